@@ -1,4 +1,5 @@
 import base64
+import hashlib
 import random
 import re
 import sys
@@ -43,7 +44,11 @@ def check_period_validity(normalized_username):
 def image_from_64(img_64, img_name, max_width):
     _format, _img_str = img_64.split(';base64,')
     decoded64_img = base64.b64decode(_img_str)
-    temporary_image = Image.open(BytesIO(decoded64_img))
+    return image_from_bytes(decoded64_img, img_name, max_width)
+
+
+def image_from_bytes(img_bytes, img_name, max_width):
+    temporary_image = Image.open(BytesIO(img_bytes))
     output = BytesIO()
     
     if temporary_image.mode != 'RGB':
@@ -61,9 +66,35 @@ def image_from_64(img_64, img_name, max_width):
     uploaded_image = InMemoryUploadedFile(output, 'VersatileImageField', "%s.jpg" % img_name.split('.')[0],
                                           'image/jpeg', sys.getsizeof(output), None)
 
+    # Stored content-addressed by images.dedup.save_image
+    uploaded_image.width, uploaded_image.height = temporary_image.size
+    uploaded_image.content_hash = content_hash(temporary_image)
+    uploaded_image.perceptual_hash = perceptual_hash(temporary_image)
+
     return uploaded_image
 
 
+def content_hash(image):
+    # sha256 of the decoded pixels, the same picture encoded differently hashes the same
+    digest = hashlib.sha256(f'{image.mode}:{image.width}x{image.height}:'.encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+def perceptual_hash(image, hash_size=8):
+    # Difference hash as 16 hex digits: each bit tells whether a pixel of a hash_size + 1 by hash_size
+    # grayscale version is brighter than its right neighbour. Recompressed or slightly edited copies
+    # of a picture keep the same hash.
+    pixels = list(image.convert('L').resize((hash_size + 1, hash_size), Image.LANCZOS).getdata())
+    bits = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            bits = bits << 1 | (left > right)
+    return f'{bits:0{hash_size * hash_size // 4}x}'
+
+
 # def image_from_64(img_64):
 # _format, _img_str = img_64.split(';base64,')
 
@@ -0,0 +1,43 @@
+from storagequeue.models import StorageDeletion
+
+from .models import ImageBlob
+
+
+def set_name(field_file, name):
+    # Points an image field at a file already in storage, like FieldFile.save does after uploading
+    field_file.name = name
+    field_file._committed = True
+    setattr(field_file.instance, field_file.field.name, name)
+
+
+def upload(field_file, uploaded_file):
+    # Stores an upload under its content hash and returns its unsaved ImageBlob
+    name = field_file.field.generate_filename(field_file.instance, f'{uploaded_file.content_hash}.jpg')
+    name = field_file.storage.save(name, uploaded_file, max_length=field_file.field.max_length)
+    set_name(field_file, name)
+    return ImageBlob(name=name, content_hash=uploaded_file.content_hash,
+                     perceptual_hash=uploaded_file.perceptual_hash, width=uploaded_file.width,
+                     height=uploaded_file.height)
+
+
+def save_image(field_file, uploaded_file, save=True):
+    """
+    Saves an upload of core.utils.image_from_bytes to an image field in place of FieldFile.save. An
+    image already stored with the same content hash is referred to instead of uploaded again, and its
+    renditions are reused since they are recorded under the same name.
+    Deleting the image through StorageDeletion.objects.enqueue_image releases the reference.
+    """
+    blob = ImageBlob.objects.matching([uploaded_file]).get(uploaded_file.content_hash)
+    if blob is not None:
+        blob = ImageBlob.objects.reference(blob)
+
+    if blob is None:
+        new_blob = upload(field_file, uploaded_file)
+        blob = ImageBlob.objects.reference(new_blob)
+        if blob.name != new_blob.name:
+            # The same image was stored by another request in between, the copy is not needed
+            StorageDeletion.objects.enqueue([new_blob.name])
+
+    set_name(field_file, blob.name)
+    if save:
+        field_file.instance.save()
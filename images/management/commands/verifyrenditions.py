@@ -0,0 +1,91 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from versatileimagefield.settings import VERSATILEIMAGEFIELD_SIZED_DIRNAME
+
+from images.models import Rendition
+from images.renditions import create_rendition, RESPONSIVE_DIRNAME
+from product.models import ProductImage
+from storagequeue.models import StorageDeletion
+
+
+def rendition_files(folder):
+    # Every file under a renditions folder of the storage
+    directories, files = default_storage.listdir(folder)
+    for name in files:
+        yield f'{folder}/{name}'
+    for directory in directories:
+        yield from rendition_files(f'{folder}/{directory}')
+
+
+class Command(BaseCommand):
+    help = 'Check that the renditions in the manifest exist in storage, several storage requests at a time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=16, help='Storage requests in flight')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Manifest rows checked per batch')
+        parser.add_argument('--fix', action='store_true',
+                            help='Create missing renditions again, or drop them from the manifest and queue them '
+                                 'for deletion when their source image is gone')
+        parser.add_argument('--orphans', action='store_true',
+                            help='Also list the rendition files in storage that are not in the manifest')
+
+    def handle(self, *args, **options):
+        checked = 0
+        missing = []
+        last_id = 0
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            while True:
+                batch = list(Rendition.objects.filter(id__gt=last_id).order_by('id')[:options['batch_size']])
+                if len(batch) == 0:
+                    break
+                last_id = batch[-1].id
+                checked += len(batch)
+
+                exists = executor.map(lambda rendition: default_storage.exists(rendition.path), batch)
+                missing += [rendition for rendition, found in zip(batch, exists) if not found]
+
+            self.stdout.write(f'Checked {checked} renditions, {len(missing)} missing from storage')
+            for rendition in missing:
+                self.stdout.write(f'Missing {rendition.path} of {rendition.source}')
+
+            if options['fix'] and missing:
+                self.fix(executor, missing)
+
+        if options['orphans']:
+            recorded = set(Rendition.objects.values_list('path', flat=True))
+            orphans = [name for folder in [VERSATILEIMAGEFIELD_SIZED_DIRNAME, RESPONSIVE_DIRNAME]
+                       for name in rendition_files(folder) if name not in recorded]
+            for name in orphans:
+                self.stdout.write(f'Not in the manifest {name}')
+            self.stdout.write(f'{len(orphans)} rendition files are not in the manifest')
+
+    def fix(self, executor, missing):
+        sources = executor.map(lambda rendition: default_storage.exists(rendition.source), missing)
+
+        recreated = []
+        dropped = []
+        for rendition, source_exists in zip(missing, sources):
+            if source_exists:
+                recreated.append(rendition)
+            else:
+                dropped.append(rendition)
+
+        def recreate(rendition):
+            # Every image field stores to the default storage, any of them renders the source
+            image = ProductImage(image=rendition.source).image
+            try:
+                return create_rendition(image, rendition.rendition_key)
+            except Exception as e:
+                self.stderr.write(f'Could not create {rendition.path}: {e}')
+                return None
+
+        created = [rendition for rendition in executor.map(recreate, recreated) if rendition is not None]
+        Rendition.objects.record(created)
+
+        StorageDeletion.objects.enqueue([rendition.path for rendition in dropped])
+        Rendition.objects.filter(id__in=[rendition.id for rendition in dropped]).delete()
+
+        self.stdout.write(f'Created {len(created)} renditions again, dropped {len(dropped)} without a source image')
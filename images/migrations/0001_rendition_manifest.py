@@ -0,0 +1,31 @@
+# Generated by Django 3.0.3 on 2026-10-19 14:18
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Rendition',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=255)),
+                ('rendition_key', models.CharField(max_length=50)),
+                ('path', models.CharField(max_length=255)),
+                ('width', models.IntegerField()),
+                ('height', models.IntegerField()),
+                ('bytes', models.IntegerField()),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'unique_together': {('source', 'rendition_key')},
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.0.3 on 2026-10-19 14:27
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0002_stored_image'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageBlob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('content_hash', models.CharField(max_length=64, unique=True)),
+                ('perceptual_hash', models.CharField(db_index=True, max_length=16)),
+                ('width', models.IntegerField()),
+                ('height', models.IntegerField()),
+                ('references', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
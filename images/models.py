@@ -0,0 +1,174 @@
+from django.db import models, transaction
+from django.db.models import F
+from django.utils.timezone import now
+
+# Size keys of the renditions listing pages show
+PRODUCT_THUMB = 'thumbnail__200x250'
+HERO_THUMB = 'thumbnail__360x270'
+
+
+def sized_name(image, rendition_key):
+    # Name versatileimagefield builds for the rendition_key rendition of image, without creating it
+    attribute, size = rendition_key.split('__')
+    return getattr(image, attribute)[size].name
+
+
+class ImageFormat:
+    # Formats of the responsive renditions, best compression first. A format is only rendered when
+    # the installed Pillow can write it, see images.renditions.available_formats
+    AVIF = 'avif'
+    WEBP = 'webp'
+    JPEG = 'jpeg'
+
+    PIL_FORMATS = {
+        AVIF: 'AVIF',
+        WEBP: 'WEBP',
+        JPEG: 'JPEG',
+    }
+    MIME_TYPES = {
+        AVIF: 'image/avif',
+        WEBP: 'image/webp',
+        JPEG: 'image/jpeg',
+    }
+
+
+class RenditionManager(models.Manager):
+    def record(self, renditions):
+        # Replaces the rows of the same source and size key
+        if not renditions:
+            return
+
+        replaced = models.Q()
+        for rendition in renditions:
+            replaced |= models.Q(source=rendition.source, rendition_key=rendition.rendition_key)
+        with transaction.atomic():
+            self.filter(replaced).delete()
+            self.bulk_create(renditions)
+
+    def recorded(self, sources):
+        # {(source, size key): Rendition} of the given source names
+        return {(rendition.source, rendition.rendition_key): rendition
+                for rendition in self.filter(source__in=list(sources))}
+
+    def paths(self, images, rendition_key, built_names=False):
+        """
+        Returns {image name: storage path} of the rendition_key renditions of images with one query.
+        Images without a recorded rendition map to the original image, which is served instead of a
+        missing file. With built_names they map to the name versatileimagefield builds instead, for
+        images whose renditions were warmed under those names before the manifest existed.
+        """
+        images = [image for image in images if image]
+        paths = dict(self.filter(source__in=[image.name for image in images], rendition_key=rendition_key)
+                     .values_list('source', 'path'))
+        return {image.name: paths.get(image.name) or (sized_name(image, rendition_key) if built_names else image.name)
+                for image in images}
+
+    def path(self, image, rendition_key, built_names=False):
+        if not image:
+            return None
+        return self.paths([image], rendition_key, built_names)[image.name]
+
+
+class Rendition(models.Model):
+    # Manifest of the renditions created in storage, written by images.renditions when they are created.
+    # Thumbnails are looked up here instead of building their names and hoping the file exists, and
+    # deleting an image removes exactly the files listed here.
+    source = models.CharField(max_length=255)
+    rendition_key = models.CharField(max_length=50)
+    path = models.CharField(max_length=255)
+    width = models.IntegerField()
+    height = models.IntegerField()
+    bytes = models.IntegerField()
+    created_at = models.DateTimeField(default=now)
+
+    objects = RenditionManager()
+
+    class Meta:
+        unique_together = ['source', 'rendition_key']
+
+    def __str__(self):
+        return self.path
+
+
+class StoredImageManager(models.Manager):
+    def record(self, stored_images):
+        # Replaces the rows of the same names
+        with transaction.atomic():
+            self.filter(name__in=[stored_image.name for stored_image in stored_images]).delete()
+            self.bulk_create(stored_images)
+
+
+class StoredImage(models.Model):
+    # Size and blurred placeholder of an uploaded image, written with its responsive renditions
+    name = models.CharField(max_length=255, unique=True)
+    width = models.IntegerField()
+    height = models.IntegerField()
+    # data: URI of a tiny version, shown while the image loads
+    placeholder = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=now)
+
+    objects = StoredImageManager()
+
+    def __str__(self):
+        return self.name
+
+
+class ImageBlobManager(models.Manager):
+    def matching(self, uploaded_files):
+        """
+        Returns {content hash: ImageBlob} of the uploads of core.utils.image_from_bytes that are stored
+        already, with one query. Only the same content hash matches: the perceptual hash also matches
+        colour variants or edited labels of a picture, so it is never used to share a file.
+        """
+        return {blob.content_hash: blob for blob in
+                self.filter(content_hash__in=[uploaded_file.content_hash for uploaded_file in uploaded_files])}
+
+    def reference(self, blob, count=1):
+        """
+        Adds count references to blob, saving it when it is new. Returns the blob the
+        image field refers to: another one when the same content was stored by another request in
+        between, and None when blob was released in between and its files are queued for deletion.
+        """
+        if blob.pk is not None:
+            return blob if self.filter(pk=blob.pk).update(references=F('references') + count) else None
+
+        with transaction.atomic():
+            stored, created = self.get_or_create(content_hash=blob.content_hash, defaults={
+                'name': blob.name, 'perceptual_hash': blob.perceptual_hash, 'width': blob.width,
+                'height': blob.height, 'references': count,
+            })
+            if not created:
+                self.filter(pk=stored.pk).update(references=F('references') + count)
+        return stored
+
+    def release(self, name):
+        """
+        Drops a reference to the stored original name. Returns True when nothing refers to it anymore
+        and its files can be deleted, which is always the case for images stored before deduplication.
+        """
+        while True:
+            if self.filter(name=name, references__gt=1).update(references=F('references') - 1):
+                return False
+            deleted, _ = self.filter(name=name, references__lte=1).delete()
+            # A reference added between both queries is released on the next pass
+            if deleted or not self.filter(name=name).exists():
+                return True
+
+
+class ImageBlob(models.Model):
+    # An uploaded original stored under its content hash, see images.dedup. Image fields holding the
+    # same picture share the stored file and its renditions, the files are deleted with the last
+    # reference.
+    name = models.CharField(max_length=255, unique=True)
+    content_hash = models.CharField(max_length=64, unique=True)
+    # Near duplicates share it, kept for reports and manual review, see ImageBlobManager.matching
+    perceptual_hash = models.CharField(max_length=16, db_index=True)
+    width = models.IntegerField()
+    height = models.IntegerField()
+    references = models.IntegerField(default=0)
+    created_at = models.DateTimeField(default=now)
+
+    objects = ImageBlobManager()
+
+    def __str__(self):
+        return self.name
@@ -0,0 +1,230 @@
+import base64
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image
+from versatileimagefield.utils import get_rendition_key_set, get_resized_path
+
+from .models import Rendition, StoredImage, ImageFormat
+
+try:
+    # Registers AVIF with Pillow versions that can not write it themselves
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
+
+RESPONSIVE_DIRNAME = '__responsive__'
+SAVE_OPTIONS = {
+    ImageFormat.AVIF: {'quality': 50},
+    ImageFormat.WEBP: {'quality': 75, 'method': 4},
+    ImageFormat.JPEG: {'quality': 75, 'optimize': True, 'progressive': True},
+}
+# Longest side of the placeholder, it is blown up and blurred by the client
+PLACEHOLDER_SIZE = 16
+
+
+def size_keys(rendition_key_set):
+    return [size_key for key, size_key in get_rendition_key_set(rendition_key_set) if size_key != 'url']
+
+
+def available_formats():
+    # Responsive formats the installed Pillow can write, best compression first
+    Image.init()
+    return [image_format for image_format, pil_format in ImageFormat.PIL_FORMATS.items() if pil_format in Image.SAVE]
+
+
+def responsive_widths(rendition_key_set, source_width):
+    # Widths of RESPONSIVE_IMAGE_WIDTHS, an image is never scaled up
+    widths = settings.RESPONSIVE_IMAGE_WIDTHS.get(rendition_key_set, [])
+    return sorted({min(width, source_width) for width in widths})
+
+
+def responsive_path(name, width, image_format):
+    folder, filename = os.path.split(name)
+    basename, ext = os.path.splitext(filename)
+    return f'{RESPONSIVE_DIRNAME}/{folder}/{basename}-{width}w.{image_format}'
+
+
+def open_source(image):
+    with image.storage.open(image.name, 'rb') as source_file:
+        source = Image.open(source_file)
+        source.load()
+    return source if source.mode == 'RGB' else source.convert('RGB')
+
+
+def resize(source, width):
+    if width >= source.width:
+        return source
+    height = max(1, round(source.height * width / source.width))
+    return source.resize((width, height), Image.LANCZOS)
+
+
+def placeholder(source):
+    # data: URI of a PLACEHOLDER_SIZE version of the image
+    small = source.copy()
+    small.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+    image_format = ImageFormat.WEBP if ImageFormat.WEBP in available_formats() else ImageFormat.JPEG
+
+    output = BytesIO()
+    small.save(output, format=ImageFormat.PIL_FORMATS[image_format], quality=30)
+    return f'data:{ImageFormat.MIME_TYPES[image_format]};base64,{base64.b64encode(output.getvalue()).decode()}'
+
+
+def save_responsive_rendition(image, resized, image_format, width):
+    output = BytesIO()
+    resized.save(output, format=ImageFormat.PIL_FORMATS[image_format], **SAVE_OPTIONS[image_format])
+    content = output.getvalue()
+    path = image.storage.save(responsive_path(image.name, width, image_format), ContentFile(content))
+    return Rendition(source=image.name, rendition_key=f'{image_format}__{width}w', path=path, width=resized.width,
+                     height=resized.height, bytes=len(content))
+
+
+def create_rendition(image, size_key):
+    """
+    Creates the size_key rendition of a VersatileImageField image and returns its unsaved manifest
+    Rendition. Size keys are versatileimagefield ones, like thumbnail__200x250, or responsive ones,
+    like webp__480w. A versatileimagefield rendition already in storage, created before the manifest,
+    is read instead of created again.
+    Never touches the database, so it can run in worker threads.
+    """
+    method, size = size_key.split('__')
+    if method in ImageFormat.PIL_FORMATS:
+        width = int(size[:-1])
+        return save_responsive_rendition(image, resize(open_source(image), width), method, width)
+
+    width, height = [int(i) for i in size.split('x')]
+    sized = getattr(image, method)
+    storage = image.storage
+    path = get_resized_path(path_to_image=image.name, width=width, height=height,
+                            filename_key=sized.get_filename_key(), storage=storage)
+
+    if storage.exists(path):
+        with storage.open(path, 'rb') as rendition_file:
+            content = rendition_file.read()
+    else:
+        source, file_ext, image_format, mime_type = sized.retrieve_image(image.name)
+        source, save_kwargs = sized.preprocess(source, image_format)
+        image_file = sized.process_image(image=source, image_format=image_format, save_kwargs=save_kwargs,
+                                         width=width, height=height)
+        content = image_file.getvalue()
+        sized.save_image(image_file, path, file_ext, mime_type)
+
+    rendition_width, rendition_height = Image.open(BytesIO(content)).size
+    return Rendition(source=image.name, rendition_key=size_key, path=path, width=rendition_width,
+                     height=rendition_height, bytes=len(content))
+
+
+def create_responsive_renditions(image, rendition_key_set, recorded, stored_image=None):
+    """
+    Creates the RESPONSIVE_IMAGE_WIDTHS renditions of image in every available format, decoding the
+    source once and resizing it once per width. Returns an unsaved StoredImage, None when stored_image
+    is given, and the unsaved Renditions missing from `recorded`.
+    """
+    formats = available_formats()
+    if stored_image is not None:
+        missing = [(width, image_format) for width in responsive_widths(rendition_key_set, stored_image.width)
+                   for image_format in formats if (image.name, f'{image_format}__{width}w') not in recorded]
+        if not missing:
+            return None, []
+
+    source = open_source(image)
+    new_stored_image = None
+    if stored_image is None:
+        new_stored_image = StoredImage(name=image.name, width=source.width, height=source.height,
+                                       placeholder=placeholder(source))
+
+    renditions = []
+    for width in responsive_widths(rendition_key_set, source.width):
+        resized = None
+        for image_format in formats:
+            if (image.name, f'{image_format}__{width}w') in recorded:
+                continue
+            if resized is None:
+                resized = resize(source, width)
+            renditions.append(save_responsive_rendition(image, resized, image_format, width))
+
+    return new_stored_image, renditions
+
+
+def create_renditions(image, rendition_key_set, recorded=None, stored_image=None, thumbnails=True):
+    """
+    Creates the renditions of image missing from `recorded`: the rendition_key_set thumbnails, unless
+    thumbnails is False, and the responsive renditions. Returns an unsaved StoredImage, or None when
+    stored_image is given, and the unsaved Renditions.
+    """
+    if not image:
+        return None, []
+
+    recorded = recorded or {}
+    renditions = []
+    if thumbnails:
+        renditions += [create_rendition(image, size_key) for size_key in size_keys(rendition_key_set)
+                       if (image.name, size_key) not in recorded]
+
+    new_stored_image, responsive = create_responsive_renditions(image, rendition_key_set, recorded, stored_image)
+    return new_stored_image, renditions + responsive
+
+
+def warm_renditions(images, rendition_key_set, thumbnails=True):
+    """
+    Creates and records the renditions of the images that are not in the manifest yet.
+    Returns the number of renditions created and the names of the images that failed.
+    """
+    images = [image for image in images if image]
+    names = [image.name for image in images]
+    recorded = Rendition.objects.recorded(names)
+    stored_images = StoredImage.objects.in_bulk(names, field_name='name')
+
+    created = 0
+    failed = []
+    for image in images:
+        try:
+            new_stored_image, renditions = create_renditions(image, rendition_key_set, recorded,
+                                                             stored_images.get(image.name), thumbnails)
+        except Exception:
+            failed.append(image.name)
+            continue
+
+        Rendition.objects.record(renditions)
+        if new_stored_image is not None:
+            StoredImage.objects.record([new_stored_image])
+        created += len(renditions)
+
+    return created, failed
+
+
+def responsive_images(names):
+    """
+    Returns {name: {name, src, width, height, placeholder, sources}} of images for <picture> elements, with
+    two queries for all of them. sources holds a {type, srcset} per format, best compression first. src
+    is the widest JPEG rendition, the original without one. Paths are storage names, like the thumbnails.
+    """
+    names = list(dict.fromkeys(name for name in names if name))
+    stored_images = StoredImage.objects.in_bulk(names, field_name='name')
+    by_name = {}
+    for rendition in Rendition.objects.filter(source__in=names).order_by('width'):
+        image_format = rendition.rendition_key.split('__')[0]
+        if image_format in ImageFormat.PIL_FORMATS:
+            by_name.setdefault(rendition.source, {}).setdefault(image_format, []).append(rendition)
+
+    images = {}
+    for name in names:
+        stored_image = stored_images.get(name)
+        by_format = by_name.get(name, {})
+        sources = [{'type': ImageFormat.MIME_TYPES[image_format],
+                    'srcset': ', '.join(f'{rendition.path} {rendition.width}w'
+                                        for rendition in by_format[image_format])}
+                   for image_format in ImageFormat.PIL_FORMATS if image_format in by_format]
+        jpegs = by_format.get(ImageFormat.JPEG)
+
+        images[name] = {
+            'name': name,
+            'src': jpegs[-1].path if jpegs else name,
+            'width': stored_image.width if stored_image else None,
+            'height': stored_image.height if stored_image else None,
+            'placeholder': stored_image.placeholder if stored_image else None,
+            'sources': sources,
+        }
+    return images
@@ -0,0 +1,184 @@
+import hashlib
+import os
+import tempfile
+import time
+from io import BytesIO
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.signing import Signer
+from django.urls import reverse
+from django.utils.crypto import constant_time_compare
+from PIL import Image
+
+from .models import Rendition, ImageFormat
+from .renditions import available_formats, resize, SAVE_OPTIONS
+
+# Largest width or height the endpoint renders, bigger requests are refused
+MAX_DIMENSION = 2000
+# Share of IMAGE_RESIZE_CACHE_BYTES kept after an eviction, so every write does not evict again
+EVICT_TO = 0.9
+
+signer = Signer(salt='images.resize')
+
+
+def params_value(key, width, height, image_format):
+    return f'{key}:{width}:{height or 0}:{image_format}'
+
+
+def resize_url(key, width, height=None, image_format=ImageFormat.WEBP):
+    # Signed URL of the resize endpoint, only URLs built here are rendered
+    params = {'key': key, 'w': width, 'h': height or 0, 'f': image_format}
+    params['s'] = signer.signature(params_value(key, width, height, image_format))
+    return f'{reverse("resize_image")}?{urlencode(params)}'
+
+
+def verify(key, width, height, image_format, signature):
+    return constant_time_compare(signer.signature(params_value(key, width, height, image_format)), signature)
+
+
+class DiskLRUCache:
+    """
+    Size-bounded cache of rendered images on the local disk, shared by every worker of the instance.
+    Reading an entry sets its access time, and entries read least recently are evicted once the
+    directory grows past max_bytes. Modification times are left alone, they are the Last-Modified of
+    the entries.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # Bytes written since the directory was last measured, added to its measured size
+        self.size = None
+
+    def path(self, name):
+        digest = hashlib.sha256(name.encode()).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def get(self, name):
+        # (content, modification time) of the entry, or None. Entries are read here, since another
+        # worker may evict them at any time.
+        path = self.path(name)
+        try:
+            with open(path, 'rb') as entry_file:
+                content = entry_file.read()
+                modified = os.fstat(entry_file.fileno()).st_mtime
+            os.utime(path, (time.time(), modified))
+        except FileNotFoundError:
+            return None
+        return content, modified
+
+    def set(self, name, content):
+        # Written to a temporary file and renamed, so readers never see a partial entry
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                temp_file.write(content)
+            os.replace(temp_path, path)
+        except Exception:
+            os.remove(temp_path)
+            raise
+
+        if self.size is not None:
+            self.size += len(content)
+        if self.size is None or self.size > self.max_bytes:
+            self.evict()
+
+    def entries(self):
+        for folder in os.scandir(self.directory):
+            if not folder.is_dir():
+                continue
+            for entry in os.scandir(folder.path):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                yield entry.path, stat.st_atime, stat.st_size
+
+    def evict(self):
+        entries = sorted(self.entries(), key=lambda entry: entry[1])
+        total = sum(size for path, accessed, size in entries)
+        if total > self.max_bytes:
+            for path, accessed, size in entries:
+                if total <= self.max_bytes * EVICT_TO:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+        self.size = total
+
+
+cache = DiskLRUCache(settings.IMAGE_RESIZE_CACHE_DIR, settings.IMAGE_RESIZE_CACHE_BYTES)
+
+
+def warm_rendition(key, width, height, image_format):
+    # Path of a recorded responsive rendition of the same width and format, only for width-only requests
+    if height:
+        return None
+    rendition = Rendition.objects.filter(source=key, rendition_key=f'{image_format}__{width}w').first()
+    return rendition.path if rendition else None
+
+
+def render(key, width, height, image_format, storage=default_storage):
+    """
+    Renders the key image to fit in width x height, or width alone when height is 0, without scaling it
+    up. JPEG sources are decoded in draft mode, at the smallest power of two scale still larger than the
+    requested size, which skips most of the decoding of large photos.
+    """
+    with storage.open(key, 'rb') as source_file:
+        source = Image.open(source_file)
+        box = (width, height or round(source.height * width / source.width) or 1)
+        source.draft('RGB', box)
+        source.load()
+    if source.mode != 'RGB':
+        source = source.convert('RGB')
+
+    if height:
+        resized = source.copy()
+        resized.thumbnail(box, Image.LANCZOS)
+    else:
+        resized = resize(source, width)
+
+    output = BytesIO()
+    resized.save(output, format=ImageFormat.PIL_FORMATS[image_format], **SAVE_OPTIONS[image_format])
+    return output.getvalue()
+
+
+def resized_image(key, width, height, image_format, storage=default_storage):
+    """
+    Returns the content and the modification time of the key image resized to width x height in
+    image_format, from the cache or stored in it. A warm rendition in storage is copied into the
+    cache instead of rendering the image again.
+    """
+    name = params_value(key, width, height, image_format)
+    cached = cache.get(name)
+    if cached is not None:
+        return cached
+
+    rendition_path = warm_rendition(key, width, height, image_format)
+    content = None
+    if rendition_path is not None:
+        try:
+            with storage.open(rendition_path, 'rb') as rendition_file:
+                content = rendition_file.read()
+        except (FileNotFoundError, OSError):
+            # verifyrenditions reports missing renditions, render this one instead
+            content = None
+    if content is None:
+        content = render(key, width, height, image_format, storage)
+    cache.set(name, content)
+    return content, time.time()
+
+
+def check_params(width, height, image_format):
+    # Error message of invalid resize params, or None
+    if not 0 < width <= MAX_DIMENSION or not 0 <= height <= MAX_DIMENSION:
+        return f'Width and height must be at most {MAX_DIMENSION}'
+    if image_format not in available_formats():
+        return f'Format must be one of {", ".join(available_formats())}'
+    return None
@@ -0,0 +1,77 @@
+import graphene
+from promise import Promise
+from promise.dataloader import DataLoader
+
+from .models import ImageFormat, Rendition
+from .renditions import responsive_images
+from .resize import check_params, resize_url
+
+
+class ImageSourceType(graphene.ObjectType):
+    # A <source> of a <picture> element
+    type = graphene.String()
+    srcset = graphene.String()
+
+
+class ResponsiveImageType(graphene.ObjectType):
+    src = graphene.String()
+    width = graphene.Int()
+    height = graphene.Int()
+    placeholder = graphene.String()
+    # Best compression first, see images.renditions.responsive_images
+    sources = graphene.List(ImageSourceType)
+    # Signed URL of the images/resize/ endpoint rendering the image at another size
+    resized_url = graphene.String(width=graphene.Int(required=True), height=graphene.Int(),
+                                  format=graphene.String())
+
+    def resolve_resized_url(self, info, width, height=None, **kwargs):
+        image_format = kwargs.get('format') or ImageFormat.WEBP
+        error = check_params(width, height or 0, image_format)
+        if error is not None:
+            raise Exception(error)
+        return resize_url(self['name'], width, height, image_format)
+
+
+class ResponsiveImageLoader(DataLoader):
+    # Responsive images of the image names a request resolves, two queries per batch
+    def batch_load_fn(self, names):
+        images = responsive_images(names)
+        return Promise.resolve([images[name] for name in names])
+
+
+class RenditionPathLoader(DataLoader):
+    # Storage paths of one rendition key of the images a request resolves, one query per batch
+    def __init__(self, rendition_key, built_names=False):
+        super().__init__(get_cache_key=lambda image: image.name)
+        self.rendition_key = rendition_key
+        self.built_names = built_names
+
+    def batch_load_fn(self, images):
+        paths = Rendition.objects.paths(images, self.rendition_key, self.built_names)
+        return Promise.resolve([paths[image.name] for image in images])
+
+
+def load_rendition_path(info, image, rendition_key, built_names=False):
+    # Promise of Rendition.objects.path, batched per request like load_responsive_image
+    if not image:
+        return None
+    loaders = getattr(info.context, 'rendition_path_loaders', None)
+    if loaders is None:
+        loaders = info.context.rendition_path_loaders = {}
+    loader = loaders.get((rendition_key, built_names))
+    if loader is None:
+        loader = loaders[rendition_key, built_names] = RenditionPathLoader(rendition_key, built_names)
+    return loader.load(image)
+
+
+def load_responsive_image(info, image):
+    """
+    Returns a promise of the responsive image of image, or None. Lookups of a request are batched, so
+    a listing asking for responsive images makes two queries instead of two per row.
+    """
+    if not image:
+        return None
+    loader = getattr(info.context, 'responsive_image_loader', None)
+    if loader is None:
+        loader = info.context.responsive_image_loader = ResponsiveImageLoader()
+    return loader.load(image.name)
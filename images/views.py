@@ -0,0 +1,87 @@
+import hashlib
+import re
+
+from django.http import HttpResponse, JsonResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import require_GET
+
+from .models import ImageFormat
+from .resize import check_params, resized_image, verify
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+# Resized images of a signed URL never change, the source key is never overwritten
+CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def byte_range(header, length):
+    """
+    Returns the (start, end) of a single `Range: bytes=` header, None to serve the whole image, or
+    False when the range is not satisfiable. Multiple ranges are answered with the whole image.
+    """
+    match = RANGE_RE.match(header.strip())
+    if match is None:
+        return None
+    start, end = match.groups()
+    if start == '' and end == '':
+        return None
+    if start == '':
+        # Suffix range, the last `end` bytes
+        suffix = int(end)
+        if suffix == 0:
+            return False
+        return max(0, length - suffix), length - 1
+    start = int(start)
+    end = min(int(end), length - 1) if end else length - 1
+    if start >= length or start > end:
+        return False
+    return start, end
+
+
+@require_GET
+def resize_image(request):
+    params = request.GET
+    key = params.get('key', '')
+    try:
+        width = int(params.get('w', 0))
+        height = int(params.get('h', 0))
+    except ValueError:
+        return JsonResponse({'error': 'Width and height must be numbers'}, status=400)
+    image_format = params.get('f', ImageFormat.WEBP)
+
+    if not key or not verify(key, width, height, image_format, params.get('s', '')):
+        return JsonResponse({'error': 'Invalid signature'}, status=403)
+    error = check_params(width, height, image_format)
+    if error is not None:
+        return JsonResponse({'error': error}, status=400)
+
+    try:
+        content, modified = resized_image(key, width, height, image_format)
+    except FileNotFoundError:
+        return JsonResponse({'error': 'Image not found'}, status=404)
+
+    etag = quote_etag(hashlib.md5(content).hexdigest())
+    last_modified = int(modified)
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = HttpResponse(content, content_type=ImageFormat.MIME_TYPES[image_format])
+        range_header = request.META.get('HTTP_RANGE')
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if range_header and (if_range is None or if_range == etag):
+            length = len(content)
+            requested = byte_range(range_header, length)
+            if requested is False:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = f'bytes */{length}'
+            elif requested is not None:
+                start, end = requested
+                response = HttpResponse(content[start:end + 1], status=206,
+                                        content_type=ImageFormat.MIME_TYPES[image_format])
+                response['Content-Range'] = f'bytes {start}-{end}/{length}'
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Accept-Ranges'] = 'bytes'
+    response['Cache-Control'] = CACHE_CONTROL
+    return response
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from mailqueue.sender import EmailSender
+
+
+class Command(BaseCommand):
+    help = 'Send the queued emails in batches over one SMTP connection. Point EMAIL_HOST and EMAIL_PORT at ' \
+           'a local sink, like python -m aiosmtpd -n -l localhost:1025, to try it out without sending mail'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50, help='Emails claimed per transaction')
+        parser.add_argument('--run-for', type=int, default=0,
+                            help='Keep polling for new emails for this many seconds, by default send what is '
+                                 'queued and exit')
+        parser.add_argument('--interval', type=float, default=2, help='Seconds between polls when idle')
+
+    def handle(self, *args, **options):
+        sender = EmailSender()
+        stop_at = time.monotonic() + options['run_for']
+        sent = 0
+
+        try:
+            while True:
+                claimed = sender.send_batch(options['batch_size'])
+                sent += claimed
+                if claimed:
+                    continue
+                if time.monotonic() + options['interval'] >= stop_at:
+                    break
+                time.sleep(options['interval'])
+        finally:
+            sender.close()
+
+        self.stdout.write(f'Processed {sent} queued emails')
@@ -0,0 +1,50 @@
+from django.contrib.postgres.fields import ArrayField, JSONField
+from django.db import models
+from django.utils.timezone import now
+
+
+class EmailStatus:
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+
+    CHOICES = [
+        (PENDING, 'Pending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    ]
+
+
+class OutboundEmailManager(models.Manager):
+    def enqueue(self, subject, message, recipient_list, html_template=None, context=None, from_email=None):
+        # The html body is rendered from html_template and context by the sender, not in the request
+        return self.create(subject=subject, message=message, recipients=recipient_list, from_email=from_email,
+                           html_template=html_template, context=context or {})
+
+
+class OutboundEmail(models.Model):
+    # Emails waiting to be sent by the sendqueuedemails command, see mailqueue.sender
+    subject = models.CharField(max_length=255)
+    message = models.TextField()
+    html_template = models.CharField(max_length=100, null=True, blank=True)
+    context = JSONField(default=dict, blank=True)
+    from_email = models.CharField(max_length=255, null=True, blank=True)
+    recipients = ArrayField(models.EmailField())
+    status = models.CharField(max_length=10, choices=EmailStatus.CHOICES, default=EmailStatus.PENDING)
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=now)
+    last_error = models.TextField(null=True, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    objects = OutboundEmailManager()
+
+    class Meta:
+        indexes = [
+            # Only pending emails are ever polled
+            models.Index(fields=['next_attempt_at'], name='outboundemail_pending',
+                         condition=models.Q(status=EmailStatus.PENDING)),
+        ]
+
+    def __str__(self):
+        return f'{self.subject} to {", ".join(self.recipients)}'
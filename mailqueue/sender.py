@@ -0,0 +1,81 @@
+from datetime import timedelta
+from smtplib import SMTPServerDisconnected
+
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.utils.timezone import now
+
+from .models import OutboundEmail, EmailStatus
+
+MAX_ATTEMPTS = 6
+# Seconds before the first retry, doubled for every further attempt
+RETRY_BACKOFF = 30
+
+
+class EmailSender:
+    """
+    Sends queued emails over one SMTP connection, which stays open across batches and is only reopened
+    after the server drops it. Batches are claimed with SKIP LOCKED, so several senders never pick up
+    the same email.
+    """
+
+    def __init__(self):
+        self.connection = None
+
+    def open(self):
+        if self.connection is None:
+            self.connection = get_connection()
+            self.connection.open()
+        return self.connection
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+
+    def send(self, outbound_email):
+        email = EmailMultiAlternatives(outbound_email.subject, outbound_email.message, outbound_email.from_email,
+                                       outbound_email.recipients)
+        if outbound_email.html_template:
+            email.attach_alternative(render_to_string(outbound_email.html_template, outbound_email.context),
+                                     'text/html')
+
+        try:
+            email.connection = self.open()
+            email.send()
+        except SMTPServerDisconnected:
+            # A connection idle for too long is dropped by the server, sent again on a new one
+            self.close()
+            email.connection = self.open()
+            email.send()
+
+    def send_batch(self, batch_size=50):
+        # Returns the number of emails claimed
+        with transaction.atomic():
+            batch = list(OutboundEmail.objects.select_for_update(skip_locked=True)
+                         .filter(status=EmailStatus.PENDING, next_attempt_at__lte=now())
+                         .order_by('next_attempt_at')[:batch_size])
+
+            for outbound_email in batch:
+                outbound_email.attempts += 1
+                try:
+                    self.send(outbound_email)
+                    outbound_email.status = EmailStatus.SENT
+                    outbound_email.sent_at = now()
+                except Exception as e:
+                    self.close()
+                    outbound_email.last_error = str(e)
+                    if outbound_email.attempts >= MAX_ATTEMPTS:
+                        outbound_email.status = EmailStatus.FAILED
+                    else:
+                        delay = RETRY_BACKOFF * 2 ** (outbound_email.attempts - 1)
+                        outbound_email.next_attempt_at = now() + timedelta(seconds=delay)
+
+            OutboundEmail.objects.bulk_update(batch, ['status', 'attempts', 'next_attempt_at', 'last_error',
+                                                      'sent_at'])
+
+        return len(batch)
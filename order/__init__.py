@@ -8,6 +8,9 @@ class OrderStatus:
     FULFILLED = "fulfilled"
     CANCELED = "canceled"
 
+    # Orders still waiting on the shop. Used by the shop order inbox and its partial index
+    OPEN = [UNFULFILLED, PARTIALLY_FULFILLED]
+
     CHOICES = [
         (
             DRAFT,
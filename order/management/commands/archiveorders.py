@@ -0,0 +1,39 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils.timezone import now
+
+from order import OrderStatus
+from order.models import Order, ShopOrderLine
+
+
+class Command(BaseCommand):
+    help = 'Move fulfilled and canceled orders older than the given number of days to the order archive'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90, help='Archive orders created more than this many days ago')
+        parser.add_argument('--batch-size', type=int, default=500, help='Orders moved per transaction')
+
+    def handle(self, *args, **options):
+        created_before = now() - timedelta(days=options['days'])
+        batch_size = options['batch_size']
+
+        # An order is done when none of its shop orders is still open, ie all are fulfilled or canceled
+        open_shop_orders = ShopOrderLine.objects.filter(order=OuterRef('pk'), status__in=OrderStatus.OPEN)
+        done_orders = Order.objects.filter(~Exists(open_shop_orders), created__lt=created_before).order_by('id')
+
+        archived = 0
+        while True:
+            with transaction.atomic():
+                order_ids = list(done_orders.select_for_update(skip_locked=True).values_list('id', flat=True)[:batch_size])
+                if len(order_ids) == 0:
+                    break
+
+                Order.objects.archive(order_ids)
+
+            archived += len(order_ids)
+            self.stdout.write(f'Archived {archived} orders')
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully archived {archived} orders'))
@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+
+from order import OrderStatus
+from order.models import ShopDailySales, ShopDailyProductSales, ShopOrderLineHistory, OrderItemHistory
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the shop daily sales rollups from the hot and archived orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shop', type=int, help='Only rebuild the rollups of this shop id')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rollup rows inserted per query')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        # The history views cover the archive too, so rollups of archived orders survive a rebuild
+        shop_orders = ShopOrderLineHistory.objects.exclude(status=OrderStatus.CANCELED).filter(shop__isnull=False)
+        order_items = OrderItemHistory.objects.exclude(shop_order__status=OrderStatus.CANCELED) \
+            .filter(shop_order__shop__isnull=False)
+        daily_sales = ShopDailySales.objects.all()
+        daily_product_sales = ShopDailyProductSales.objects.all()
+
+        if options['shop'] is not None:
+            shop_orders = shop_orders.filter(shop_id=options['shop'])
+            order_items = order_items.filter(shop_order__shop_id=options['shop'])
+            daily_sales = daily_sales.filter(shop_id=options['shop'])
+            daily_product_sales = daily_product_sales.filter(shop_id=options['shop'])
+
+        days = shop_orders.annotate(day=TruncDate('created')) \
+            .values('shop_id', 'day') \
+            .annotate(orders_count=Count('id'), items_count=Coalesce(Sum('total_items'), 0),
+                      revenue_total=Coalesce(Sum('total'), 0)) \
+            .order_by()
+
+        product_days = order_items.annotate(shop_id=F('shop_order__shop_id'),
+                                            day=TruncDate('shop_order__created'),
+                                            title=Coalesce('product_title', Value(''))) \
+            .values('shop_id', 'day', 'title') \
+            .annotate(quantity_total=Sum('quantity'),
+                      revenue_total=Sum(ExpressionWrapper(F('quantity') * F('unit_price'),
+                                                          output_field=DecimalField()))) \
+            .order_by()
+
+        with transaction.atomic():
+            daily_sales.delete()
+            daily_product_sales.delete()
+
+            ShopDailySales.objects.bulk_create(
+                (ShopDailySales(shop_id=row['shop_id'], day=row['day'], orders=row['orders_count'],
+                                items=row['items_count'], revenue=row['revenue_total'])
+                 for row in days.iterator()),
+                batch_size=batch_size
+            )
+            ShopDailyProductSales.objects.bulk_create(
+                (ShopDailyProductSales(shop_id=row['shop_id'], day=row['day'], product_title=row['title'],
+                                       quantity=row['quantity_total'], revenue=row['revenue_total'])
+                 for row in product_days.iterator()),
+                batch_size=batch_size
+            )
+
+        self.stdout.write(self.style.SUCCESS('Successfully rebuilt shop sales rollups'))
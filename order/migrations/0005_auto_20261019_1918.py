@@ -0,0 +1,32 @@
+# Generated by Django 3.0.3 on 2026-10-19 13:48
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0004_auto_20200128_2159'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shoporderline',
+            name='created',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.RunSQL(
+            sql='UPDATE order_shoporderline SET created = order_order.created '
+                'FROM order_order WHERE order_order.id = order_shoporderline.order_id',
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name='shoporderline',
+            index=models.Index(fields=['shop', 'status', 'created'], name='shoporder_shop_status_created'),
+        ),
+        migrations.AddIndex(
+            model_name='shoporderline',
+            index=models.Index(condition=models.Q(status__in=['unfulfilled', 'partially fulfilled']), fields=['shop', 'created'], name='shoporder_open_inbox'),
+        ),
+    ]
@@ -0,0 +1,123 @@
+# Generated by Django 3.0.3 on 2026-10-19 13:50
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+ORDER_COLUMNS = 'id, created, reference_id, user_id, status, user_email, user_phone, user_full_name, total, total_items'
+SHOP_ORDER_COLUMNS = 'id, order_id, status, shop_id, client_tracking_id, total, total_items, created'
+ORDER_ITEM_COLUMNS = 'id, shop_order_id, product_title, shop_product_id, combo_id, quantity, unit_price'
+
+
+def history_view(view, hot_table, archive_table, columns):
+    return migrations.RunSQL(
+        sql=f'CREATE VIEW {view} AS SELECT {columns} FROM {hot_table} '
+            f'UNION ALL SELECT {columns} FROM {archive_table}',
+        reverse_sql=f'DROP VIEW {view}',
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('shop', '0017_auto_20200311_1030'),
+        ('order', '0005_auto_20261019_1918'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderHistory',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField()),
+                ('reference_id', models.CharField(max_length=18)),
+                ('status', models.CharField(choices=[('draft', 'Draft'), ('unfulfilled', 'Unfulfilled'), ('partially fulfilled', 'Partially fulfilled'), ('fulfilled', 'Fulfilled'), ('canceled', 'Canceled')], max_length=32)),
+                ('user_email', models.EmailField(max_length=254)),
+                ('user_phone', models.CharField(max_length=10)),
+                ('user_full_name', models.CharField(max_length=100)),
+                ('total', models.DecimalField(decimal_places=2, max_digits=9)),
+                ('total_items', models.IntegerField()),
+            ],
+            options={
+                'db_table': 'order_orderhistory',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='OrderItemHistory',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_title', models.CharField(blank=True, max_length=255, null=True)),
+                ('quantity', models.IntegerField()),
+                ('unit_price', models.DecimalField(decimal_places=2, max_digits=9)),
+            ],
+            options={
+                'db_table': 'order_orderitemhistory',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ShopOrderLineHistory',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('draft', 'Draft'), ('unfulfilled', 'Unfulfilled'), ('partially fulfilled', 'Partially fulfilled'), ('fulfilled', 'Fulfilled'), ('canceled', 'Canceled')], max_length=32)),
+                ('client_tracking_id', models.CharField(max_length=12)),
+                ('total', models.DecimalField(blank=True, decimal_places=2, max_digits=9, null=True)),
+                ('total_items', models.IntegerField()),
+                ('created', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'order_shoporderlinehistory',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('created', models.DateTimeField(db_index=True)),
+                ('reference_id', models.CharField(default='', max_length=18)),
+                ('status', models.CharField(choices=[('draft', 'Draft'), ('unfulfilled', 'Unfulfilled'), ('partially fulfilled', 'Partially fulfilled'), ('fulfilled', 'Fulfilled'), ('canceled', 'Canceled')], max_length=32)),
+                ('user_email', models.EmailField(blank=True, default='', max_length=254)),
+                ('user_phone', models.CharField(max_length=10)),
+                ('user_full_name', models.CharField(max_length=100)),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=9)),
+                ('total_items', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_orders', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedShopOrderLine',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('draft', 'Draft'), ('unfulfilled', 'Unfulfilled'), ('partially fulfilled', 'Partially fulfilled'), ('fulfilled', 'Fulfilled'), ('canceled', 'Canceled')], max_length=32)),
+                ('client_tracking_id', models.CharField(max_length=12)),
+                ('total', models.DecimalField(blank=True, decimal_places=2, max_digits=9, null=True)),
+                ('total_items', models.IntegerField(default=0)),
+                ('created', models.DateTimeField()),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shop_orders', to='order.ArchivedOrder')),
+                ('shop', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='archived_orders', to='shop.Shop')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedOrderItem',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('product_title', models.CharField(blank=True, max_length=255, null=True)),
+                ('quantity', models.IntegerField()),
+                ('unit_price', models.DecimalField(decimal_places=2, max_digits=9)),
+                ('combo', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='shop.Combo')),
+                ('shop_order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_items', to='order.ArchivedShopOrderLine')),
+                ('shop_product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='shop.ShopProduct')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='archivedshoporderline',
+            index=models.Index(fields=['shop', 'created'], name='archivedshoporder_shop_created'),
+        ),
+        history_view('order_orderhistory', 'order_order', 'order_archivedorder', ORDER_COLUMNS),
+        history_view('order_shoporderlinehistory', 'order_shoporderline', 'order_archivedshoporderline',
+                     SHOP_ORDER_COLUMNS),
+        history_view('order_orderitemhistory', 'order_orderitem', 'order_archivedorderitem', ORDER_ITEM_COLUMNS),
+    ]
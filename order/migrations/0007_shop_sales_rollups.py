@@ -0,0 +1,43 @@
+# Generated by Django 3.0.3 on 2026-10-19 13:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0017_auto_20200311_1030'),
+        ('order', '0006_order_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShopDailySales',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('orders', models.IntegerField(default=0)),
+                ('items', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='shop.Shop')),
+            ],
+            options={
+                'unique_together': {('shop', 'day')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ShopDailyProductSales',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('product_title', models.CharField(max_length=255)),
+                ('quantity', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_product_sales', to='shop.Shop')),
+            ],
+            options={
+                'unique_together': {('shop', 'day', 'product_title')},
+            },
+        ),
+    ]
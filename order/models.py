@@ -1,7 +1,10 @@
+from collections import defaultdict
+
 from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator
-from django.db import models
-from django.utils.timezone import now
+from django.db import connection, models
+from django.db.models import Count, Q
+from django.utils.timezone import now, localdate
 
 from shop.models import Shop, ShopProduct, Combo
 from . import OrderStatus
@@ -9,6 +12,48 @@ from . import OrderStatus
 User = get_user_model()
 
 
+class OrderManager(models.Manager):
+    def refresh_statuses(self, order_ids):
+        # Recomputes the status of the given orders from their shop orders with a single aggregate query.
+        # Must run inside a transaction, the orders stay locked until it commits so concurrent
+        # status changes from different shops of the same order can not overwrite each other.
+        orders = list(self.select_for_update().filter(id__in=order_ids).order_by('id'))
+
+        shop_order_counts = ShopOrderLine.objects.filter(order_id__in=order_ids).values('order_id').annotate(
+            total=Count('id'), fulfilled=Count('id', filter=Q(status=OrderStatus.FULFILLED))
+        )
+        counts_by_order = {counts['order_id']: counts for counts in shop_order_counts}
+
+        for order in orders:
+            counts = counts_by_order.get(order.id, {'total': 0, 'fulfilled': 0})
+            if counts['fulfilled'] == 0:
+                order.status = OrderStatus.UNFULFILLED
+            elif counts['fulfilled'] == counts['total']:
+                order.status = OrderStatus.FULFILLED
+            else:
+                order.status = OrderStatus.PARTIALLY_FULFILLED
+
+        self.bulk_update(orders, ['status'])
+        return orders
+
+    def archive(self, order_ids):
+        # Moves the given orders with their shop orders and items to the archive tables.
+        # Ids are kept so an archived order is still addressed by the same id.
+        shop_orders = ShopOrderLine.objects.filter(order_id__in=order_ids)
+        order_items = OrderItem.objects.filter(shop_order__order_id__in=order_ids)
+
+        ArchivedOrder.objects.bulk_create(
+            [archived_copy(order, ArchivedOrder) for order in self.filter(id__in=order_ids)])
+        ArchivedShopOrderLine.objects.bulk_create(
+            [archived_copy(shop_order, ArchivedShopOrderLine) for shop_order in shop_orders])
+        ArchivedOrderItem.objects.bulk_create(
+            [archived_copy(order_item, ArchivedOrderItem) for order_item in order_items])
+
+        order_items.delete()
+        shop_orders.delete()
+        return self.filter(id__in=order_ids).delete()
+
+
 class Order(models.Model):
     created = models.DateTimeField(default=now, editable=False)
     reference_id = models.CharField(max_length=18, default="", db_index=True)
@@ -28,6 +73,8 @@ class Order(models.Model):
     total = models.DecimalField(max_digits=9, decimal_places=2, default=0)
     total_items = models.IntegerField(default=0)
 
+    objects = OrderManager()
+
     def __str__(self):
         return str(self.pk)
 
@@ -41,6 +88,15 @@ class ShopOrderLine(models.Model):
     client_tracking_id = models.CharField(max_length=12)  # hh1-self.id last
     total = models.DecimalField(max_digits=9, decimal_places=2, null=True, blank=True)
     total_items = models.IntegerField(default=0)
+    # Copy of order.created so the shop order inbox can be filtered and sorted without joining Order
+    created = models.DateTimeField(default=now, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['shop', 'status', 'created'], name='shoporder_shop_status_created'),
+            models.Index(fields=['shop', 'created'], name='shoporder_open_inbox',
+                         condition=Q(status__in=OrderStatus.OPEN)),
+        ]
 
     def __str__(self):
         return self.client_tracking_id
@@ -65,3 +121,208 @@ class OrderItem(models.Model):
 
     def __str__(self):
         return self.product_title
+
+
+def archived_copy(instance, archive_model):
+    values = {field.attname: getattr(instance, field.attname) for field in instance._meta.concrete_fields}
+    return archive_model(**values)
+
+
+# Archive tier. Fulfilled and canceled orders are moved here by the archiveorders command so the
+# hot tables used by userOrders and shopOrders stay small. Columns must be kept in sync with the hot
+# models above and with the history views below.
+
+class ArchivedOrder(models.Model):
+    id = models.IntegerField(primary_key=True)
+    created = models.DateTimeField(db_index=True)
+    reference_id = models.CharField(max_length=18, default="")
+    user = models.ForeignKey(User, blank=True, null=True, related_name="archived_orders",
+                             on_delete=models.SET_NULL)
+    status = models.CharField(max_length=32, choices=OrderStatus.CHOICES)
+    user_email = models.EmailField(blank=True, default="")
+    user_phone = models.CharField(max_length=10)
+    user_full_name = models.CharField(max_length=100)
+    total = models.DecimalField(max_digits=9, decimal_places=2, default=0)
+    total_items = models.IntegerField(default=0)
+
+    def __str__(self):
+        return str(self.pk)
+
+
+class ArchivedShopOrderLine(models.Model):
+    id = models.IntegerField(primary_key=True)
+    order = models.ForeignKey(ArchivedOrder, related_name="shop_orders", on_delete=models.CASCADE)
+    status = models.CharField(max_length=32, choices=OrderStatus.CHOICES)
+    shop = models.ForeignKey(Shop, related_name="archived_orders", on_delete=models.CASCADE, null=True,
+                             blank=True)
+    client_tracking_id = models.CharField(max_length=12)
+    total = models.DecimalField(max_digits=9, decimal_places=2, null=True, blank=True)
+    total_items = models.IntegerField(default=0)
+    created = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['shop', 'created'], name='archivedshoporder_shop_created'),
+        ]
+
+    def __str__(self):
+        return self.client_tracking_id
+
+
+class ArchivedOrderItem(models.Model):
+    id = models.IntegerField(primary_key=True)
+    shop_order = models.ForeignKey(ArchivedShopOrderLine, related_name='order_items', on_delete=models.CASCADE)
+    product_title = models.CharField(max_length=255, null=True, blank=True)
+    shop_product = models.ForeignKey(ShopProduct, related_name='+', on_delete=models.SET_NULL, null=True,
+                                     blank=True)
+    combo = models.ForeignKey(Combo, related_name='+', on_delete=models.SET_NULL, null=True, blank=True)
+    quantity = models.IntegerField()
+    unit_price = models.DecimalField(max_digits=9, decimal_places=2)
+
+    def __str__(self):
+        return self.product_title
+
+
+# Read only views over hot UNION ALL archive rows (see migration 0006). They are only queried when a
+# requested date range reaches into the archive, anything else reads the hot tables directly.
+
+class OrderHistory(models.Model):
+    created = models.DateTimeField()
+    reference_id = models.CharField(max_length=18)
+    user = models.ForeignKey(User, blank=True, null=True, related_name='+', on_delete=models.DO_NOTHING)
+    status = models.CharField(max_length=32, choices=OrderStatus.CHOICES)
+    user_email = models.EmailField()
+    user_phone = models.CharField(max_length=10)
+    user_full_name = models.CharField(max_length=100)
+    total = models.DecimalField(max_digits=9, decimal_places=2)
+    total_items = models.IntegerField()
+
+    class Meta:
+        managed = False
+        db_table = 'order_orderhistory'
+
+    def __str__(self):
+        return str(self.pk)
+
+
+class ShopOrderLineHistory(models.Model):
+    order = models.ForeignKey(OrderHistory, related_name="shop_orders", on_delete=models.DO_NOTHING)
+    status = models.CharField(max_length=32, choices=OrderStatus.CHOICES)
+    shop = models.ForeignKey(Shop, related_name='+', on_delete=models.DO_NOTHING, null=True, blank=True)
+    client_tracking_id = models.CharField(max_length=12)
+    total = models.DecimalField(max_digits=9, decimal_places=2, null=True, blank=True)
+    total_items = models.IntegerField()
+    created = models.DateTimeField()
+
+    class Meta:
+        managed = False
+        db_table = 'order_shoporderlinehistory'
+
+    def __str__(self):
+        return self.client_tracking_id
+
+
+class OrderItemHistory(models.Model):
+    shop_order = models.ForeignKey(ShopOrderLineHistory, related_name='order_items', on_delete=models.DO_NOTHING)
+    product_title = models.CharField(max_length=255, null=True, blank=True)
+    shop_product = models.ForeignKey(ShopProduct, related_name='+', on_delete=models.DO_NOTHING, null=True,
+                                     blank=True)
+    combo = models.ForeignKey(Combo, related_name='+', on_delete=models.DO_NOTHING, null=True, blank=True)
+    quantity = models.IntegerField()
+    unit_price = models.DecimalField(max_digits=9, decimal_places=2)
+
+    class Meta:
+        managed = False
+        db_table = 'order_orderitemhistory'
+
+    def __str__(self):
+        return self.product_title
+
+
+class ShopDailySalesManager(models.Manager):
+    def record(self, shop_order, order_items, sign=1):
+        # Adds (sign=1) or removes (sign=-1) a shop order from its shop's rollups for the day it was placed.
+        # Upserts so concurrent checkouts for the same shop and day add up instead of racing on an insert.
+        if shop_order.shop_id is None:
+            return
+
+        day = localdate(shop_order.created)
+        product_sales = defaultdict(lambda: [0, 0])
+        for order_item in order_items:
+            product_sale = product_sales[order_item.product_title or '']
+            product_sale[0] += order_item.quantity * sign
+            product_sale[1] += order_item.quantity * order_item.unit_price * sign
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {self.model._meta.db_table} AS sales (shop_id, day, orders, items, revenue) '
+                'VALUES (%s, %s, %s, %s, %s) ON CONFLICT (shop_id, day) DO UPDATE SET '
+                'orders = sales.orders + EXCLUDED.orders, items = sales.items + EXCLUDED.items, '
+                'revenue = sales.revenue + EXCLUDED.revenue',
+                [shop_order.shop_id, day, sign, shop_order.total_items * sign, (shop_order.total or 0) * sign]
+            )
+
+            if len(product_sales) == 0:
+                return
+
+            values = []
+            for product_title, (quantity, revenue) in product_sales.items():
+                values += [shop_order.shop_id, day, product_title, quantity, revenue]
+
+            cursor.execute(
+                f'INSERT INTO {ShopDailyProductSales._meta.db_table} AS sales '
+                '(shop_id, day, product_title, quantity, revenue) VALUES '
+                + ', '.join(['(%s, %s, %s, %s, %s)'] * len(product_sales)) +
+                ' ON CONFLICT (shop_id, day, product_title) DO UPDATE SET '
+                'quantity = sales.quantity + EXCLUDED.quantity, revenue = sales.revenue + EXCLUDED.revenue',
+                values
+            )
+
+    def record_status_change(self, shop_orders, status):
+        # Called with the shop orders still holding their old status. Only moving into or out of
+        # canceled changes the rollups.
+        sign = -1 if status == OrderStatus.CANCELED else 1
+        toggled = [shop_order for shop_order in shop_orders
+                   if (shop_order.status == OrderStatus.CANCELED) == (sign == 1)]
+        if len(toggled) == 0:
+            return
+
+        order_items = defaultdict(list)
+        for order_item in OrderItem.objects.filter(shop_order__in=toggled):
+            order_items[order_item.shop_order_id].append(order_item)
+
+        for shop_order in toggled:
+            self.record(shop_order, order_items[shop_order.id], sign)
+
+
+# Sales rollups of non canceled shop orders per shop and day, so shop reports never scan order history.
+# Kept up to date by CheckoutCart and the order status mutations, rebuilt by the rebuildshopsales command.
+
+class ShopDailySales(models.Model):
+    shop = models.ForeignKey(Shop, related_name='daily_sales', on_delete=models.CASCADE)
+    day = models.DateField()
+    orders = models.IntegerField(default=0)
+    items = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    objects = ShopDailySalesManager()
+
+    class Meta:
+        unique_together = ['shop', 'day']
+
+    def __str__(self):
+        return f'{self.shop} {self.day}'
+
+
+class ShopDailyProductSales(models.Model):
+    shop = models.ForeignKey(Shop, related_name='daily_product_sales', on_delete=models.CASCADE)
+    day = models.DateField()
+    product_title = models.CharField(max_length=255)
+    quantity = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ['shop', 'day', 'product_title']
+
+    def __str__(self):
+        return self.product_title
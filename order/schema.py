@@ -1,15 +1,18 @@
 import graphene
-from django.utils.timezone import now
-from django_filters import FilterSet, OrderingFilter
+from django.db import transaction
+from django.db.models import Max, Sum
+from django.utils.timezone import is_naive, make_aware, now
+from django_filters import FilterSet, OrderingFilter, BooleanFilter, DateTimeFilter
 from graphene_django.filter import DjangoFilterConnectionField
 from graphene_django.types import DjangoObjectType
-from graphql_jwt.decorators import login_required
+from graphql_jwt.decorators import login_required, user_passes_test
 from graphql_relay import from_global_id
 
 from core.utils import n_len_rand
 from shop.models import Shop
 from . import OrderStatus
-from .models import Order, ShopOrderLine, OrderItem
+from .models import Order, ShopOrderLine, OrderItem, ArchivedOrder, ArchivedShopOrderLine, OrderHistory, \
+    ShopOrderLineHistory, OrderItemHistory, ShopDailySales, ShopDailyProductSales
 
 
 class OrderNode(DjangoObjectType):
@@ -19,6 +22,11 @@ class OrderNode(DjangoObjectType):
         order_by = ['-created']
         interfaces = (graphene.relay.Node,)
 
+    @classmethod
+    def is_type_of(cls, root, info):
+        # Orders are read from the history view when the requested date range reaches into the archive
+        return isinstance(root, OrderHistory) or super().is_type_of(root, info)
+
 
 class ShopOrderLineNode(DjangoObjectType):
     class Meta:
@@ -26,6 +34,10 @@ class ShopOrderLineNode(DjangoObjectType):
         filter_fields = ['client_tracking_id', 'status', 'shop']
         interfaces = (graphene.relay.Node,)
 
+    @classmethod
+    def is_type_of(cls, root, info):
+        return isinstance(root, ShopOrderLineHistory) or super().is_type_of(root, info)
+
 
 class OrderItemNode(DjangoObjectType):
     class Meta:
@@ -33,6 +45,46 @@ class OrderItemNode(DjangoObjectType):
         filter_fields = ['id']
         interfaces = (graphene.relay.Node,)
 
+    @classmethod
+    def is_type_of(cls, root, info):
+        return isinstance(root, OrderItemHistory) or super().is_type_of(root, info)
+
+
+class ShopDailySalesType(DjangoObjectType):
+    class Meta:
+        model = ShopDailySales
+        fields = ('day', 'orders', 'items', 'revenue')
+
+
+class ShopProductSalesType(graphene.ObjectType):
+    product_title = graphene.String()
+    quantity = graphene.Int()
+    revenue = graphene.Float()
+
+
+class ShopSalesReportType(graphene.ObjectType):
+    orders = graphene.Int()
+    items = graphene.Int()
+    revenue = graphene.Float()
+    days = graphene.List(ShopDailySalesType)
+    top_products = graphene.List(ShopProductSalesType)
+
+
+SHOP_ORDER_STATUSES = {
+    'fulfilled': OrderStatus.FULFILLED,
+    'unfulfilled': OrderStatus.UNFULFILLED,
+    'canceled': OrderStatus.CANCELED,
+}
+
+
+def get_owned_shop(user, relay_shop_id):
+    shop_id = from_global_id(relay_shop_id)[1]
+    shop = Shop.objects.get(owner=user)
+    if shop.id != int(shop_id):
+        raise Exception("Permission denied")
+
+    return shop
+
 
 class ModifyOrderStatus(graphene.relay.ClientIDMutation):
     shop_order = graphene.Field(ShopOrderLineNode)
@@ -47,48 +99,61 @@ class ModifyOrderStatus(graphene.relay.ClientIDMutation):
     @login_required
     def mutate_and_get_payload(cls, root, info, **input):
         shop_order_id = from_global_id(input.get('shop_order_id'))[1]
-        shop_id = from_global_id(input.get('shop_id'))[1]
         status = input.get('status')
         user = info.context.user
 
-        shop = Shop.objects.get(owner=user)
-        if shop.id == int(shop_id):
+        shop = get_owned_shop(user, input.get('shop_id'))
+
+        with transaction.atomic():
             try:
-                shop_order = ShopOrderLine.objects.get(id=shop_order_id)
-                if status == "fulfilled":
-                    shop_order.status = OrderStatus.FULFILLED
-                elif status == "unfulfilled":
-                    shop_order.status = OrderStatus.UNFULFILLED
-                elif status == "canceled":
-                    shop_order.status = OrderStatus.CANCELED
+                shop_order = ShopOrderLine.objects.select_for_update().get(id=shop_order_id, shop=shop)
 
-                shop_order.save()
+            except ShopOrderLine.DoesNotExist:
+                raise Exception("This order does not exist")
+
+            if status in SHOP_ORDER_STATUSES:
+                ShopDailySales.objects.record_status_change([shop_order], SHOP_ORDER_STATUSES[status])
+                shop_order.status = SHOP_ORDER_STATUSES[status]
+                shop_order.save(update_fields=['status'])
+
+            Order.objects.refresh_statuses([shop_order.order_id])
 
-                no_of_fulfilled_shop_orders = 0
-                order = shop_order.order
-                order_related_shop_orders = order.shop_orders.all()
-                for shop_order in order_related_shop_orders:
-                    if shop_order.status == "fulfilled":
-                        no_of_fulfilled_shop_orders += 1
+        return cls(shop_order)
 
-                if no_of_fulfilled_shop_orders == order_related_shop_orders.count():
-                    order.status = OrderStatus.FULFILLED
 
-                elif 0 < no_of_fulfilled_shop_orders < order_related_shop_orders.count():
-                    order.status = OrderStatus.PARTIALLY_FULFILLED
+class ModifyOrderStatuses(graphene.relay.ClientIDMutation):
+    shop_orders = graphene.List(ShopOrderLineNode)
 
-                elif no_of_fulfilled_shop_orders == 0:
-                    order.status = OrderStatus.UNFULFILLED
+    class Input:
+        shop_order_ids = graphene.List(graphene.ID, required=True)
+        status = graphene.String(required=True)
+        shop_id = graphene.ID(required=True)
+
+    @classmethod
+    @login_required
+    def mutate_and_get_payload(cls, root, info, **input):
+        shop_order_ids = [from_global_id(relay_id)[1] for relay_id in input.get('shop_order_ids')]
+        status = input.get('status')
+        user = info.context.user
 
-                order.save()
+        if status not in SHOP_ORDER_STATUSES:
+            raise Exception("Invalid order status")
 
-                return cls(shop_order)
+        shop = get_owned_shop(user, input.get('shop_id'))
 
-            except ShopOrderLine.DoesNotExist:
-                raise Exception("This order does not exist")
+        with transaction.atomic():
+            shop_orders = ShopOrderLine.objects.filter(id__in=shop_order_ids, shop=shop)
+            locked_shop_orders = list(shop_orders.select_for_update().order_by('id'))
+            order_ids = list({shop_order.order_id for shop_order in locked_shop_orders})
 
-        else:
-            raise Exception("Permission denied")
+            if len(order_ids) == 0:
+                raise Exception("These orders do not exist")
+
+            ShopDailySales.objects.record_status_change(locked_shop_orders, SHOP_ORDER_STATUSES[status])
+            shop_orders.update(status=SHOP_ORDER_STATUSES[status])
+            Order.objects.refresh_statuses(order_ids)
+
+        return cls(list(shop_orders))
 
 
 class ClearCart(graphene.relay.ClientIDMutation):
@@ -145,15 +210,17 @@ class CheckoutCart(graphene.relay.ClientIDMutation):
 
             order_items = []
             shop_orders = []
+            shop_order_items = []
             for cart_line in user_cart_lines.all():
                 shop_order_tracking_id = f'{hour}{minute}-{n_len_rand(3)}'
                 shop = cart_line.shop
-                shop_order = ShopOrderLine(order=order, shop=shop,
+                shop_order = ShopOrderLine(order=order, shop=shop, created=order.created,
                                            client_tracking_id=shop_order_tracking_id)
 
                 shop_order_total = 0
                 shop_order_total_items = 0
                 shop_order.save()
+                shop_order_items.append((shop_order, []))
 
                 for cart_item in cart_line.items.all():
                     product_title = cart_item.combo.name if cart_item.is_combo() else cart_item.shop_product.product.title
@@ -167,6 +234,7 @@ class CheckoutCart(graphene.relay.ClientIDMutation):
                     shop_order_total_items += order_item.quantity
                     # A combo is considered as a single item
                     order_items.append(order_item)
+                    shop_order_items[-1][1].append(order_item)
 
                 shop_order.total = shop_order_total
                 shop_order.total_items = shop_order_total_items
@@ -178,6 +246,8 @@ class CheckoutCart(graphene.relay.ClientIDMutation):
 
             ShopOrderLine.objects.bulk_update(shop_orders, ['total', 'total_items'])
             OrderItem.objects.bulk_create(order_items)
+            for shop_order, items in shop_order_items:
+                ShopDailySales.objects.record(shop_order, items)
 
             order.total = order_total
             order.total_items = order_total_items
@@ -191,6 +261,7 @@ class Mutation(graphene.ObjectType):
     # checkout_cart = CheckoutCart.Field()
     clear_cart = ClearCart.Field()
     modify_order_status = ModifyOrderStatus.Field()
+    modify_order_statuses = ModifyOrderStatuses.Field()
 
 
 class UserOrderFilter(FilterSet):
@@ -198,6 +269,9 @@ class UserOrderFilter(FilterSet):
         model = Order
         fields = ['id', 'user']
 
+    created_after = DateTimeFilter(field_name='created', lookup_expr='gte')
+    created_before = DateTimeFilter(field_name='created', lookup_expr='lte')
+
     order_by = OrderingFilter(
         fields=(
             ('created'),
@@ -210,17 +284,71 @@ class ShopOrderFilter(FilterSet):
         model = ShopOrderLine
         fields = ['shop', 'status', 'client_tracking_id']
 
+    # Only the orders still waiting on the shop, served from the shoporder_open_inbox partial index
+    inbox = BooleanFilter(method='filter_inbox')
+    created_after = DateTimeFilter(field_name='created', lookup_expr='gte')
+    created_before = DateTimeFilter(field_name='created', lookup_expr='lte')
+
     order_by = OrderingFilter(
         fields=(
-            ('order__created'),
+            # shop_order.created is a copy of order.created, the param name is kept for the front end
+            ('created', 'order__created'),
         )
     )
 
+    def filter_inbox(self, queryset, name, value):
+        if value:
+            return queryset.filter(status__in=OrderStatus.OPEN)
+        return queryset
+
+
+def reaches_archive(archive_model, created_after=None, created_before=None, **kwargs):
+    # Without a date range only the hot tables are read. With one, the archive is read too
+    # unless the range starts after the newest archived order.
+    if created_after is None and created_before is None:
+        return False
+
+    newest_archived = archive_model.objects.aggregate(newest=Max('created'))['newest']
+    if newest_archived is None:
+        return False
+
+    if created_after is not None and is_naive(created_after):
+        # DateTimes sent without an offset are in the current time zone, like the filters read them
+        created_after = make_aware(created_after)
+    return created_after is None or created_after <= newest_archived
+
 
 class Query(graphene.ObjectType):
     user_orders = DjangoFilterConnectionField(OrderNode, filterset_class=UserOrderFilter)
     shop_orders = DjangoFilterConnectionField(ShopOrderLineNode, filterset_class=ShopOrderFilter)
+    shop_sales_report = graphene.Field(ShopSalesReportType, date_from=graphene.Date(required=True, name='from'),
+                                       date_to=graphene.Date(required=True, name='to'))
 
     @login_required
     def resolve_user_orders(self, info, **kwargs):
-        return UserOrderFilter(kwargs).qs
+        orders = OrderHistory.objects.all() if reaches_archive(ArchivedOrder, **kwargs) else Order.objects.all()
+        return UserOrderFilter(kwargs, queryset=orders).qs
+
+    def resolve_shop_orders(self, info, **kwargs):
+        if reaches_archive(ArchivedShopOrderLine, **kwargs):
+            return ShopOrderLineHistory.objects.all()
+        return ShopOrderLine.objects.all()
+
+    @login_required
+    @user_passes_test(lambda user: user.is_shop_owner)
+    def resolve_shop_sales_report(self, info, date_from, date_to):
+        # Reads only the daily rollups, a year long report is at most 365 rows per table
+        shop = info.context.user.shop
+
+        days = ShopDailySales.objects.filter(shop=shop, day__range=(date_from, date_to)).order_by('day')
+        totals = days.aggregate(orders=Sum('orders'), items=Sum('items'), revenue=Sum('revenue'))
+
+        top_products = ShopDailyProductSales.objects.filter(shop=shop, day__range=(date_from, date_to)) \
+            .values('product_title') \
+            .annotate(quantity=Sum('quantity'), revenue=Sum('revenue')) \
+            .filter(quantity__gt=0) \
+            .order_by('-quantity')[:10]
+
+        return ShopSalesReportType(orders=totals['orders'] or 0, items=totals['items'] or 0,
+                                   revenue=totals['revenue'] or 0, days=days,
+                                   top_products=[ShopProductSalesType(**product) for product in top_products])
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from payment.reconcile import reconcile_payments
+
+
+class Command(BaseCommand):
+    help = 'Check pending Paytm payments and credit the plans of successful ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help='Status requests sent at a time')
+        parser.add_argument('--batch-size', type=int, default=100, help='Payments checked per pass')
+        parser.add_argument('--run-for', type=int, default=0,
+                            help='Keep checking for this many seconds, by default check what is due and exit')
+        parser.add_argument('--interval', type=float, default=2, help='Seconds between passes when idle')
+
+    def handle(self, *args, **options):
+        stop_at = time.monotonic() + options['run_for']
+        checked = 0
+
+        while True:
+            checked_now = reconcile_payments(workers=options['workers'], batch_size=options['batch_size'])
+            checked += checked_now
+            if checked_now:
+                continue
+            if time.monotonic() + options['interval'] >= stop_at:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write(f'Checked {checked} payments')
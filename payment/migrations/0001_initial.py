@@ -0,0 +1,39 @@
+# Generated by Django 3.0.3 on 2026-10-19 14:13
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('shop', '0017_auto_20200311_1030'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentIntent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order_id', models.UUIDField(unique=True)),
+                ('amount', models.DecimalField(decimal_places=0, max_digits=9)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('success', 'Success'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('gateway_response', django.contrib.postgres.fields.jsonb.JSONField(blank=True, default=dict)),
+                ('checks', models.IntegerField(default=0)),
+                ('next_check_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('credited_at', models.DateTimeField(blank=True, null=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('plan', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='shop.ShopPlan')),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payment_intents', to='shop.Shop')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='paymentintent',
+            index=models.Index(condition=models.Q(status='pending'), fields=['next_check_at'], name='paymentintent_pending'),
+        ),
+    ]
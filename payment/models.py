@@ -0,0 +1,50 @@
+from django.contrib.postgres.fields import JSONField
+from django.db import models
+from django.utils.timezone import now
+
+from shop.models import Shop, ShopPlan
+
+
+class PaymentStatus:
+    PENDING = 'pending'
+    SUCCESS = 'success'
+    FAILED = 'failed'
+
+    CHOICES = [
+        (PENDING, 'Pending'),
+        (SUCCESS, 'Success'),
+        (FAILED, 'Failed'),
+    ]
+
+    # STATUS values of the Paytm order status API
+    PAYTM = {
+        'TXN_SUCCESS': SUCCESS,
+        'TXN_FAILURE': FAILED,
+        'PENDING': PENDING,
+    }
+
+
+class PaymentIntent(models.Model):
+    # A plan purchase handed to Paytm. Its status is only ever set from the Paytm order status API, by the
+    # reconcilepayments command or for older checkouts by the transaction_status query, see payment.reconcile
+    order_id = models.UUIDField(unique=True)
+    shop = models.ForeignKey(Shop, related_name='payment_intents', on_delete=models.CASCADE)
+    plan = models.ForeignKey(ShopPlan, on_delete=models.SET_NULL, null=True)
+    amount = models.DecimalField(max_digits=9, decimal_places=0)
+    status = models.CharField(max_length=10, choices=PaymentStatus.CHOICES, default=PaymentStatus.PENDING)
+    # Last response of the order status API, returned as is by the transaction_status query
+    gateway_response = JSONField(default=dict, blank=True)
+    checks = models.IntegerField(default=0)
+    next_check_at = models.DateTimeField(default=now)
+    credited_at = models.DateTimeField(null=True, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['next_check_at'], name='paymentintent_pending',
+                         condition=models.Q(status=PaymentStatus.PENDING)),
+        ]
+
+    def __str__(self):
+        return f'{self.order_id} {self.status}'
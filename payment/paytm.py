@@ -0,0 +1,40 @@
+import os
+from json import dumps
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .utils import Checksum
+
+MKEY = os.environ.get('MKEY')
+MID = os.environ.get('MID')
+PAYTM_STAGE = os.environ.get('PAYTM_STAGE')
+
+# PAYTM_STATUS_URL points the status checks at a local stub server when testing
+STATUS_URL = os.environ.get('PAYTM_STATUS_URL') or \
+    ("https://securegw-stage.paytm.in/order/status" if PAYTM_STAGE else "https://securegw.paytm.in/order/status")
+
+# Connect and read timeouts in seconds
+TIMEOUT = (3.05, 10)
+
+
+def status_session(pool_size=10):
+    # One keep alive connection pool shared by the threads checking statuses
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers['Content-type'] = 'application/json'
+    return session
+
+
+def fetch_transaction_status(session, order_id):
+    paytm_params = {
+        "MID": MID,
+        "ORDER_ID": str(order_id),
+    }
+    paytm_params['CHECKSUMHASH'] = Checksum.generate_checksum(paytm_params, MKEY)
+
+    response = session.post(STATUS_URL, data=dumps(paytm_params), timeout=TIMEOUT)
+    response.raise_for_status()
+    return response.json()
@@ -0,0 +1,118 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.utils.timezone import now
+
+from shop.models import PlanQueue, ShopPlan
+from .models import PaymentIntent, PaymentStatus
+from .paytm import status_session, fetch_transaction_status
+
+# Seconds before the first recheck of a pending payment, doubled per check up to MAX_CHECK_INTERVAL
+CHECK_BACKOFF = 5
+MAX_CHECK_INTERVAL = 10 * 60
+# Payments still pending after this long are given up on
+PENDING_EXPIRY = timedelta(days=3)
+
+
+def apply_transaction_status(intent_id, response):
+    # Stores a status response and credits the plan of a successful payment, exactly once
+    with transaction.atomic():
+        intent = PaymentIntent.objects.select_for_update().select_related('shop', 'plan').get(id=intent_id)
+        if intent.status != PaymentStatus.PENDING:
+            return intent
+
+        intent.checks += 1
+        intent.gateway_response = response
+        status = PaymentStatus.PAYTM.get(response.get('STATUS'), PaymentStatus.PENDING)
+
+        if status == PaymentStatus.SUCCESS:
+            try:
+                paid = Decimal(response.get('TXNAMOUNT'))
+            except (TypeError, InvalidOperation):
+                paid = None
+
+            if paid != intent.amount or intent.plan is None:
+                # Needs a look by hand, the plan is not credited
+                status = PaymentStatus.FAILED
+                intent.gateway_response = dict(response, STATUS='TXN_FAILURE',
+                                               RESPMSG='Paid amount does not match the plan. Please contact us')
+            else:
+                PlanQueue.objects.add_plan_to_queue(plan=intent.plan, shop=intent.shop, order_id=intent.order_id)
+                intent.credited_at = now()
+
+        if status == PaymentStatus.PENDING:
+            if now() - intent.created > PENDING_EXPIRY:
+                status = PaymentStatus.FAILED
+            else:
+                delay = min(CHECK_BACKOFF * 2 ** intent.checks, MAX_CHECK_INTERVAL)
+                intent.next_check_at = now() + timedelta(seconds=delay)
+
+        intent.status = status
+        intent.save()
+        return intent
+
+
+def intent_from_gateway(shop, order_id, response):
+    """
+    Records the PaymentIntent of a checkout started before intents were recorded, from its order status
+    response, and stores the response as reconcile_payments would. The plan is the one priced at the paid amount,
+    as the status page credited it then. Returns None when there is nothing to record: orders Paytm
+    failed or does not know, and orders already credited.
+    """
+    status = PaymentStatus.PAYTM.get(response.get('STATUS'))
+    if status not in (PaymentStatus.SUCCESS, PaymentStatus.PENDING) or response.get('ORDERID') != str(order_id):
+        return None
+    if PlanQueue.objects.filter(order_id=order_id).exists():
+        return None
+    try:
+        amount = Decimal(response.get('TXNAMOUNT'))
+    except (TypeError, InvalidOperation):
+        return None
+
+    plan = ShopPlan.objects.filter(plan_id=str(int(amount))).first()
+    intent, created = PaymentIntent.objects.get_or_create(order_id=order_id,
+                                                          defaults={'shop': shop, 'plan': plan, 'amount': amount})
+    if intent.shop_id != shop.id:
+        return None
+    return apply_transaction_status(intent.id, response)
+
+
+def reconcile_payments(workers=8, batch_size=100):
+    """
+    Checks the due pending payments with Paytm, `workers` requests at a time over one pooled session.
+    Only the HTTP requests run in the pool, statuses are stored from the calling thread.
+    Returns the number of payments checked.
+    """
+    intents = list(PaymentIntent.objects.filter(status=PaymentStatus.PENDING, next_check_at__lte=now())
+                   .order_by('next_check_at').values_list('id', 'order_id')[:batch_size])
+    if not intents:
+        return 0
+
+    session = status_session(pool_size=workers)
+
+    def check(order_id):
+        try:
+            return fetch_transaction_status(session, order_id)
+        except Exception as e:
+            return e
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            responses = list(executor.map(check, [order_id for intent_id, order_id in intents]))
+    finally:
+        session.close()
+
+    for (intent_id, order_id), response in zip(intents, responses):
+        if isinstance(response, Exception):
+            # Timeouts and gateway errors are retried like a pending status
+            response = {'STATUS': 'PENDING', 'ORDERID': str(order_id), 'RESPMSG': str(response)}
+        try:
+            apply_transaction_status(intent_id, response)
+        except Exception:
+            # Crediting failed and was rolled back, checked again later instead of on every pass
+            PaymentIntent.objects.filter(id=intent_id) \
+                .update(next_check_at=now() + timedelta(seconds=MAX_CHECK_INTERVAL))
+
+    return len(intents)
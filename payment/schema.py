@@ -1,20 +1,18 @@
 import os
 import uuid
-from json import dumps
 
 import graphene
-import requests
+from django.utils.timezone import now
 from graphql_jwt.decorators import user_passes_test, login_required
 from graphql_relay import from_global_id
 
-from shop.models import ShopPlan, PlanQueue
+from shop.models import ShopPlan
+from .models import PaymentIntent, PaymentStatus
+from .paytm import MKEY, MID, status_session, fetch_transaction_status
+from .reconcile import intent_from_gateway
 from .utils import Checksum
 
 allowed_host = os.environ.get('ALLOWED_HOSTS')
-PAYTM_STAGE = os.environ.get('PAYTM_STAGE')
-
-MKEY = os.environ.get('MKEY')
-MID = os.environ.get('MID')
 
 callback_url = f"http://{allowed_host}:8000/paytm/callback/" if allowed_host == 'localhost' else f"https://{allowed_host}/paytm/callback/"
 
@@ -35,7 +33,8 @@ class GetPaytmSubmitForm(graphene.relay.ClientIDMutation):
             plan = ShopPlan.objects.get(id=plan_id)
 
             user = info.context.user
-            order_id = str(uuid.uuid4())
+            order_id = uuid.uuid4()
+            PaymentIntent.objects.create(order_id=order_id, shop=user.shop, plan=plan, amount=plan.price)
             # body parameters
 
             paytm_params = {
@@ -43,7 +42,7 @@ class GetPaytmSubmitForm(graphene.relay.ClientIDMutation):
                 "WEBSITE": os.environ.get('WEBSITE_NAME'),
                 "INDUSTRY_TYPE_ID": "Retail",
                 "CHANNEL_ID": "WEB",
-                "ORDER_ID": order_id,
+                "ORDER_ID": str(order_id),
                 "EMAIL": user.email,
                 "CALLBACK_URL": callback_url,
                 # Order Transaction Amount here
@@ -68,71 +67,30 @@ class Query(graphene.ObjectType):
     @login_required
     @user_passes_test(lambda user: user.is_shop_owner)
     def resolve_transaction_status(self, info, **kwargs):
+        # Statuses are fetched from Paytm and plans credited by the reconcilepayments command. This only
+        # reads what it stored, in the format of the Paytm order status response.
         order_id = kwargs.get('order_id')
         shop = info.context.user.shop
 
-        paytm_params = {
-            "MID": MID,
-            "ORDER_ID": order_id,
-        }
-        checksum = Checksum.generate_checksum(paytm_params, MKEY)
-        paytm_params['CHECKSUMHASH'] = checksum
-
-        post_data = dumps(paytm_params)
-        # for Staging
-        url = "https://securegw-stage.paytm.in/order/status" if PAYTM_STAGE else "https://securegw.paytm.in/order/status"
-
-        transaction_status_response = requests.post(url, data=post_data,
-                                                    headers={"Content-type": "application/json"}).json()
-
-        if transaction_status_response['STATUS'] == 'TXN_SUCCESS':
-            txn_amount = transaction_status_response['TXNAMOUNT']
-            order_id_uuid = uuid.UUID(order_id)
-            # check if already exist a plan queue with same order id. It means the transaction_status_response page
-            # was refreshed by user
-            try:
-                plan_queue = PlanQueue.objects.get(order_id=order_id_uuid)
-                return transaction_status_response
-
-            except PlanQueue.DoesNotExist:
-                try:
-                    plan = ShopPlan.objects.get(plan_id=str(int(float(txn_amount))))
-
-                    PlanQueue.objects.add_plan_to_queue(plan=plan, shop=shop)
-
-                    return transaction_status_response
-
-                except Exception as e:
-                    raise Exception(e)
-                    # raspaai system error. Money has been transacted initiate refund
-                    # initiate_refund_params = dict()
-                    # initiate_refund_params["body"] = {
-                    # "mid" :MID,
-                    # # This has fixed value for refund transaction
-                    # "txnType" : "REFUND",
-                    # "orderId" : order_id,
-                    # "txnId" : transaction_status_response["TXNID"],
-                    # # Enter numeric or alphanumeric unique refund id
-                    # "refId" : order_id,
-                    # # Enter amount that needs to be refunded, this must be numeric
-                    # "refundAmount" : f'{round(float(txn_amount)*0.99)}'
-                    # }
-
-                    # checksum = Checksum.generate_checksum_by_str(dumps(initiate_refund_params["body"]), MKEY)
-                    # # head parameters
-                    # initiate_refund_params["head"] = {
-                    # # This is used when you have two different merchant keys. In case you have only one please put - C11
-                    # "clientId" : "C11",
-                    # # put generated checksum value here
-                    # "signature" : checksum
-                    # }
-
-                    # # prepare JSON string for request
-                    # post_data = dumps(initiate_refund_params)
-                    # # for Staging
-                    # url = "https://securegw-stage.paytm.in/refund/apply" if PAYTM_STAGE else "https://securegw.paytm.in/refund/apply"
-                    # initiate_refund_response = requests.post(url, data = post_data, headers = {"Content-type": "application/json"}).json()
-                    # return initiate_refund_response["body"]
-
-        else:
-            return transaction_status_response
+        try:
+            order_id = uuid.UUID(order_id)
+        except ValueError:
+            raise Exception("No payment exist with this order id")
+
+        intent = PaymentIntent.objects.filter(order_id=order_id).first()
+        if intent is None:
+            # Checkouts started before payment intents were recorded are looked up with Paytm here, and
+            # followed by reconcilepayments from then on
+            with status_session(pool_size=1) as session:
+                response = fetch_transaction_status(session, order_id)
+            intent = intent_from_gateway(shop, order_id, response)
+            return intent.gateway_response if intent else response
+
+        if intent.shop_id != shop.id:
+            raise Exception("No payment exist with this order id")
+
+        if intent.status == PaymentStatus.PENDING:
+            # Someone is waiting on it, it is checked on the next pass
+            PaymentIntent.objects.filter(id=intent.id).update(next_check_at=now())
+
+        return intent.gateway_response or {'STATUS': 'PENDING', 'ORDERID': str(order_id)}
@@ -0,0 +1,172 @@
+import json
+import threading
+import uuid
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import requests
+from django.test import SimpleTestCase, TestCase
+from django.utils.timezone import now
+
+from shop.models import PlanQueue, Shop, ShopPlan
+from user.models import User
+from . import paytm
+from .models import PaymentIntent, PaymentStatus
+from .paytm import fetch_transaction_status, status_session
+from .reconcile import intent_from_gateway, reconcile_payments
+from .utils import Checksum
+
+MKEY = 'stubmerchantkey1'
+
+
+class StubPaytmHandler(BaseHTTPRequestHandler):
+    # Answers the order status API with the response set for the order id, 500 for unknown ones
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.requests.append(body)
+        response = self.server.responses.get(body['ORDER_ID'])
+        if response is None:
+            self.send_response(500)
+            self.end_headers()
+            return
+
+        content = json.dumps(response).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubPaytmMixin:
+    """
+    Runs a local stub of the Paytm order status API for the test case, and points PAYTM_STATUS_URL at it
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubPaytmHandler)
+        cls.server.requests = []
+        cls.server.responses = {}
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+        cls.patches = [
+            mock.patch.object(paytm, 'STATUS_URL', f'http://127.0.0.1:{cls.server.server_port}/order/status'),
+            mock.patch.object(paytm, 'MKEY', MKEY),
+            mock.patch.object(paytm, 'MID', 'stubmid'),
+        ]
+        for patch in cls.patches:
+            patch.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        for patch in cls.patches:
+            patch.stop()
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        self.server.requests.clear()
+        self.server.responses.clear()
+
+    def respond(self, order_id, status, amount='499.00', **response):
+        self.server.responses[str(order_id)] = dict(response, ORDERID=str(order_id), STATUS=status,
+                                                    TXNAMOUNT=amount)
+
+
+class FetchTransactionStatusTests(StubPaytmMixin, SimpleTestCase):
+
+    def test_posts_signed_order_id(self):
+        order_id = uuid.uuid4()
+        self.respond(order_id, 'TXN_SUCCESS')
+
+        with status_session(pool_size=1) as session:
+            response = fetch_transaction_status(session, order_id)
+
+        self.assertEqual(response['STATUS'], 'TXN_SUCCESS')
+        request, = self.server.requests
+        self.assertEqual(request['MID'], 'stubmid')
+        self.assertEqual(request['ORDER_ID'], str(order_id))
+        self.assertTrue(Checksum.verify_checksum(request, MKEY, request['CHECKSUMHASH']))
+
+    def test_gateway_error_raises(self):
+        with status_session(pool_size=1) as session:
+            with self.assertRaises(requests.HTTPError):
+                fetch_transaction_status(session, uuid.uuid4())
+
+
+class ReconcilePaymentsTests(StubPaytmMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        owner = User.objects.create_user('owner@example.com', password='stub-Paytm-9931', is_shop_owner=True)
+        self.shop = Shop.objects.create(owner=owner, title='Shop', username='shop', public_username='shop',
+                                        address='Address')
+        self.plan = ShopPlan.objects.create(plan_id='499', name='Monthly', price=499, product_space=30)
+
+    def intent(self, **fields):
+        fields = dict({'order_id': uuid.uuid4(), 'shop': self.shop, 'plan': self.plan, 'amount': 499}, **fields)
+        return PaymentIntent.objects.create(**fields)
+
+    def test_credits_successful_payment_once(self):
+        intent = self.intent()
+        self.respond(intent.order_id, 'TXN_SUCCESS')
+
+        self.assertEqual(reconcile_payments(workers=2), 1)
+        intent.refresh_from_db()
+        self.assertEqual(intent.status, PaymentStatus.SUCCESS)
+        self.assertIsNotNone(intent.credited_at)
+
+        PaymentIntent.objects.filter(id=intent.id).update(next_check_at=now())
+        self.assertEqual(reconcile_payments(workers=2), 0)
+        self.assertEqual(PlanQueue.objects.filter(order_id=intent.order_id).count(), 1)
+
+    def test_amount_mismatch_is_not_credited(self):
+        intent = self.intent()
+        self.respond(intent.order_id, 'TXN_SUCCESS', amount='1.00')
+
+        reconcile_payments(workers=2)
+        intent.refresh_from_db()
+        self.assertEqual(intent.status, PaymentStatus.FAILED)
+        self.assertFalse(PlanQueue.objects.filter(order_id=intent.order_id).exists())
+
+    def test_pending_and_failing_checks_back_off(self):
+        pending = self.intent()
+        unreachable = self.intent()
+        self.respond(pending.order_id, 'PENDING')
+
+        self.assertEqual(reconcile_payments(workers=2), 2)
+        for intent in (pending, unreachable):
+            intent.refresh_from_db()
+            self.assertEqual(intent.status, PaymentStatus.PENDING)
+            self.assertEqual(intent.checks, 1)
+            self.assertGreater(intent.next_check_at, now())
+        self.assertEqual(reconcile_payments(workers=2), 0)
+
+    def test_old_checkout_is_recorded_from_gateway(self):
+        order_id = uuid.uuid4()
+        self.respond(order_id, 'TXN_SUCCESS')
+
+        with status_session(pool_size=1) as session:
+            intent = intent_from_gateway(self.shop, order_id, fetch_transaction_status(session, order_id))
+
+        self.assertEqual(intent.status, PaymentStatus.SUCCESS)
+        self.assertEqual(intent.plan, self.plan)
+        self.assertTrue(PlanQueue.objects.filter(order_id=order_id, shop=self.shop).exists())
+        # Credited once, a refreshed status page reads the intent
+        self.assertIsNone(intent_from_gateway(self.shop, order_id, self.server.responses[str(order_id)]))
+
+    def test_unknown_order_is_not_recorded(self):
+        order_id = uuid.uuid4()
+        self.respond(order_id, 'TXN_FAILURE', RESPMSG='Invalid Order Id.')
+
+        self.assertIsNone(intent_from_gateway(self.shop, order_id, self.server.responses[str(order_id)]))
+        self.assertFalse(PaymentIntent.objects.filter(order_id=order_id).exists())
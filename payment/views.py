@@ -1,6 +1,8 @@
 from django.shortcuts import render
+from django.utils.timezone import now
 from django.views.decorators.csrf import csrf_exempt
 
+from payment.models import PaymentIntent, PaymentStatus
 from payment.utils import Checksum
 
 import os
@@ -21,6 +23,8 @@ def handle_callback(request):
     if verify:
         resp_status = response_dict["STATUS"]
         order_id = response_dict["ORDERID"]
+        # The status itself is taken from the order status API, the payment is checked on the next pass
+        PaymentIntent.objects.filter(order_id=order_id, status=PaymentStatus.PENDING).update(next_check_at=now())
 
         # CORS_ORIGIN_WHITELIST is the front end url
         redirect_url = f'{FRONT_END}/dashboard/shop/plans/buy/payment/{resp_status}/{order_id}'
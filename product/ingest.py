@@ -0,0 +1,272 @@
+import json
+import os
+import time
+import zipfile
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from threading import Lock
+
+from django.db import transaction
+
+from core.utils import image_from_bytes
+from images.dedup import set_name, upload
+from images.models import ImageBlob, Rendition, StoredImage, PRODUCT_THUMB
+from images.renditions import create_renditions
+from storagequeue.models import StorageDeletion
+from .models import Product, ProductImage, ProductCategory, ProductType, MeasurementUnit
+
+# Categories whose products have no mrp, same as AddBrandProduct
+NO_MRP_CATEGORIES = ['raspaaifood', 'raspaaiservices']
+
+
+class ImageSource:
+    # Images of a manifest, either a directory or a zip file. Zip members are read one at a time
+    # since a ZipFile is not safe to read from several threads.
+
+    def __init__(self, path):
+        self.path = path
+        self.zip_file = zipfile.ZipFile(path) if zipfile.is_zipfile(path) else None
+        self.lock = Lock()
+
+    def read(self, name):
+        if self.zip_file is not None:
+            with self.lock:
+                return self.zip_file.read(name)
+
+        with open(os.path.join(self.path, name), 'rb') as image_file:
+            return image_file.read()
+
+    def close(self):
+        if self.zip_file is not None:
+            self.zip_file.close()
+
+
+def with_retries(func, retries, backoff=0.5):
+    # Storage uploads fail now and then, retried with exponential backoff
+    for attempt in range(retries + 1):
+        try:
+            return func()
+        except Exception:
+            if attempt == retries:
+                raise
+            time.sleep(backoff * 2 ** attempt)
+
+
+def decode_image(image_source, image_name):
+    # Runs in a worker thread, the image is resized and hashed but not uploaded
+    return image_from_bytes(image_source.read(image_name), image_name, max_width=Product.IMG_MAX_WIDTH)
+
+
+def process_image(image, img_file, blob, recorded, stored_image, thumbnails, retries):
+    # Runs in a worker thread and never touches the database. An image without a stored blob is
+    # uploaded under its content hash, then its renditions missing from `recorded` are created: the
+    # responsive ones, plus the thumbnails for a primary image. Returns its ImageBlob, its StoredImage
+    # and the manifest rows of its new renditions, unsaved.
+    if blob is None:
+        blob = with_retries(lambda: upload(image, img_file), retries)
+    else:
+        set_name(image, blob.name)
+
+    new_stored_image, renditions = with_retries(lambda: create_renditions(image, 'product_image', recorded,
+                                                                          stored_image, thumbnails), retries)
+    return blob, new_stored_image, renditions
+
+
+class ManifestLookups:
+    # Categories, types and measurement units are few, they are loaded once for the whole manifest
+
+    def __init__(self):
+        self.categories = {category.username: category for category in ProductCategory.objects.all()}
+        self.types = {(product_type.category_id, product_type.username): product_type.id
+                      for product_type in ProductType.objects.all()}
+        self.measurement_units = {unit.name: unit for unit in MeasurementUnit.objects.all()}
+
+    def build_product(self, brand, row):
+        category = self.categories.get(row.get('category'))
+        if category is None:
+            raise Exception(f'No category {row.get("category")} exist')
+
+        type_id = self.types.get((category.id, row.get('type')))
+        if type_id is None:
+            raise Exception(f'No type {row.get("type")} exist in {category.username}')
+
+        images = row.get('images') or []
+        if len(images) == 0:
+            raise Exception("No product images were provided")
+
+        if category.username in NO_MRP_CATEGORIES:
+            mrp = None
+        else:
+            try:
+                mrp = int(row['mrp'])
+            except (KeyError, TypeError, ValueError):
+                raise Exception("A valid mrp is required")
+
+        technical_details = row.get('technical_details') or {}
+
+        product = Product(title=row['title'], brand=brand, mrp=mrp, category=category, type_id=type_id,
+                          description=row['description'], long_description=row['long_description'],
+                          thumb_overlay_text=row.get('thumb_overlay_text'),
+                          measurement_unit=self.measurement_units.get(row.get('measurement_unit')),
+                          technical_details={key: str(value) for key, value in technical_details.items()})
+        product.full_clean(exclude=['brand', 'category', 'type', 'measurement_unit'])
+
+        return product, images
+
+
+def ingest_brand_products(brand, manifest_lines, image_source, workers=8, retries=3, batch_size=100, report=None):
+    """
+    Creates the products of a JSONL manifest for a brand. Each manifest line is a product with title,
+    category and type usernames, mrp, measurement_unit, thumb_overlay_text, description,
+    long_description, technical_details and images, a list of file names in image_source whose
+    order is the image position.
+    Products are bulk created per batch, their images go through a pool of `workers` threads.
+    Images stored already, see images.dedup, are referred to instead of uploaded again.
+    A product whose images can not be processed is not created.
+    report is called with (products done, products per second) after every batch.
+    Returns a dict with the created count and a list of (line number, error).
+    """
+    lookups = ManifestLookups()
+    lines = enumerate(manifest_lines, start=1)
+
+    created = 0
+    errors = []
+    started_at = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            chunk = list(islice(lines, batch_size))
+            if len(chunk) == 0:
+                break
+
+            batch = []
+            for line_number, line in chunk:
+                if not line.strip():
+                    continue
+                try:
+                    batch.append((line_number, *lookups.build_product(brand, json.loads(line))))
+                except Exception as e:
+                    errors.append((line_number, str(e)))
+
+            futures = []
+            for line_number, product, images in batch:
+                futures.append((line_number, product, [
+                    executor.submit(decode_image, image_source, image_name) for image_name in images
+                ]))
+
+            decoded = []
+            for line_number, product, image_futures in futures:
+                files = []
+                for future in image_futures:
+                    try:
+                        files.append(future.result())
+                    except Exception as e:
+                        errors.append((line_number, f'Image could not be processed: {e}'))
+                if len(files) == len(image_futures):
+                    decoded.append((line_number, product, files))
+
+            # Images stored already with the same content hash, by earlier uploads or an earlier line,
+            # are not uploaded again and only their missing renditions are created. Copies within the
+            # batch are processed once, keyed by their stored name or else their content hash.
+            img_files = {img_file.content_hash: img_file for line_number, product, files in decoded
+                         for img_file in files}
+            blobs = ImageBlob.objects.matching(list(img_files.values()))
+            keys = {content_hash: blobs[content_hash].name if content_hash in blobs else content_hash
+                    for content_hash in img_files}
+            names = [blob.name for blob in blobs.values()]
+            recorded = Rendition.objects.recorded(names)
+            stored_images = StoredImage.objects.in_bulk(names, field_name='name')
+            primary_keys = {keys[files[0].content_hash] for line_number, product, files in decoded}
+
+            job_files = {}
+            jobs = {}
+            for content_hash, img_file in img_files.items():
+                key = keys[content_hash]
+                if key in jobs:
+                    continue
+                blob = blobs.get(content_hash)
+                job_files[key] = img_file
+                jobs[key] = executor.submit(process_image, ProductImage().image, img_file, blob, recorded,
+                                            stored_images.get(key), key in primary_keys, retries)
+
+            processed = {}
+            for key, future in jobs.items():
+                # Every future is waited on so the uploads no product refers to can all be removed
+                try:
+                    processed[key] = future.result()
+                except Exception as e:
+                    processed[key] = e
+
+            uses = Counter()
+            done = []
+            for line_number, product, files in decoded:
+                failures = [processed[keys[img_file.content_hash]] for img_file in files
+                            if isinstance(processed[keys[img_file.content_hash]], Exception)]
+                if failures:
+                    errors.append((line_number, f'Image could not be processed: {failures[0]}'))
+                    continue
+                done.append((product, files))
+                uses.update(keys[img_file.content_hash] for img_file in files)
+
+            # Products are only written once their images are uploaded, with their images in one
+            # transaction, so an interrupted batch leaves no product without images behind. Uploads
+            # of an interrupted batch are left unreferenced in storage.
+            with transaction.atomic():
+                stored_blobs = {}
+                new_stored_images = []
+                renditions = []
+                for key, result in processed.items():
+                    if isinstance(result, Exception):
+                        continue
+                    blob, stored_image, image_renditions = result
+                    if not uses[key]:
+                        if blob.pk is None:
+                            StorageDeletion.objects.enqueue([blob.name] + [rendition.path
+                                                                           for rendition in image_renditions])
+                        else:
+                            # The stored image stays, so do the renditions just created for it
+                            if stored_image is not None:
+                                new_stored_images.append(stored_image)
+                            renditions += image_renditions
+                        continue
+
+                    stored = ImageBlob.objects.reference(blob, uses[key])
+                    if stored is None:
+                        # Released by a deletion in between, its files are queued for deletion so it is
+                        # stored again. Its renditions are left to warmproductthumbs.
+                        stored = ImageBlob.objects.reference(upload(ProductImage().image, job_files[key]),
+                                                             uses[key])
+                        stored_image, image_renditions = None, []
+                    elif stored.name != blob.name:
+                        # The same image was stored by another request in between, the copy is not needed
+                        StorageDeletion.objects.enqueue([blob.name] + [rendition.path
+                                                                       for rendition in image_renditions])
+                        stored_image, image_renditions = None, []
+
+                    stored_blobs[key] = stored
+                    if stored_image is not None:
+                        new_stored_images.append(stored_image)
+                    renditions += image_renditions
+                    recorded.update({(rendition.source, rendition.rendition_key): rendition
+                                     for rendition in image_renditions})
+
+                stored_names = {content_hash: stored_blobs[key].name for content_hash, key in keys.items()
+                                if key in stored_blobs}
+                for product, files in done:
+                    primary_name = stored_names[files[0].content_hash]
+                    product.set_thumb(ProductImage(image=primary_name), recorded.get((primary_name, PRODUCT_THUMB)))
+                Product.objects.bulk_create([product for product, files in done])
+
+                ProductImage.objects.bulk_create([
+                    ProductImage(product=product, position=position, image=stored_names[img_file.content_hash])
+                    for product, files in done for position, img_file in enumerate(files)
+                ])
+                Rendition.objects.record(renditions)
+                StoredImage.objects.record(new_stored_images)
+
+            created += len(done)
+            if report is not None:
+                report(created, created / (time.monotonic() - started_at))
+
+    return {'created': created, 'errors': errors}
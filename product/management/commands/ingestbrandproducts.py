@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from product.ingest import ImageSource, ingest_brand_products
+from product.models import Brand
+
+
+class Command(BaseCommand):
+    help = 'Create the products of a JSONL manifest for a brand, with images from a directory or zip file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('brand', help='Username of the brand')
+        parser.add_argument('manifest', help='JSONL file, one product per line')
+        parser.add_argument('images', help='Directory or zip file holding the images named in the manifest')
+        parser.add_argument('--workers', type=int, default=8, help='Threads processing and uploading images')
+        parser.add_argument('--retries', type=int, default=3, help='Retries of a failed image upload')
+        parser.add_argument('--batch-size', type=int, default=100, help='Products created per batch')
+
+    def handle(self, *args, **options):
+        try:
+            brand = Brand.objects.get(username=options['brand'])
+        except Brand.DoesNotExist:
+            raise CommandError(f'No brand with username {options["brand"]} exist')
+
+        def report(done, rate):
+            self.stdout.write(f'{done} products created, {rate:.1f} products/sec')
+
+        image_source = ImageSource(options['images'])
+        try:
+            with open(options['manifest'], encoding='utf-8') as manifest:
+                result = ingest_brand_products(brand, manifest, image_source, workers=options['workers'],
+                                               retries=options['retries'], batch_size=options['batch_size'],
+                                               report=report)
+        finally:
+            image_source.close()
+
+        for line_number, error in result['errors']:
+            self.stderr.write(f'Line {line_number}: {error}')
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully created {result["created"]} products for {brand}'))
@@ -0,0 +1,27 @@
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from images.renditions import warm_renditions
+from product.models import Brand
+
+class Command(BaseCommand):
+    help = 'Create the missing renditions of brand hero_image and record them in the rendition manifest'
+    
+    def handle(self, *args, **options):
+        all_brands = Brand.objects.order_by('id').iterator(chunk_size=500)
+        done = 0
+        failed = []
+        
+        while True:
+            brands = list(islice(all_brands, 500))
+            if len(brands) == 0:
+                break
+            created, batch_failed = warm_renditions([brand.hero_image for brand in brands], 'hero_image')
+            done += created
+            failed += batch_failed
+        
+        if done:
+            self.stdout.write(self.style.SUCCESS(f'Successfully warmed {done} renditions.'))
+            
+        if failed:
+            raise CommandError(f'Failed to warm {len(failed)} images')
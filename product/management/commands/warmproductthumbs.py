@@ -1,19 +1,59 @@
+from itertools import islice
+
 from django.core.management.base import BaseCommand, CommandError
-from versatileimagefield.image_warmer import VersatileImageFieldWarmer
-from product.models import ProductImage
+from images.models import Rendition, PRODUCT_THUMB
+from images.renditions import warm_renditions
+from product.models import Product, ProductImage
+from search.models import ShopProductSearchDoc
+from shop.models import ShopProduct, Combo
 
 class Command(BaseCommand):
-    help = 'Create or check thumbnails of products'
+    help = 'Create the missing thumbnails and responsive renditions of products, record them in the rendition ' \
+           'manifest and copy the thumbnails onto the products'
     
     def handle(self, *args, **options):
         # All product thumbs. Thumbs have position = 0
-        all_thumbs = ProductImage.objects.filter(position=0)
+        all_thumbs = ProductImage.objects.filter(position=0).select_related('product').order_by('id') \
+            .iterator(chunk_size=500)
+        done = 0
+        failed = []
+        
+        while True:
+            product_images = list(islice(all_thumbs, 500))
+            if len(product_images) == 0:
+                break
+            created, batch_failed = warm_renditions([product_image.image for product_image in product_images],
+                                                    'product_image')
+            done += created
+            failed += batch_failed
+
+            recorded = Rendition.objects.recorded([product_image.image.name for product_image in product_images])
+            changed = []
+            for product_image in product_images:
+                product = product_image.product
+                thumb = (product.thumb, product.thumb_width, product.thumb_height)
+                product.set_thumb(product_image, recorded.get((product_image.image.name, PRODUCT_THUMB)))
+                if (product.thumb, product.thumb_width, product.thumb_height) != thumb:
+                    changed.append(product)
+
+            # bulk_update sends no post_save, combos and search docs showing the thumbs are refreshed here
+            Product.objects.bulk_update(changed, ['thumb', 'thumb_width', 'thumb_height'])
+            Combo.objects.filter(products__shop_product__product__in=changed).refresh_thumbs()
+            ShopProductSearchDoc.objects.refresh(ShopProduct.objects.filter(product__in=changed))
         
-        img_warmer = VersatileImageFieldWarmer(instance_or_queryset=all_thumbs, rendition_key_set='product_image', image_attr='image', verbose=True)
-        done, failed = img_warmer.warm()
+        # The other images only get their responsive renditions
+        other_images = ProductImage.objects.exclude(position=0).order_by('id').iterator(chunk_size=500)
+        while True:
+            product_images = list(islice(other_images, 500))
+            if len(product_images) == 0:
+                break
+            created, batch_failed = warm_renditions([product_image.image for product_image in product_images],
+                                                    'product_image', thumbnails=False)
+            done += created
+            failed += batch_failed
         
         if done:
             self.stdout.write(self.style.SUCCESS(f'Successfully warmed {done} thumbs.'))
             
         if failed:
-            raise CommandError(f'Failed to warm {failed} thumbs')
\ No newline at end of file
+            raise CommandError(f'Failed to warm {len(failed)} thumbs')
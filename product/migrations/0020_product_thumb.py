@@ -0,0 +1,54 @@
+# Generated by Django 3.0.3 on 2026-10-19 14:20
+
+from django.db import migrations, models
+
+
+def copy_primary_thumbs(apps, schema_editor):
+    # Thumbnails missing from the manifest keep the name versatileimagefield builds for them
+    Product = apps.get_model('product', 'Product')
+    ProductImage = apps.get_model('product', 'ProductImage')
+    Rendition = apps.get_model('images', 'Rendition')
+
+    primary_images = list(ProductImage.objects.filter(position=0).select_related('product').order_by('id'))
+    for start in range(0, len(primary_images), 1000):
+        batch = primary_images[start:start + 1000]
+        renditions = {rendition.source: rendition for rendition in Rendition.objects.filter(
+            source__in=[product_image.image.name for product_image in batch], rendition_key='thumbnail__200x250')}
+
+        products = []
+        for product_image in batch:
+            product = product_image.product
+            rendition = renditions.get(product_image.image.name)
+            if rendition is not None:
+                product.thumb, product.thumb_width, product.thumb_height = rendition.path, rendition.width, rendition.height
+            else:
+                product.thumb = product_image.image.thumbnail['200x250'].name
+            products.append(product)
+        Product.objects.bulk_update(products, ['thumb', 'thumb_width', 'thumb_height'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0001_rendition_manifest'),
+        ('product', '0019_auto_20200311_1030'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='thumb',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='thumb_height',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='thumb_width',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(copy_primary_thumbs, migrations.RunPython.noop),
+    ]
@@ -2,12 +2,15 @@ from datetime import timedelta
 
 from django.conf import settings
 from django.contrib.postgres.fields import HStoreField
-from django.db import models
+from django.db import models, transaction, connection
 from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.utils.timezone import now
 from versatileimagefield.fields import VersatileImageField
-from versatileimagefield.image_warmer import VersatileImageFieldWarmer
+
+from images.models import Rendition, HERO_THUMB, PRODUCT_THUMB
+from images.renditions import warm_renditions
+from storagequeue.models import StorageDeletion
 
 User = settings.AUTH_USER_MODEL
 
@@ -57,14 +60,15 @@ class Brand(models.Model):
         return self.public_username
         
     def get_thumb(self):
-        # thumb = self.hero_image.thumbnail['480x360']
-        thumb = self.hero_image.thumbnail('360x270')
-        thumb.save("thumbnails")
-        return thumb
+        # Storage path of the hero image thumbnail, see Shop.get_thumb
+        return Rendition.objects.path(self.hero_image, HERO_THUMB, built_names=True)
+
+    def warm_image(self):
+        warm_renditions([self.hero_image], 'hero_image')
 
     def delete_hero_image(self):
-        self.hero_image.delete_all_created_images()
-        self.hero_image.delete(save=False)
+        # The files are removed by the deletequeuedfiles worker
+        StorageDeletion.objects.enqueue_image(self.hero_image, 'hero_image')
 
     def check_plans_validity(self):
         try:
@@ -132,10 +136,8 @@ def delete_Brand_instance(sender, instance, **kwargs):
     owner = instance.owner
     owner.is_brand_owner = False
     owner.save()
-    # Deletes Image Renditions
-    instance.hero_image.delete_all_created_images()
-    # Deletes Original Image
-    instance.hero_image.delete(save=False)
+    # Queues the original image and its renditions for deletion
+    instance.delete_hero_image()
     
 
 class ApplicationStatus(models.Model):
@@ -158,47 +160,70 @@ class BrandApplication(models.Model):
         return self.brand.public_username
 
 
-class BrandPlanQueueManager(models.Manager):
-    def add_plan_to_queue(self, plan_id=None, brand_id=None, plan=None, brand=None, order_id=None):
-        try:
-            plan = BrandPlan.objects.get(id=plan_id) if plan_id else plan
-            brand = Brand.objects.get(id=brand_id) if brand_id else brand
+class PlanQueueManager(models.Manager):
+    # Shared by the brand and shop plan queues, owner_field is the foreign key to the brand or shop
+    owner_field = None
+
+    def credit(self, owner, plan, order_id=None, deactivate_expired=False):
+        """
+        Adds plan to the owner's queue in one transaction. The owner row is locked, so concurrent credits
+        for one owner run one after the other and chain their dates. The insert skips an order id that was
+        credited before (ON CONFLICT (order_id) DO NOTHING) and the plan queued for it then is returned.
+        """
+        with transaction.atomic():
+            list(type(owner).objects.select_for_update().filter(id=owner.id).values_list('id', flat=True))
+
+            owner_plans = self.filter(**{self.owner_field: owner})
+            latest_plan_end_date = owner_plans.order_by('-added_at').values_list('date_end', flat=True).first()
+
+            if latest_plan_end_date is None or latest_plan_end_date < now():
+                # No plans, or all of them expired and will be removed from table by cron job
+                if latest_plan_end_date is not None and deactivate_expired:
+                    owner_plans.update(is_active=False)
+                is_active = True
+                date_start = now()
+            else:
+                # Either an active plan or extra future plans in queue. This plan will not be active and will
+                # continue the dates from previous latest plan
+                is_active = False
+                date_start = latest_plan_end_date
 
-            def add_to_plan_queue(date_start, date_end, is_active=False):
-                brand_plan = self.model(brand=brand, product_space=plan.product_space, plan=plan, is_active=is_active,
-                                        date_start=date_start, order_id=order_id, date_end=date_end)
-                brand_plan.save()
-                if not brand.is_active:
-                    brand.is_active = True
-                    brand.save()
+            queued_plan = self.model(plan=plan, product_space=plan.product_space, is_active=is_active,
+                                     date_start=date_start, date_end=date_start + plan.validity_duration,
+                                     order_id=order_id, **{self.owner_field: owner})
 
-                return brand_plan
+            fields = [field for field in self.model._meta.concrete_fields if not field.primary_key]
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'INSERT INTO {self.model._meta.db_table} ({", ".join(field.column for field in fields)}) '
+                    f'VALUES ({", ".join(["%s"] * len(fields))}) ON CONFLICT (order_id) DO NOTHING RETURNING id',
+                    [field.get_db_prep_save(field.pre_save(queued_plan, True), connection) for field in fields]
+                )
+                row = cursor.fetchone()
 
-            no_brand_plans_in_queue = brand.plans.count()
+            if row is None:
+                return self.get(order_id=order_id)
 
-            if no_brand_plans_in_queue == 0:
-                brand_plan = add_to_plan_queue(is_active=True, date_start=now(),
-                                               date_end=now() + plan.validity_duration)
+            queued_plan.id = row[0]
+            queued_plan._state.adding = False
+            queued_plan._state.db = self.db
 
-            else:
-                brand_plans = brand.plans
-                latest_shop_plan_in_queue = brand_plans.latest('added_at')
-                # New plan start date will be equal to previous plan end date if previous plan is still active
-                latest_plan_end_date = latest_shop_plan_in_queue.date_end
-                end_date = latest_plan_end_date + plan.validity_duration
-
-                if latest_plan_end_date < now():
-                    # it means the brand do not have any active plans. All plans have expired.
-                    # and will be removed from table by cron job
-                    brand_plans.update(is_active=False)
-                    brand_plan = add_to_plan_queue(is_active=True, date_start=now(),
-                                                   date_end=now() + plan.validity_duration)
-                else:
-                    # brand have either active plan or extra future plan in queue. Add another plan in queue
-                    # This plan will not be active and will continue the dates from previous latest plan
-                    brand_plan = add_to_plan_queue(is_active=False, date_start=latest_plan_end_date, date_end=end_date)
+            if not owner.is_active:
+                owner.is_active = True
+                owner.save()
+
+        return queued_plan
 
-            return brand_plan
+
+class BrandPlanQueueManager(PlanQueueManager):
+    owner_field = 'brand'
+
+    def add_plan_to_queue(self, plan_id=None, brand_id=None, plan=None, brand=None, order_id=None):
+        try:
+            plan = BrandPlan.objects.get(id=plan_id) if plan_id else plan
+            brand = Brand.objects.get(id=brand_id) if brand_id else brand
+
+            return self.credit(brand, plan, order_id, deactivate_expired=True)
 
         except self.model.DoesNotExist:
             raise Exception("No brand plan exist with that id")
@@ -253,6 +278,11 @@ class Product(models.Model):
     long_description = models.TextField(max_length=1000)
     is_available = models.BooleanField(default=True)
     technical_details = HStoreField()
+    # Thumbnail of the position 0 image, copied from the rendition manifest by refresh_thumb so
+    # product and combo listings read no images
+    thumb = models.CharField(max_length=255, null=True, blank=True)
+    thumb_width = models.IntegerField(null=True, blank=True)
+    thumb_height = models.IntegerField(null=True, blank=True)
 
     def __str__(self):
         return self.title
@@ -261,9 +291,22 @@ class Product(models.Model):
         return True if self.mrp else False
 
     def get_thumb(self):
-        image = self.images.get(position=0).image
-        thumb = image.thumbnail['200x250']
-        return thumb
+        return self.thumb
+
+    def refresh_thumb(self):
+        # Reads the primary image and its thumbnail, the caller saves the product
+        primary_image = self.images.filter(position=0).first()
+        rendition = Rendition.objects.filter(source=primary_image.image.name, rendition_key=PRODUCT_THUMB).first() \
+            if primary_image else None
+        self.set_thumb(primary_image, rendition)
+
+    def set_thumb(self, primary_image, rendition):
+        if rendition is not None:
+            self.thumb, self.thumb_width, self.thumb_height = rendition.path, rendition.width, rendition.height
+        else:
+            # Without a recorded thumbnail the original image is shown
+            self.thumb = primary_image.image.name if primary_image else None
+            self.thumb_width = self.thumb_height = None
 
 
 class ProductImage(models.Model):
@@ -278,16 +321,10 @@ class ProductImage(models.Model):
 
 @receiver(post_delete, sender=ProductImage)
 def delete_ProductImage_images(sender, instance, **kwargs):
-    # Deletes Image Renditions
-    instance.image.delete_all_created_images()
-    # Deletes Original Image
-    instance.image.delete(save=False)
+    # Queues the original image and its renditions for deletion
+    StorageDeletion.objects.enqueue_image(instance.image, 'product_image')
     
 @receiver(post_save, sender=ProductImage)
 def warm_ProductImage_images(sender, instance, **kwargs):
-    instance_position = instance.position
-    if instance_position == 0:
-        product_img_warmer = VersatileImageFieldWarmer(instance_or_queryset=instance,
-                                                       rendition_key_set='product_image',
-                                                       image_attr='image')
-        product_img_warmer.warm()
+    # Every image gets its responsive renditions, only the primary image is shown as a thumbnail
+    warm_renditions([instance.image], 'product_image', thumbnails=instance.position == 0)
@@ -10,6 +10,8 @@ from graphql_jwt.decorators import login_required, user_passes_test, superuser_r
 from graphql_relay.node.node import from_global_id
 
 from core.utils import image_from_64
+from images.dedup import save_image
+from images.schema import ResponsiveImageType, load_responsive_image
 from search.postgresql_search import search_products_in_brand
 from .models import Product, ProductCategory, ProductType, ProductImage, Brand, ApplicationStatus, BrandPlan, \
     BrandApplication, PlanQueue, MeasurementUnit
@@ -45,11 +47,15 @@ class BrandNode(DjangoObjectType):
     occupied_space = graphene.Int()
     have_active_plan = graphene.Boolean()
     active_plan = graphene.Field(BrandPlanQueueNode)
+    responsive_hero_image = graphene.Field(ResponsiveImageType)
 
     def resolve_occupied_space(self, info, **kwargs):
         space = self.products.count()
         return space
 
+    def resolve_responsive_hero_image(self, info, **kwargs):
+        return load_responsive_image(info, self.hero_image)
+
     def resolve_have_active_plan(self, info, **kwargs):
         return self.have_active_plan()
 
@@ -117,7 +123,7 @@ class ProductNode(DjangoObjectType):
         # Using image.name preserve consitency between non-thumb images and thumb images
         # sized image when returned driectly they return the image.url which include "/media"
         # while simple non-sized images return image url do not contain "/media"
-        thumb_name = self.get_thumb().name
+        thumb_name = self.get_thumb()
         return thumb_name
 
 
@@ -137,6 +143,11 @@ class ProductImageNode(DjangoObjectType):
         filter_fields = ['id']
         interfaces = (graphene.relay.Node,)
 
+    responsive_image = graphene.Field(ResponsiveImageType)
+
+    def resolve_responsive_image(self, info, **kwargs):
+        return load_responsive_image(info, self.image)
+
 
 class ProductCategoryNode(DjangoObjectType):
     class Meta:
@@ -190,7 +201,8 @@ class AdminAddBrand(graphene.relay.ClientIDMutation):
 
                     owner.is_brand_owner = True
                     brand.is_active = True
-                    brand.hero_image.save(hero_img_file.name, hero_img_file)
+                    save_image(brand.hero_image, hero_img_file)
+                    brand.warm_image()
                     owner.save()
 
                     return cls(brand)
@@ -250,6 +262,7 @@ class BrandRegisterApplication(graphene.relay.ClientIDMutation):
                 brand.full_clean(exclude=['hero_image'])
                 brand.hero_image.save(img_name, hero_img_content, save=False)
                 brand.save()
+                brand.warm_image()
 
                 # Create a brand application
                 brand_application = BrandApplication(brand=brand, status=application_status)
@@ -369,7 +382,11 @@ class AddBrandProduct(graphene.relay.ClientIDMutation):
                 img_file = image_from_64(img64, img_name, max_width=Product.IMG_MAX_WIDTH)
 
                 product_image = ProductImage(product=product, position=position)
-                product_image.image.save(img_file.name, img_file)
+                save_image(product_image.image, img_file)
+
+            # The position 0 image was warmed when it was saved
+            product.refresh_thumb()
+            product.save(update_fields=['thumb', 'thumb_width', 'thumb_height'])
 
         except Exception as e:
             product.delete()
@@ -503,7 +520,10 @@ class ModifyBrandProduct(graphene.relay.ClientIDMutation):
                             img_file = image_from_64(img64, img_name, Product.IMG_MAX_WIDTH)
 
                             product_image_obj = ProductImage.objects.create(product=product, position=position)
-                            product_image_obj.image.save(img_file.name, img_file)
+                            save_image(product_image_obj.image, img_file)
+
+                    # The primary image may have been deleted, moved or added
+                    product.refresh_thumb()
                 
                 product.save()
 
@@ -50,7 +50,12 @@ INSTALLED_APPS = [
     'user.apps.UserConfig',
     'product.apps.ProductConfig',
     'shop.apps.ShopConfig',
-    'order.apps.OrderConfig'
+    'order.apps.OrderConfig',
+    'search.apps.SearchConfig',
+    'mailqueue.apps.MailqueueConfig',
+    'payment.apps.PaymentConfig',
+    'images.apps.ImagesConfig',
+    'storagequeue.apps.StoragequeueConfig',
 ]
 
 AUTH_USER_MODEL = 'user.User'
@@ -69,6 +74,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'user.auth.JSONWebTokenRequestMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -157,11 +163,12 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
 # Email Settings
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
-EMAIL_USE_TLS = True
-EMAIL_HOST = 'smtp.gmail.com'
+# Host and port can point at a local SMTP sink, see the sendqueuedemails command
+EMAIL_USE_TLS = os.environ.get('EMAIL_USE_TLS', 'true').lower() == 'true'
+EMAIL_HOST = os.environ.get('EMAIL_HOST', 'smtp.gmail.com')
 EMAIL_HOST_USER = os.environ.get('EMAIL_USER')
 EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_PASS')
-EMAIL_PORT = 587
+EMAIL_PORT = int(os.environ.get('EMAIL_PORT', 587))
 
 # AWS S3 bucket configuration
 AWS_ACCESS_KEY_ID = os.environ.get('AWS_ACCESS_KEY_ID')
@@ -184,7 +191,7 @@ GRAPHENE = {
 }
 
 AUTHENTICATION_BACKENDS = [
-    'graphql_jwt.backends.JSONWebTokenBackend',
+    'user.auth.CachedJSONWebTokenBackend',
     'django.contrib.auth.backends.ModelBackend',
 ]
 
@@ -204,6 +211,9 @@ CORS_ALLOW_CREDENTIALS = (
     True
 )
 
+# Dotted path of the search.backends.SearchBackend serving product and combo search
+SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND', 'search.backends.postgres.PostgresSearchBackend')
+
 VERSATILEIMAGEFIELD_SETTINGS = {
     'create_images_on_demand': False,
 }
@@ -219,6 +229,16 @@ VERSATILEIMAGEFIELD_RENDITION_KEY_SETS = {
     ]
 }
 
+# Widths of the WebP, AVIF and JPEG renditions made for srcset, per rendition key set, see images.renditions
+RESPONSIVE_IMAGE_WIDTHS = {
+    'hero_image': [240, 360, 720],
+    'product_image': [160, 320, 480],
+}
+
+# Local disk cache of the images rendered by the resize endpoint, see images.resize
+IMAGE_RESIZE_CACHE_DIR = os.environ.get('IMAGE_RESIZE_CACHE_DIR', os.path.join(BASE_DIR, 'image_cache'))
+IMAGE_RESIZE_CACHE_BYTES = int(os.environ.get('IMAGE_RESIZE_CACHE_BYTES', 1024 ** 3))
+
 
 if 'RDS_HOSTNAME' in os.environ:
     GDAL_LIBRARY_PATH = '/usr/local/lib/libgdal.so'
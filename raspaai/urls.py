@@ -20,13 +20,19 @@ from graphene_django.views import GraphQLView
 from django.conf import settings
 from django.conf.urls.static import static
 
+from images import views as images_view
 from payment import views as payment_view
+from shop import views as shop_view
 from .views import read_file
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('graphql/', csrf_exempt(GraphQLView.as_view(graphiql=True))),
     path('paytm/callback/', payment_view.handle_callback),
+    path('shop/catalog/import/', shop_view.import_shop_catalog),
+    path('shop/catalog/update/', shop_view.update_shop_catalog),
+    path('shop/catalog/export/', shop_view.export_shop_catalog),
+    path('images/resize/', images_view.resize_image, name='resize_image'),
     # path('.well-known/acme-challenge/IeC426ptXRu29W5x0-wgUYokbwYGckrkpylNLyzcJ9E', read_file)
 ]
 
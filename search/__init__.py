@@ -0,0 +1,11 @@
+class SearchSort:
+    # Result orders of product and combo search
+    RELEVANCE = 'relevance'
+    PRICE = 'price'
+    DISTANCE = 'distance'
+
+    CHOICES = [
+        (RELEVANCE, 'Relevance'),
+        (PRICE, 'Price'),
+        (DISTANCE, 'Distance'),
+    ]
@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.contrib.gis.measure import D
+from django.utils.module_loading import import_string
+
+from search import SearchSort
+from shop.models import Shop
+
+_backend = None
+
+
+class SearchBackend:
+    """
+    Interface of a product and combo search engine. Backends are built once per worker process.
+    Shop product results are ShopProductSearchDoc objects and combo results are Combo objects, both
+    ordered by `sort`, a SearchSort, and carrying their distance from coords as a D in `distance`.
+    """
+
+    def index(self, shop_product_ids=(), combo_ids=()):
+        # (Re)indexes the given documents, called after their search docs were refreshed
+        raise NotImplementedError
+
+    def delete(self, shop_product_ids=(), combo_ids=()):
+        raise NotImplementedError
+
+    def search_shop_products(self, phrase, coords, km=None, shops=None, sort=SearchSort.PRICE):
+        # coords is {'lat', 'lng'}, shops optionally restricts results to a Shop queryset
+        raise NotImplementedError
+
+    def search_combos(self, phrase, coords, km=None, shops=None, sort=SearchSort.PRICE):
+        raise NotImplementedError
+
+    def nearby_shop_ids(self, coords, km):
+        # Ids of the active shops within km of coords
+        ref_location = Point(coords['lng'], coords['lat'], srid=4326)
+        return set(Shop.objects.filter(location__dwithin=(ref_location, D(km=km)), is_active=True)
+                   .values_list('id', flat=True))
+
+
+def get_search_backend():
+    # settings.SEARCH_BACKEND is the dotted path of a SearchBackend subclass
+    global _backend
+    if _backend is None:
+        _backend = import_string(settings.SEARCH_BACKEND)()
+    return _backend
@@ -0,0 +1,270 @@
+import math
+import re
+import time
+from collections import Counter, namedtuple
+from threading import RLock
+
+from django.contrib.gis.measure import D
+from django.db.models import Max
+
+from search import SearchSort
+from search.models import SearchChange, SearchChangeLog, ShopProductSearchDoc, ComboSearchDoc
+from search.postgresql_search import RELEVANCE_DISTANCE_WEIGHT, RELEVANCE_PRICE_WEIGHT, search_range
+from shop.models import Combo
+from . import SearchBackend
+
+# Same cut offs as the postgres backend
+SIMILARITY_THRESHOLD = 0.1
+# Stands in for ts_rank of a description matching every word of the phrase
+DESCRIPTION_MATCH_SCORE = 0.1
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LATITUDE = math.pi * EARTH_RADIUS_KM / 180
+
+WORD_RE = re.compile(r'[^\W_]+')
+
+Entry = namedtuple('Entry', ['shop_id', 'lat', 'lng', 'is_active', 'price', 'trigrams', 'tokens'])
+
+
+def words(text):
+    return WORD_RE.findall((text or '').lower())
+
+
+def trigrams(text):
+    # pg_trgm: every word is padded with two spaces in front and one behind
+    result = set()
+    for word in words(text):
+        padded = f'  {word} '
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+def distance_km(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, [lat1, lng1, lat2, lng2])
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+class MemoryIndex:
+    """
+    Trigram index over names and an inverted word index over descriptions, with the location, active
+    flag and price needed to filter and order results. Matching follows the postgres backend: name
+    similarity above SIMILARITY_THRESHOLD or every word of the phrase in the description. Words are not
+    stemmed, so description matches are stricter than postgres full text search.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.trigram_index = {}
+        self.word_index = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, doc_id, shop_id, location, is_active, price, name, description):
+        self.remove(doc_id)
+
+        entry = Entry(shop_id=shop_id, lat=location.y if location else None, lng=location.x if location else None,
+                      is_active=is_active, price=price, trigrams=trigrams(name), tokens=set(words(description)))
+        self.entries[doc_id] = entry
+        for trigram in entry.trigrams:
+            self.trigram_index.setdefault(trigram, set()).add(doc_id)
+        for token in entry.tokens:
+            self.word_index.setdefault(token, set()).add(doc_id)
+
+    def remove(self, doc_id):
+        entry = self.entries.pop(doc_id, None)
+        if entry is None:
+            return
+
+        for trigram in entry.trigrams:
+            self.trigram_index[trigram].discard(doc_id)
+            if not self.trigram_index[trigram]:
+                del self.trigram_index[trigram]
+        for token in entry.tokens:
+            self.word_index[token].discard(doc_id)
+            if not self.word_index[token]:
+                del self.word_index[token]
+
+    def match(self, phrase):
+        # Returns {doc id: text score} of the docs matching the phrase
+        phrase_trigrams = trigrams(phrase)
+        shared = Counter()
+        for trigram in phrase_trigrams:
+            shared.update(self.trigram_index.get(trigram, ()))
+
+        matches = {}
+        for doc_id, count in shared.items():
+            similarity = count / (len(phrase_trigrams) + len(self.entries[doc_id].trigrams) - count)
+            if similarity > SIMILARITY_THRESHOLD:
+                matches[doc_id] = similarity
+
+        phrase_words = set(words(phrase))
+        if phrase_words:
+            for doc_id in set.intersection(*[self.word_index.get(word, set()) for word in phrase_words]):
+                matches[doc_id] = matches.get(doc_id, 0) + DESCRIPTION_MATCH_SCORE
+
+        return matches
+
+    def search(self, phrase, coords, km=None, shop_ids=None, sort=SearchSort.PRICE):
+        # Returns (doc id, distance in km) of the matching docs, ordered like the postgres backend
+        km = search_range(km)
+        results = []
+        for doc_id, text_score in self.match(phrase).items():
+            entry = self.entries[doc_id]
+            distance = distance_km(coords['lat'], coords['lng'], entry.lat, entry.lng) \
+                if entry.lat is not None else None
+            if shop_ids:
+                if entry.shop_id not in shop_ids:
+                    continue
+            elif not entry.is_active or distance is None or distance > km:
+                continue
+
+            if sort == SearchSort.RELEVANCE:
+                score = text_score - RELEVANCE_DISTANCE_WEIGHT * (distance or 0) / km \
+                    - RELEVANCE_PRICE_WEIGHT * math.log(float(entry.price) + 1)
+                order = (-score,)
+            elif sort == SearchSort.DISTANCE:
+                order = (distance is None, distance or 0, entry.price)
+            else:
+                order = (entry.price,)
+            results.append((order, doc_id, distance))
+
+        return [(doc_id, distance) for order, doc_id, distance in sorted(results)]
+
+
+class InMemorySearchBackend(SearchBackend):
+    """
+    Keeps a MemoryIndex of shop products and one of combos in every worker process, loaded from the
+    search docs. Before a search, at most once per REFRESH_INTERVAL seconds, the SearchChangeLog rows
+    written since the last refresh are replayed. Everything is reloaded every FULL_RELOAD_INTERVAL
+    seconds so nothing is missed once old log rows are pruned.
+    """
+
+    REFRESH_INTERVAL = 5
+    FULL_RELOAD_INTERVAL = 60 * 60
+
+    def __init__(self):
+        self.lock = RLock()
+        self.shop_products = MemoryIndex()
+        self.combos = MemoryIndex()
+        # shop id: (lat, lng, is_active) of the shops of the loaded docs
+        self.shops = {}
+        self.last_change_id = None
+        self.refreshed_at = 0
+        self.reloaded_at = 0
+
+    def load_shop_products(self, docs):
+        for doc in docs.values('shop_product_id', 'shop_id', 'shop_location', 'shop_is_active', 'offered_price',
+                               'title', 'description').iterator():
+            self.shop_products.add(doc['shop_product_id'], doc['shop_id'], doc['shop_location'],
+                                   doc['shop_is_active'], doc['offered_price'], doc['title'], doc['description'])
+            self.add_shop(doc['shop_id'], doc['shop_location'], doc['shop_is_active'])
+
+    def load_combos(self, docs):
+        for doc in docs.values('combo_id', 'shop_id', 'shop_location', 'shop_is_active', 'offered_price', 'name',
+                               'description').iterator():
+            self.combos.add(doc['combo_id'], doc['shop_id'], doc['shop_location'], doc['shop_is_active'],
+                            doc['offered_price'], doc['name'], doc['description'])
+            self.add_shop(doc['shop_id'], doc['shop_location'], doc['shop_is_active'])
+
+    def add_shop(self, shop_id, location, is_active):
+        self.shops[shop_id] = (location.y if location else None, location.x if location else None, is_active)
+
+    def reload(self):
+        # Changes logged while loading are replayed by the next refresh, replaying is idempotent
+        self.last_change_id = SearchChangeLog.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+        self.shop_products = MemoryIndex()
+        self.combos = MemoryIndex()
+        self.shops = {}
+        self.load_shop_products(ShopProductSearchDoc.objects.all())
+        self.load_combos(ComboSearchDoc.objects.all())
+        self.reloaded_at = self.refreshed_at = time.monotonic()
+
+    def apply_changes(self):
+        changes = SearchChangeLog.objects.filter(id__gt=self.last_change_id).order_by('id') \
+            .values_list('id', 'kind', 'object_id')
+
+        shop_product_ids = set()
+        combo_ids = set()
+        shop_ids = set()
+        for change_id, kind, object_id in changes.iterator():
+            self.last_change_id = change_id
+            if kind == SearchChange.SHOP_PRODUCT:
+                shop_product_ids.add(object_id)
+            elif kind == SearchChange.COMBO:
+                combo_ids.add(object_id)
+            elif kind == SearchChange.SHOP:
+                shop_ids.add(object_id)
+
+        # Only the latest state counts, changed docs are read again from the doc tables
+        if shop_ids:
+            self.load_shop_products(ShopProductSearchDoc.objects.filter(shop__in=shop_ids))
+            self.load_combos(ComboSearchDoc.objects.filter(shop__in=shop_ids))
+        self.index(shop_product_ids, combo_ids)
+
+        self.refreshed_at = time.monotonic()
+
+    def refresh(self):
+        with self.lock:
+            now = time.monotonic()
+            if self.last_change_id is None or now - self.reloaded_at > self.FULL_RELOAD_INTERVAL:
+                self.reload()
+            elif now - self.refreshed_at > self.REFRESH_INTERVAL:
+                self.apply_changes()
+
+    def index(self, shop_product_ids=(), combo_ids=()):
+        # Reads the current docs, ids without one are dropped
+        with self.lock:
+            self.delete(shop_product_ids, combo_ids)
+            if shop_product_ids:
+                self.load_shop_products(ShopProductSearchDoc.objects.filter(shop_product__in=shop_product_ids))
+            if combo_ids:
+                self.load_combos(ComboSearchDoc.objects.filter(combo__in=combo_ids))
+
+    def delete(self, shop_product_ids=(), combo_ids=()):
+        with self.lock:
+            for shop_product_id in shop_product_ids:
+                self.shop_products.remove(shop_product_id)
+            for combo_id in combo_ids:
+                self.combos.remove(combo_id)
+
+    def search_ids(self, index_name, phrase, coords, km, shops, sort):
+        self.refresh()
+        # Like the postgres backend, no matching shop means a search around coords
+        shop_ids = set(shops.values_list('id', flat=True)) if shops is not None else None
+        with self.lock:
+            # A reload replaces the indexes, so they are looked up after the refresh
+            return getattr(self, index_name).search(phrase, coords, km, shop_ids, sort)
+
+    def nearby_shop_ids(self, coords, km):
+        # From the shop locations of the loaded docs, without a query. Shops without products or combos
+        # are not in the docs and are left out.
+        self.refresh()
+        with self.lock:
+            shops = list(self.shops.items())
+
+        lat_span = km / KM_PER_DEGREE_LATITUDE
+        return {shop_id for shop_id, (lat, lng, is_active) in shops
+                if is_active and lat is not None and abs(lat - coords['lat']) <= lat_span
+                and distance_km(coords['lat'], coords['lng'], lat, lng) <= km}
+
+    @staticmethod
+    def ordered(objects, ranked):
+        results = []
+        for object_id, distance in ranked:
+            if object_id in objects:
+                objects[object_id].distance = D(km=distance) if distance is not None else None
+                results.append(objects[object_id])
+        return results
+
+    def search_shop_products(self, phrase, coords, km=None, shops=None, sort=SearchSort.PRICE):
+        ranked = self.search_ids('shop_products', phrase, coords, km, shops, sort)
+        docs = ShopProductSearchDoc.objects.prefetch_related('shop', 'product') \
+            .in_bulk([doc_id for doc_id, distance in ranked])
+        return self.ordered(docs, ranked)
+
+    def search_combos(self, phrase, coords, km=None, shops=None, sort=SearchSort.PRICE):
+        ranked = self.search_ids('combos', phrase, coords, km, shops, sort)
+        combos = Combo.objects.select_related('shop').in_bulk([combo_id for combo_id, distance in ranked])
+        return self.ordered(combos, ranked)
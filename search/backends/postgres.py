@@ -0,0 +1,25 @@
+from search import SearchSort
+from search.models import ShopProductSearchDoc, ComboSearchDoc
+from search.postgresql_search import shop_product_search, combos_search
+from shop.models import ShopProduct, Combo
+from . import SearchBackend
+
+
+class PostgresSearchBackend(SearchBackend):
+    # Trigram and full text search over the search doc tables, indexing is the doc refresh itself
+
+    def index(self, shop_product_ids=(), combo_ids=()):
+        if shop_product_ids:
+            ShopProductSearchDoc.objects.refresh(ShopProduct.objects.filter(id__in=shop_product_ids))
+        if combo_ids:
+            ComboSearchDoc.objects.refresh(Combo.objects.filter(id__in=combo_ids))
+
+    def delete(self, shop_product_ids=(), combo_ids=()):
+        ShopProductSearchDoc.objects.filter(shop_product__in=shop_product_ids).delete()
+        ComboSearchDoc.objects.filter(combo__in=combo_ids).delete()
+
+    def search_shop_products(self, phrase, coords, km=None, shops=None, sort=SearchSort.PRICE):
+        return shop_product_search(phrase, coords, km, shops=shops, sort=sort)
+
+    def search_combos(self, phrase, coords, km=None, shops=None, sort=SearchSort.PRICE):
+        return combos_search(phrase, coords, km, shops=shops, sort=sort)
@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+
+DEFAULT_BACKENDS = [
+    'search.backends.postgres.PostgresSearchBackend',
+    'search.backends.memory.InMemorySearchBackend',
+]
+
+
+class Command(BaseCommand):
+    help = 'Time product and combo search of the given phrases on each search backend'
+
+    def add_arguments(self, parser):
+        parser.add_argument('phrases', nargs='+')
+        parser.add_argument('--lat', type=float, required=True)
+        parser.add_argument('--lng', type=float, required=True)
+        parser.add_argument('--km', type=int, help='Search radius, defaults to the backend default')
+        parser.add_argument('--repeat', type=int, default=20, help='Searches per phrase')
+        parser.add_argument('--backend', action='append', dest='backends',
+                            help='Dotted path of a backend, can be repeated. Defaults to postgres and in memory')
+
+    def handle(self, *args, **options):
+        coords = {'lat': options['lat'], 'lng': options['lng']}
+
+        for path in options['backends'] or DEFAULT_BACKENDS:
+            backend = import_string(path)()
+
+            # The first search builds in process indexes, it is timed on its own
+            started_at = time.monotonic()
+            backend.search_shop_products(options['phrases'][0], coords, options['km'])
+            self.stdout.write(f'{path}: first search {(time.monotonic() - started_at) * 1000:.1f} ms')
+
+            for phrase in options['phrases']:
+                for name, search in [('products', backend.search_shop_products), ('combos', backend.search_combos)]:
+                    started_at = time.monotonic()
+                    for i in range(options['repeat']):
+                        results = len(search(phrase, coords, options['km']))
+                    took = (time.monotonic() - started_at) * 1000 / options['repeat']
+                    self.stdout.write(f'  {phrase!r} {name}: {results} results, {took:.1f} ms')
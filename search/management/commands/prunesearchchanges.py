@@ -0,0 +1,17 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+
+from search.models import SearchChangeLog
+
+
+class Command(BaseCommand):
+    help = 'Delete search change log rows older than the given number of days'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=2, help='Keep the changes of this many days')
+
+    def handle(self, *args, **options):
+        deleted = SearchChangeLog.objects.prune(now() - timedelta(days=options['days']))
+        self.stdout.write(self.style.SUCCESS(f'Successfully deleted {deleted} search changes'))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from search.models import ShopProductSearchDoc, ComboSearchDoc
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the shop product and combo search documents in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Documents rebuilt per transaction')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        shop_products = ShopProductSearchDoc.objects.rebuild(batch_size=batch_size)
+        self.stdout.write(f'Rebuilt {shop_products} shop product documents')
+
+        combos = ComboSearchDoc.objects.rebuild(batch_size=batch_size)
+        self.stdout.write(f'Rebuilt {combos} combo documents')
+
+        self.stdout.write(self.style.SUCCESS('Successfully rebuilt search documents'))
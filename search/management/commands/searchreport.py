@@ -0,0 +1,48 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Avg, Count, Q
+from django.utils.timezone import now
+
+from search.models import SearchQueryLog
+
+
+class Command(BaseCommand):
+    help = 'Print the top searches and the searches without results of every area from the search log'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7, help='Searches of this many past days')
+        parser.add_argument('--top', type=int, default=10, help='Phrases listed per area')
+        parser.add_argument('--kind', choices=[SearchQueryLog.PRODUCTS, SearchQueryLog.COMBOS],
+                            help='Only products or only combos searches')
+
+    def handle(self, *args, **options):
+        searches = SearchQueryLog.objects.filter(created__gte=now() - timedelta(days=options['days']))
+        if options['kind']:
+            searches = searches.filter(kind=options['kind'])
+
+        phrases = searches.values('lat_cell', 'lng_cell', 'normalized_phrase') \
+            .annotate(searches=Count('id'), zero_results=Count('id', filter=Q(results=0)),
+                      avg_results=Avg('results'), avg_latency=Avg('latency_ms')) \
+            .order_by('lat_cell', 'lng_cell', '-searches')
+
+        areas = {}
+        for row in phrases.iterator():
+            areas.setdefault((row['lat_cell'], row['lng_cell']), []).append(row)
+
+        totals = {area: sum(row['searches'] for row in rows) for area, rows in areas.items()}
+        for lat_cell, lng_cell in sorted(areas, key=lambda area: -totals[area]):
+            rows = areas[(lat_cell, lng_cell)]
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f'Area {lat_cell}, {lng_cell}: {totals[(lat_cell, lng_cell)]} searches'))
+
+            self.stdout.write('  Top searches')
+            for row in rows[:options['top']]:
+                self.stdout.write(f'    {row["normalized_phrase"]!r}: {row["searches"]} searches, '
+                                  f'{row["avg_results"]:.1f} results, {row["avg_latency"]:.0f} ms')
+
+            zero_rows = sorted([row for row in rows if row['zero_results']], key=lambda row: -row['zero_results'])
+            if zero_rows:
+                self.stdout.write('  Searches without results')
+                for row in zero_rows[:options['top']]:
+                    self.stdout.write(f'    {row["normalized_phrase"]!r}: {row["zero_results"]} of {row["searches"]}')
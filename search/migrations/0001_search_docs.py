@@ -0,0 +1,81 @@
+# Generated by Django 3.0.3 on 2026-10-19 14:01
+
+import django.contrib.gis.db.models.fields
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension
+import django.contrib.postgres.search
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('product', '0019_auto_20200311_1030'),
+        ('shop', '0017_auto_20200311_1030'),
+    ]
+
+    operations = [
+        # The trigram indexes below need pg_trgm, which search has been using without a migration
+        TrigramExtension(),
+        migrations.CreateModel(
+            name='ShopProductSearchDoc',
+            fields=[
+                ('shop_product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_doc', serialize=False, to='shop.ShopProduct')),
+                ('shop_location', django.contrib.gis.db.models.fields.PointField(geography=True, null=True, srid=4326)),
+                ('shop_is_active', models.BooleanField(default=False)),
+                ('title', models.CharField(max_length=100)),
+                ('description', models.CharField(max_length=200)),
+                ('search_vector', django.contrib.postgres.search.SearchVectorField(null=True)),
+                ('offered_price', models.DecimalField(decimal_places=0, default=0, max_digits=9)),
+                ('mrp', models.DecimalField(blank=True, decimal_places=0, max_digits=9, null=True)),
+                ('in_stock', models.BooleanField(default=True)),
+                ('is_available', models.BooleanField(default=True)),
+                ('category_username', models.CharField(max_length=20)),
+                ('thumb', models.CharField(blank=True, max_length=255, null=True)),
+                ('created_at', models.DateTimeField(null=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='product.Product')),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='shop.Shop')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ComboSearchDoc',
+            fields=[
+                ('combo', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_doc', serialize=False, to='shop.Combo')),
+                ('shop_location', django.contrib.gis.db.models.fields.PointField(geography=True, null=True, srid=4326)),
+                ('shop_is_active', models.BooleanField(default=False)),
+                ('name', models.CharField(max_length=200)),
+                ('description', models.CharField(max_length=255)),
+                ('search_vector', django.contrib.postgres.search.SearchVectorField(null=True)),
+                ('offered_price', models.DecimalField(decimal_places=0, default=0, max_digits=9)),
+                ('created_at', models.DateTimeField(null=True)),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='shop.Shop')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='shopproductsearchdoc',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['title'], name='shopproductdoc_title_trgm', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='shopproductsearchdoc',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='shopproductdoc_search_vector'),
+        ),
+        migrations.AddIndex(
+            model_name='shopproductsearchdoc',
+            index=models.Index(fields=['offered_price'], name='shopproductdoc_offered_price'),
+        ),
+        migrations.AddIndex(
+            model_name='combosearchdoc',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['name'], name='combodoc_name_trgm', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='combosearchdoc',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='combodoc_search_vector'),
+        ),
+        migrations.AddIndex(
+            model_name='combosearchdoc',
+            index=models.Index(fields=['offered_price'], name='combodoc_offered_price'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.0.3 on 2026-10-19 14:05
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0001_search_docs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchChangeLog',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('shop_product', 'Shop product'), ('combo', 'Combo'), ('shop', 'Shop')], max_length=16)),
+                ('object_id', models.IntegerField()),
+                ('deleted', models.BooleanField(default=False)),
+                ('created', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.0.3 on 2026-10-19 14:09
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0002_search_change_log'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchQueryLog',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('products', 'Products'), ('combos', 'Combos')], max_length=10)),
+                ('phrase', models.CharField(max_length=255)),
+                ('normalized_phrase', models.CharField(max_length=255)),
+                ('lat_cell', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('lng_cell', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('results', models.IntegerField()),
+                ('latency_ms', models.IntegerField()),
+                ('created', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
@@ -0,0 +1,268 @@
+from django.contrib.gis.db.models import PointField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.db import models, transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils.timezone import now
+
+from product.models import Product
+from shop.models import Shop, ShopProduct, Combo
+
+
+class SearchChange:
+    SHOP_PRODUCT = 'shop_product'
+    COMBO = 'combo'
+    # Every doc of the shop changed, its location or active flag
+    SHOP = 'shop'
+
+    CHOICES = [
+        (SHOP_PRODUCT, 'Shop product'),
+        (COMBO, 'Combo'),
+        (SHOP, 'Shop'),
+    ]
+
+
+class SearchChangeLogManager(models.Manager):
+    def log(self, kind, object_ids, deleted=False):
+        self.bulk_create([self.model(kind=kind, object_id=object_id, deleted=deleted) for object_id in object_ids])
+
+    def prune(self, before):
+        return self.filter(created__lt=before).delete()[0]
+
+
+class SearchChangeLog(models.Model):
+    # Append only log of search doc changes. In process search backends replay it to stay current
+    # without reloading everything, see search.backends.memory
+    id = models.BigAutoField(primary_key=True)
+    kind = models.CharField(max_length=16, choices=SearchChange.CHOICES)
+    object_id = models.IntegerField()
+    deleted = models.BooleanField(default=False)
+    created = models.DateTimeField(default=now, db_index=True)
+
+    objects = SearchChangeLogManager()
+
+    def __str__(self):
+        return f'{self.kind} {self.object_id}'
+
+
+class SearchQueryLog(models.Model):
+    # One row per product or combo search, written in batches by search.querylog. Coords are
+    # floored to a grid cell of GRID_CELL degrees, no exact user location is kept.
+    GRID_CELL = 0.05
+
+    PRODUCTS = 'products'
+    COMBOS = 'combos'
+    KIND_CHOICES = [
+        (PRODUCTS, 'Products'),
+        (COMBOS, 'Combos'),
+    ]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    phrase = models.CharField(max_length=255)
+    normalized_phrase = models.CharField(max_length=255)
+    lat_cell = models.DecimalField(max_digits=5, decimal_places=2)
+    lng_cell = models.DecimalField(max_digits=5, decimal_places=2)
+    results = models.IntegerField()
+    latency_ms = models.IntegerField()
+    created = models.DateTimeField(default=now, db_index=True)
+
+    def __str__(self):
+        return self.phrase
+
+
+# Search documents are flat copies of what product and combo search filter and rank on, so a search
+# is a single indexed query on one table instead of joining shops, products, categories and images.
+# They are kept current by the receivers below, bulk writes refresh them explicitly and the
+# rebuildsearchdocs command rebuilds them in batches.
+
+class ShopProductSearchDocManager(models.Manager):
+    def refresh(self, shop_products):
+        # Rebuilds the docs of a ShopProduct queryset with one read, a delete, a bulk insert and the
+        # tsvector update
+        shop_products = shop_products.select_related('shop', 'product__category')
+
+        docs = []
+        for shop_product in shop_products:
+            product = shop_product.product
+            docs.append(self.model(shop_product=shop_product, shop=shop_product.shop, product=product,
+                                   shop_location=shop_product.shop.location,
+                                   shop_is_active=shop_product.shop.is_active,
+                                   title=product.title, description=product.description,
+                                   offered_price=shop_product.offered_price, mrp=product.mrp,
+                                   in_stock=shop_product.in_stock, is_available=shop_product.is_available,
+                                   category_username=product.category.username,
+                                   thumb=product.thumb,
+                                   created_at=shop_product.created_at))
+
+        doc_ids = [doc.shop_product_id for doc in docs]
+        with transaction.atomic():
+            self.filter(shop_product__in=shop_products.values('id')).delete()
+            self.bulk_create(docs)
+            self.filter(shop_product__in=doc_ids).update(search_vector=SearchVector('description'))
+            SearchChangeLog.objects.log(SearchChange.SHOP_PRODUCT, doc_ids)
+
+    def rebuild(self, batch_size=1000):
+        shop_product_ids = list(ShopProduct.objects.order_by('id').values_list('id', flat=True))
+        for start in range(0, len(shop_product_ids), batch_size):
+            self.refresh(ShopProduct.objects.filter(id__in=shop_product_ids[start:start + batch_size]))
+
+        self.exclude(shop_product__in=ShopProduct.objects.values('id')).delete()
+        return len(shop_product_ids)
+
+
+class ShopProductSearchDoc(models.Model):
+    shop_product = models.OneToOneField(ShopProduct, primary_key=True, related_name='search_doc',
+                                        on_delete=models.CASCADE)
+    # Only used to render results, search filters on the copied columns
+    shop = models.ForeignKey(Shop, related_name='+', on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, related_name='+', on_delete=models.CASCADE)
+    shop_location = PointField(geography=True, srid=4326, null=True)
+    shop_is_active = models.BooleanField(default=False)
+    title = models.CharField(max_length=100)
+    description = models.CharField(max_length=200)
+    search_vector = SearchVectorField(null=True)
+    offered_price = models.DecimalField(default=0, max_digits=9, decimal_places=0)
+    mrp = models.DecimalField(null=True, blank=True, max_digits=9, decimal_places=0)
+    in_stock = models.BooleanField(default=True)
+    is_available = models.BooleanField(default=True)
+    category_username = models.CharField(max_length=20)
+    thumb = models.CharField(max_length=255, null=True, blank=True)
+    created_at = models.DateTimeField(null=True)
+
+    objects = ShopProductSearchDocManager()
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['title'], name='shopproductdoc_title_trgm', opclasses=['gin_trgm_ops']),
+            GinIndex(fields=['search_vector'], name='shopproductdoc_search_vector'),
+            models.Index(fields=['offered_price'], name='shopproductdoc_offered_price'),
+        ]
+
+    def __str__(self):
+        return self.title
+
+    # Docs are rendered as ShopProductNode, these mirror the ShopProduct fields it reads
+
+    @property
+    def id(self):
+        return self.shop_product_id
+
+    @property
+    def combo_products(self):
+        return self.shop_product.combo_products.all()
+
+    @property
+    def cartitem_set(self):
+        return self.shop_product.cartitem_set.all()
+
+    @property
+    def orderitem_set(self):
+        return self.shop_product.orderitem_set.all()
+
+    @property
+    def search_doc(self):
+        return self
+
+
+class ComboSearchDocManager(models.Manager):
+    def refresh(self, combos):
+        combos = combos.select_related('shop')
+
+        docs = [self.model(combo=combo, shop=combo.shop, shop_location=combo.shop.location,
+                           shop_is_active=combo.shop.is_active, name=combo.name, description=combo.description,
+                           offered_price=combo.offered_price, created_at=combo.created_at)
+                for combo in combos]
+
+        doc_ids = [doc.combo_id for doc in docs]
+        with transaction.atomic():
+            self.filter(combo__in=combos.values('id')).delete()
+            self.bulk_create(docs)
+            self.filter(combo__in=doc_ids).update(search_vector=SearchVector('description'))
+            SearchChangeLog.objects.log(SearchChange.COMBO, doc_ids)
+
+    def rebuild(self, batch_size=1000):
+        combo_ids = list(Combo.objects.order_by('id').values_list('id', flat=True))
+        for start in range(0, len(combo_ids), batch_size):
+            self.refresh(Combo.objects.filter(id__in=combo_ids[start:start + batch_size]))
+
+        self.exclude(combo__in=Combo.objects.values('id')).delete()
+        return len(combo_ids)
+
+    def combos(self, docs):
+        # Combos render with their products and thumbs, so results are read back from the combo table
+        # in the order the docs were ranked. A distance annotation of the docs is carried over.
+        distance = ['distance'] if 'distance' in docs.query.annotations else []
+        ranked = list(docs.values('combo_id', *distance))
+        combos = Combo.objects.select_related('shop').in_bulk([row['combo_id'] for row in ranked])
+
+        results = []
+        for row in ranked:
+            combo = combos.get(row['combo_id'])
+            if combo is not None:
+                combo.distance = row.get('distance')
+                results.append(combo)
+        return results
+
+
+class ComboSearchDoc(models.Model):
+    combo = models.OneToOneField(Combo, primary_key=True, related_name='search_doc', on_delete=models.CASCADE)
+    shop = models.ForeignKey(Shop, related_name='+', on_delete=models.CASCADE)
+    shop_location = PointField(geography=True, srid=4326, null=True)
+    shop_is_active = models.BooleanField(default=False)
+    name = models.CharField(max_length=200)
+    description = models.CharField(max_length=255)
+    search_vector = SearchVectorField(null=True)
+    offered_price = models.DecimalField(max_digits=9, decimal_places=0, default=0)
+    created_at = models.DateTimeField(null=True)
+
+    objects = ComboSearchDocManager()
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['name'], name='combodoc_name_trgm', opclasses=['gin_trgm_ops']),
+            GinIndex(fields=['search_vector'], name='combodoc_search_vector'),
+            models.Index(fields=['offered_price'], name='combodoc_offered_price'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+@receiver(post_save, sender=ShopProduct)
+def refresh_ShopProduct_search_doc(sender, instance, **kwargs):
+    ShopProductSearchDoc.objects.refresh(ShopProduct.objects.filter(pk=instance.pk))
+
+
+@receiver(post_save, sender=Product)
+def refresh_Product_search_docs(sender, instance, created, **kwargs):
+    # ModifyBrandProduct saves the product after its images, so this also covers a new primary image
+    if not created:
+        ShopProductSearchDoc.objects.refresh(ShopProduct.objects.filter(product=instance))
+
+
+@receiver(post_save, sender=Shop)
+def refresh_Shop_search_docs(sender, instance, created, **kwargs):
+    # Location and active flag are copied into every doc of the shop
+    if not created:
+        ShopProductSearchDoc.objects.filter(shop=instance) \
+            .update(shop_location=instance.location, shop_is_active=instance.is_active)
+        ComboSearchDoc.objects.filter(shop=instance) \
+            .update(shop_location=instance.location, shop_is_active=instance.is_active)
+        SearchChangeLog.objects.log(SearchChange.SHOP, [instance.id])
+
+
+@receiver(post_save, sender=Combo)
+def refresh_Combo_search_doc(sender, instance, **kwargs):
+    ComboSearchDoc.objects.refresh(Combo.objects.filter(pk=instance.pk))
+
+
+@receiver(post_delete, sender=ShopProduct)
+def log_ShopProduct_delete(sender, instance, **kwargs):
+    # The doc itself goes with the cascade
+    SearchChangeLog.objects.log(SearchChange.SHOP_PRODUCT, [instance.id], deleted=True)
+
+
+@receiver(post_delete, sender=Combo)
+def log_Combo_delete(sender, instance, **kwargs):
+    SearchChangeLog.objects.log(SearchChange.COMBO, [instance.id], deleted=True)
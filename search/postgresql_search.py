@@ -1,38 +1,84 @@
+from django.contrib.gis.db.models.functions import Distance
 from django.contrib.gis.geos import Point
 from django.contrib.gis.measure import D
-from django.contrib.postgres.search import TrigramSimilarity
-from django.db.models import Q
+from django.contrib.postgres.search import TrigramSimilarity, SearchQuery, SearchRank
+from django.db.models import Q, F, FloatField, ExpressionWrapper
+from django.db.models.functions import Cast, Ln
 
-from shop.models import ShopProduct, Combo, Shop
-from product.models import Product
+from search import SearchSort
+from search.models import ShopProductSearchDoc, ComboSearchDoc
+from shop.models import Shop
 
-def shop_product_search(phrase, coords, km=5, shops=False):
-    name_sim = TrigramSimilarity("title", phrase)
-    ft_in_description = Q(description__search=phrase)
-    name_sim_filter = Q(name_sim__gt=0.1)
-    matching_products = Product.objects.annotate(name_sim=name_sim).filter(
-        (name_sim_filter | ft_in_description)
-    )
-    
-    if matching_products.count() == 0:
-        return []
-    
-    else:
-        lat = coords['lat']
-        lng = coords['lng']
-        ref_location = Point(lng, lat, srid=4326)
-
-        nearby_shops = shops if shops else Shop.objects.filter(location__dwithin=(ref_location, D(km=km)), is_active=True)
-        
-        if nearby_shops.count() == 0:
-            return []
-        
-        nearby_shop_products = ShopProduct.objects.filter(shop__in=nearby_shops)
-        
-        filtered_shop_products = nearby_shop_products.filter(product__in=matching_products)
-        ordered_shop_products = filtered_shop_products.order_by('offered_price')
-
-        return ordered_shop_products
+DEFAULT_RANGE_IN_KM = 5
+# Wider searches are narrowed to this, so every search stays a location index scan over a bounded area
+MAX_RANGE_IN_KM = 25
+
+# Relevance is name similarity plus full text rank, less a distance penalty reaching
+# RELEVANCE_DISTANCE_WEIGHT at the edge of the search range and a penalty on the log of the price
+RELEVANCE_DISTANCE_WEIGHT = 0.3
+RELEVANCE_PRICE_WEIGHT = 0.05
+
+
+def search_range(km):
+    return min(km or DEFAULT_RANGE_IN_KM, MAX_RANGE_IN_KM)
+
+
+def nearby_shops_named(shop_name, coords, km=DEFAULT_RANGE_IN_KM):
+    # Shops in range with a title similar to shop_name. The radius filter goes first on the location
+    # index, so similarity is only computed for the nearby shops and not for every shop.
+    ref_location = Point(coords['lng'], coords['lat'], srid=4326)
+    nearby_shops = Shop.objects.filter(location__dwithin=(ref_location, D(km=search_range(km))), is_active=True)
+    return nearby_shops.annotate(name_sim=TrigramSimilarity("title", shop_name)).filter(name_sim__gt=0.3)
+
+
+def nearby_docs(docs, coords, km=DEFAULT_RANGE_IN_KM, shops=False):
+    # Location and active flag are copied into the search docs, the shop table is not joined
+    if shops:
+        return docs.filter(shop__in=shops)
+
+    lat = coords['lat']
+    lng = coords['lng']
+    ref_location = Point(lng, lat, srid=4326)
+
+    return docs.filter(shop_location__dwithin=(ref_location, D(km=search_range(km))), shop_is_active=True)
+
+
+def nearby_shop_products(coords, km=DEFAULT_RANGE_IN_KM):
+    docs = nearby_docs(ShopProductSearchDoc.objects.all(), coords, km)
+    return docs.prefetch_related('shop', 'product')
+
+
+def nearby_combos(coords, km=DEFAULT_RANGE_IN_KM):
+    docs = nearby_docs(ComboSearchDoc.objects.all(), coords, km)
+    return ComboSearchDoc.objects.combos(docs)
+
+
+def ranked_docs(docs, name_field, phrase, coords, km=DEFAULT_RANGE_IN_KM, sort=SearchSort.PRICE):
+    # Matches docs on name similarity or full text and orders them, every result is annotated with its
+    # distance from coords. Similarity, text rank and distance are all computed in the search query.
+    query = SearchQuery(phrase)
+    ref_location = Point(coords['lng'], coords['lat'], srid=4326)
+
+    docs = docs.annotate(name_sim=TrigramSimilarity(name_field, phrase),
+                         distance=Distance('shop_location', ref_location)) \
+        .filter(Q(name_sim__gt=0.1) | Q(search_vector=query))
+
+    if sort == SearchSort.RELEVANCE:
+        range_in_m = search_range(km) * 1000
+        score = F('name_sim') + SearchRank(F('search_vector'), query) \
+            - RELEVANCE_DISTANCE_WEIGHT * Cast('distance', FloatField()) / range_in_m \
+            - RELEVANCE_PRICE_WEIGHT * Ln(Cast('offered_price', FloatField()) + 1)
+        return docs.annotate(score=ExpressionWrapper(score, output_field=FloatField())).order_by('-score')
+
+    if sort == SearchSort.DISTANCE:
+        return docs.order_by('distance', 'offered_price')
+
+    return docs.order_by('offered_price')
+
+
+def shop_product_search(phrase, coords, km=DEFAULT_RANGE_IN_KM, shops=False, sort=SearchSort.PRICE):
+    docs = nearby_docs(ShopProductSearchDoc.objects.all(), coords, km, shops)
+    return ranked_docs(docs, 'title', phrase, coords, km, sort).prefetch_related('shop', 'product')
 
 # first filtering nearby shops and then phrase filtering
 # def shop_product_search(phrase, coords, km=5, shops=False):
@@ -54,24 +100,9 @@ def shop_product_search(phrase, coords, km=5, shops=False):
     # return order_shop_products
 
 
-def combos_search(phrase, coords, km=5, shops=False):
-    name_sim = TrigramSimilarity("name", phrase)
-    ft_in_description = Q(description=phrase)
-    lat = coords['lat']
-    lng = coords['lng']
-    ref_location = Point(lng, lat, srid=4326)
-
-    nearby_shops = shops if shops else Shop.objects.filter(location__dwithin=(ref_location, D(km=km)), is_active=True)
- 
-    name_similar_filter = Q(name_sim__gt=0.1)
-
-    nearby_combos = Combo.objects.filter(shop__in=nearby_shops)
-    filtered_combos = nearby_combos.annotate(name_sim=name_sim).filter(
-        (name_similar_filter | ft_in_description)
-    )
-    combos = filtered_combos.order_by('offered_price')
-
-    return combos
+def combos_search(phrase, coords, km=DEFAULT_RANGE_IN_KM, shops=False, sort=SearchSort.PRICE):
+    docs = nearby_docs(ComboSearchDoc.objects.all(), coords, km, shops)
+    return ComboSearchDoc.objects.combos(ranked_docs(docs, 'name', phrase, coords, km, sort))
 
 
 def search_combos_in_shop(phrase, combos):
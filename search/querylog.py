@@ -0,0 +1,91 @@
+import atexit
+import logging
+import math
+import queue
+import time
+from decimal import Decimal
+from threading import Lock, Thread
+
+from django.db import close_old_connections
+
+from .models import SearchQueryLog
+from .suggestions import normalize
+
+logger = logging.getLogger(__name__)
+
+
+def grid_cell(value):
+    cell = SearchQueryLog.GRID_CELL
+    return Decimal(math.floor(value / cell) * cell).quantize(Decimal('0.01'))
+
+
+class QueryLogWriter:
+    """
+    Buffers search log rows in memory and bulk inserts them from a background thread, once BATCH_SIZE
+    rows are waiting or FLUSH_INTERVAL seconds after the first one. Searches never wait on the insert.
+    Rows beyond MAX_BUFFERED are dropped, as are rows still buffered when a worker is killed.
+    """
+
+    BATCH_SIZE = 200
+    FLUSH_INTERVAL = 10
+    MAX_BUFFERED = 10000
+
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=self.MAX_BUFFERED)
+        self.thread = None
+        self.lock = Lock()
+
+    def write(self, entry):
+        self.start()
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            pass
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = Thread(target=self.run, name='search-query-log', daemon=True)
+                self.thread.start()
+                atexit.register(self.flush)
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.FLUSH_INTERVAL
+            while len(batch) < self.BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            self.save(batch)
+
+    def flush(self):
+        # Saves what is buffered, on exit of the worker
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        self.save(batch)
+
+    def save(self, batch):
+        if not batch:
+            return
+        try:
+            close_old_connections()
+            SearchQueryLog.objects.bulk_create(batch)
+        except Exception:
+            # Losing a batch of log rows is better than losing the thread
+            logger.exception('Could not save %s search log rows', len(batch))
+
+
+_writer = QueryLogWriter()
+
+
+def log_search(kind, phrase, coords, results, started_at):
+    # started_at is the time.monotonic() the search started at
+    _writer.write(SearchQueryLog(kind=kind, phrase=phrase[:255], normalized_phrase=normalize(phrase)[:255],
+                                 lat_cell=grid_cell(coords['lat']), lng_cell=grid_cell(coords['lng']),
+                                 results=results, latency_ms=int((time.monotonic() - started_at) * 1000)))
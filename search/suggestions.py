@@ -0,0 +1,186 @@
+import re
+import time
+from datetime import timedelta
+from threading import Lock, Thread
+from urllib.parse import quote
+
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Sum
+from django.utils.timezone import now
+
+from order.models import ShopDailySales, ShopDailyProductSales
+from shop.models import Shop
+from .backends import get_search_backend
+from .models import ShopProductSearchDoc, ComboSearchDoc
+from .postgresql_search import DEFAULT_RANGE_IN_KM
+
+# Longest prefix kept in the index, longer prefixes are matched against the candidates of this one
+MAX_PREFIX_LENGTH = 15
+# Most suggestions returned, and candidates kept per prefix for every shop. A term among the MAX_SUGGESTIONS
+# heaviest of the nearby shops is among the MAX_SUGGESTIONS heaviest of a nearby shop offering it, so
+# merging the lists of the nearby shops loses nothing.
+MAX_SUGGESTIONS = 20
+REBUILD_INTERVAL = 15 * 60
+CACHE_TIMEOUT = 5 * 60
+# Sales of this many past days make a suggestion popular
+POPULARITY_DAYS = 30
+
+_index = None
+_rebuilding = False
+# Held while an index is built, so a worker never builds two at once
+_build_lock = Lock()
+_state_lock = Lock()
+
+
+def normalize(text):
+    return ' '.join(re.findall(r'[^\W_]+', (text or '').lower()))
+
+
+class SuggestionIndex:
+    """
+    Edge n-gram index of product titles, combo names, shop titles and brand names. Every prefix of every
+    word of a term, up to MAX_PREFIX_LENGTH, maps to the MAX_SUGGESTIONS heaviest terms holding it of
+    each shop, so shops away from the busiest areas keep their own suggestions.
+    A term's weight is its popularity: units sold in the last POPULARITY_DAYS days plus the shops
+    carrying it for products and combos, orders for shops and the weight of their products for brands.
+    """
+
+    def __init__(self):
+        # normalized term: [display text, weight, ids of the shops offering it]
+        self.terms = {}
+        self.prefixes = {}
+        self.built_at = time.monotonic()
+
+    def add(self, text, weight, shop_ids):
+        key = normalize(text)
+        if not key:
+            return
+
+        term = self.terms.setdefault(key, [text, 0, set()])
+        term[1] += weight
+        term[2].update(shop_ids)
+
+    def build(self):
+        since = (now() - timedelta(days=POPULARITY_DAYS)).date()
+        sold = dict(ShopDailyProductSales.objects.filter(day__gte=since).values_list('product_title')
+                    .annotate(total=Sum('quantity')).order_by())
+        orders = dict(ShopDailySales.objects.filter(day__gte=since).values_list('shop_id')
+                      .annotate(total=Sum('orders')).order_by())
+
+        product_shops = {}
+        brand_products = {}
+        for title, brand_title, shop_id in ShopProductSearchDoc.objects.filter(in_stock=True) \
+                .values_list('title', 'product__brand__title', 'shop_id').iterator():
+            product_shops.setdefault(title, set()).add(shop_id)
+            brand_products.setdefault(brand_title, set()).add(title)
+
+        product_weights = {}
+        for title, shop_ids in product_shops.items():
+            product_weights[title] = len(shop_ids) + sold.get(title, 0)
+            self.add(title, product_weights[title], shop_ids)
+
+        for brand_title, titles in brand_products.items():
+            self.add(brand_title, sum(product_weights[title] for title in titles),
+                     set().union(*[product_shops[title] for title in titles]))
+
+        combo_shops = {}
+        for name, shop_id in ComboSearchDoc.objects.values_list('name', 'shop_id').iterator():
+            combo_shops.setdefault(name, set()).add(shop_id)
+        for name, shop_ids in combo_shops.items():
+            self.add(name, len(shop_ids) + sold.get(name, 0), shop_ids)
+
+        for shop_id, title in Shop.objects.filter(is_active=True).values_list('id', 'title'):
+            self.add(title, 1 + orders.get(shop_id, 0), [shop_id])
+
+        for key, (text, weight, shop_ids) in self.terms.items():
+            words = key.split(' ')
+            prefixes = set()
+            for position in range(len(words)):
+                rest = ' '.join(words[position:])
+                prefixes.update(rest[:length] for length in range(1, min(len(rest), MAX_PREFIX_LENGTH) + 1))
+
+            for prefix in prefixes:
+                shop_keys = self.prefixes.setdefault(prefix, {})
+                for shop_id in shop_ids:
+                    shop_keys.setdefault(shop_id, []).append(key)
+
+        for shop_keys in self.prefixes.values():
+            for shop_id, keys in shop_keys.items():
+                shop_keys[shop_id] = sorted(keys, key=self.rank)[:MAX_SUGGESTIONS]
+
+    def rank(self, key):
+        # Heaviest first, ties in a stable order
+        return -self.terms[key][1], key
+
+    def suggest(self, prefix, shop_ids, limit):
+        # Display texts of the heaviest terms with a word starting with prefix, offered by one of shop_ids
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+
+        shop_keys = self.prefixes.get(prefix[:MAX_PREFIX_LENGTH], {})
+        candidates = set()
+        for shop_id in shop_ids:
+            candidates.update(shop_keys.get(shop_id, []))
+        if len(prefix) > MAX_PREFIX_LENGTH:
+            candidates = [key for key in candidates if f' {prefix}' in f' {key}']
+
+        return [self.terms[key][0] for key in sorted(candidates, key=self.rank)[:limit]]
+
+
+def build_index():
+    global _index
+    index = SuggestionIndex()
+    index.build()
+    _index = index
+
+
+def rebuild_index():
+    # Runs in a background thread, the old index keeps serving until the new one replaces it
+    global _rebuilding
+    try:
+        with _build_lock:
+            build_index()
+    finally:
+        _rebuilding = False
+        # The thread's own connection
+        connection.close()
+
+
+def get_suggestion_index():
+    """
+    Built on first use in each worker, which waits for it. Every REBUILD_INTERVAL seconds afterwards a
+    background thread builds a new index while requests keep using the current one.
+    """
+    global _rebuilding
+    index = _index
+    if index is None:
+        with _build_lock:
+            if _index is None:
+                build_index()
+        return _index
+
+    if time.monotonic() - index.built_at > REBUILD_INTERVAL:
+        with _state_lock:
+            start = not _rebuilding
+            _rebuilding = True
+        if start:
+            Thread(target=rebuild_index, daemon=True).start()
+    return index
+
+
+def search_suggestions(prefix, coords, limit=8, km=DEFAULT_RANGE_IN_KM):
+    """
+    Returns up to `limit` completions of prefix available around coords. Results are cached per
+    prefix and per coords rounded to about a kilometre. Nearby shops come from the search backend,
+    the in-memory one answers without a query.
+    """
+    cache_key = f'search-suggestions:{quote(normalize(prefix))}:{coords["lat"]:.2f}:{coords["lng"]:.2f}:{limit}'
+    suggestions = cache.get(cache_key)
+    if suggestions is None:
+        shop_ids = get_search_backend().nearby_shop_ids(coords, km)
+        suggestions = get_suggestion_index().suggest(prefix, shop_ids, limit) if shop_ids else []
+        cache.set(cache_key, suggestions, CACHE_TIMEOUT)
+
+    return suggestions
@@ -0,0 +1,256 @@
+import csv
+import json
+from itertools import islice
+
+from django.db import transaction
+from graphql_relay import from_global_id, to_global_id
+
+from product.models import Product
+from search.models import ShopProductSearchDoc
+from .models import ShopProduct, Combo
+
+# Columns of an imported or exported shop catalog. A row names its product either by product_id
+# (relay ProductNode id or plain id) or by title when the title is unique among brand products.
+CATALOG_FIELDS = ['product_id', 'title', 'offered_price', 'in_stock']
+CATALOG_FORMATS = ['csv', 'jsonl']
+
+TRUE_VALUES = ['true', '1', 'yes', 'y']
+FALSE_VALUES = ['false', '0', 'no', 'n']
+
+
+def read_catalog_rows(lines, catalog_format):
+    # lines is any iterable of text lines, a file is read lazily
+    if catalog_format == 'csv':
+        return csv.DictReader(lines)
+
+    if catalog_format == 'jsonl':
+        return (json.loads(line) for line in lines if line.strip())
+
+    raise Exception(f'Catalog format should be one of {", ".join(CATALOG_FORMATS)}')
+
+
+def parse_product_id(product_id):
+    product_id = str(product_id).strip()
+    if product_id.isdigit():
+        return int(product_id)
+
+    try:
+        return int(from_global_id(product_id)[1])
+    except (TypeError, ValueError, UnicodeDecodeError):
+        raise Exception(f'{product_id} is not a valid product id')
+
+
+def parse_in_stock(in_stock):
+    if in_stock is None or in_stock == '':
+        return True
+    if isinstance(in_stock, bool):
+        return in_stock
+    if str(in_stock).strip().lower() in TRUE_VALUES:
+        return True
+    if str(in_stock).strip().lower() in FALSE_VALUES:
+        return False
+
+    raise Exception(f'{in_stock} is not a valid in_stock value')
+
+
+def parse_offered_price(offered_price):
+    try:
+        offered_price = int(offered_price)
+    except (TypeError, ValueError):
+        raise Exception(f'{offered_price} is not a valid offered_price')
+
+    if not 0 <= offered_price < 10 ** 9:
+        raise Exception(f'{offered_price} is not a valid offered_price')
+
+    return offered_price
+
+
+def resolve_products(rows):
+    # One query for the ids and one for the titles of a whole batch
+    product_ids = set()
+    titles = set()
+    for row_number, row in rows:
+        if row.get('product_id'):
+            product_ids.add(row['product_id'])
+        elif row.get('title'):
+            titles.add(row['title'])
+
+    existing_ids = set(Product.objects.filter(id__in=product_ids).values_list('id', flat=True))
+
+    products_by_title = {}
+    for product_id, title in Product.objects.filter(title__in=titles).values_list('id', 'title'):
+        # A title shared by products of different brands can not be resolved
+        products_by_title[title] = None if title in products_by_title else product_id
+
+    return existing_ids, products_by_title
+
+
+def import_catalog(shop, rows, batch_size=500):
+    """
+    Adds the products of a catalog to the shop in chunks of batch_size rows.
+    Plan space is read once up front. Rows are skipped once it runs out, as are products already in the
+    shop and rows that do not resolve to a product.
+    Returns a dict with the created count and a list of (row number, error) for skipped rows.
+    """
+    remaining_space = shop.remaining_space()
+    if remaining_space is None:
+        raise Exception("No active shop plan")
+
+    created = 0
+    errors = []
+    seen_product_ids = set()
+    rows = enumerate(rows, start=1)
+
+    while True:
+        chunk = list(islice(rows, batch_size))
+        if len(chunk) == 0:
+            break
+
+        batch = []
+        for row_number, row in chunk:
+            try:
+                batch.append((row_number, {
+                    'product_id': parse_product_id(row['product_id']) if row.get('product_id') else None,
+                    'title': (row.get('title') or '').strip(),
+                    'offered_price': parse_offered_price(row.get('offered_price')),
+                    'in_stock': parse_in_stock(row.get('in_stock')),
+                }))
+            except Exception as e:
+                errors.append((row_number, str(e)))
+
+        existing_ids, products_by_title = resolve_products(batch)
+        batch_product_ids = existing_ids | {product_id for product_id in products_by_title.values() if product_id}
+        shop_product_ids = set(shop.products.filter(product_id__in=batch_product_ids)
+                               .values_list('product_id', flat=True))
+
+        shop_products = []
+        for row_number, row in batch:
+            product_id = row['product_id'] if row['product_id'] in existing_ids else products_by_title.get(row['title'])
+
+            if product_id is None:
+                errors.append((row_number, 'No product found, or the title matches more than one product'))
+            elif product_id in shop_product_ids or product_id in seen_product_ids:
+                errors.append((row_number, 'This product is already in your shop'))
+            elif created + len(shop_products) >= remaining_space:
+                errors.append((row_number, 'Not enough product space. Please upgrade your plan'))
+            else:
+                seen_product_ids.add(product_id)
+                shop_products.append(ShopProduct(shop=shop, product_id=product_id, offered_price=row['offered_price'],
+                                                 in_stock=row['in_stock']))
+
+        ShopProduct.objects.bulk_create(shop_products)
+        # bulk_create sends no post_save, search docs of the new products are built here
+        created_ids = [shop_product.id for shop_product in shop_products]
+        ShopProductSearchDoc.objects.refresh(ShopProduct.objects.filter(id__in=created_ids))
+        created += len(shop_products)
+
+    return {'created': created, 'errors': errors}
+
+
+def update_shop_products(shop, changes, key='id'):
+    """
+    Applies stock and price changes to the shop's products in one ownership query and one bulk_update.
+    changes maps a ShopProduct `key` value (id or product_id) to a dict with offered_price and/or in_stock.
+    The products are read and locked in the transaction writing them, so concurrent updates of the same
+    products apply one after the other. Combos holding the changed products are refreshed once for the
+    whole batch.
+    Returns the shop products found, those actually changed and the keys that are not in the shop.
+    """
+    with transaction.atomic():
+        shop_products = list(shop.products.select_for_update().filter(**{f'{key}__in': list(changes)})
+                             .order_by('id'))
+
+        changed = []
+        price_changed = []
+        stock_changed = []
+        for shop_product in shop_products:
+            change = changes[getattr(shop_product, key)]
+            offered_price = change.get('offered_price')
+            in_stock = change.get('in_stock')
+
+            is_changed = False
+            if offered_price is not None and offered_price != shop_product.offered_price:
+                shop_product.offered_price = offered_price
+                price_changed.append(shop_product.id)
+                is_changed = True
+            if in_stock is not None and in_stock != shop_product.in_stock:
+                shop_product.in_stock = in_stock
+                stock_changed.append(shop_product.id)
+                is_changed = True
+
+            if is_changed:
+                changed.append(shop_product)
+
+        ShopProduct.objects.bulk_update(changed, ['offered_price', 'in_stock'])
+        if price_changed:
+            Combo.objects.filter(products__shop_product__in=price_changed).refresh_prices()
+        if stock_changed:
+            Combo.objects.filter(products__shop_product__in=stock_changed).refresh_is_available()
+        ShopProductSearchDoc.objects.refresh(ShopProduct.objects.filter(id__in=[shop_product.id for shop_product in changed]))
+
+    found = {getattr(shop_product, key) for shop_product in shop_products}
+    return shop_products, changed, [key_value for key_value in changes if key_value not in found]
+
+
+def update_catalog(shop, rows, batch_size=1000):
+    """
+    Applies a csv or jsonl catalog of product_id, offered_price and in_stock to the products already
+    in the shop, batch_size rows at a time. Empty offered_price or in_stock cells are left unchanged.
+    Returns a dict with the count of products changed and a list of (row number, error) for skipped rows.
+    """
+    updated = 0
+    errors = []
+    rows = enumerate(rows, start=1)
+
+    while True:
+        chunk = list(islice(rows, batch_size))
+        if len(chunk) == 0:
+            break
+
+        changes = {}
+        row_numbers = {}
+        for row_number, row in chunk:
+            try:
+                product_id = parse_product_id(row.get('product_id'))
+                offered_price = row.get('offered_price')
+                in_stock = row.get('in_stock')
+                changes[product_id] = {
+                    'offered_price': parse_offered_price(offered_price) if offered_price not in [None, ''] else None,
+                    'in_stock': parse_in_stock(in_stock) if in_stock not in [None, ''] else None,
+                }
+                row_numbers[product_id] = row_number
+            except Exception as e:
+                errors.append((row_number, str(e)))
+
+        shop_products, changed, missing = update_shop_products(shop, changes, key='product_id')
+        updated += len(changed)
+        for product_id in missing:
+            errors.append((row_numbers[product_id], 'This product is not in your shop'))
+
+    return {'updated': updated, 'errors': errors}
+
+
+class Echo:
+    # File like object for csv.writer, returns the written row instead of buffering it
+    def write(self, value):
+        return value
+
+
+def export_catalog(shop, catalog_format, chunk_size=2000):
+    # Yields the shop catalog line by line, reading it from a server side cursor
+    shop_products = shop.products.order_by('id').values_list('product_id', 'product__title', 'offered_price',
+                                                             'in_stock')
+
+    if catalog_format == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(CATALOG_FIELDS)
+        for product_id, title, offered_price, in_stock in shop_products.iterator(chunk_size=chunk_size):
+            yield writer.writerow([to_global_id('ProductNode', product_id), title, offered_price, in_stock])
+
+    elif catalog_format == 'jsonl':
+        for product_id, title, offered_price, in_stock in shop_products.iterator(chunk_size=chunk_size):
+            yield json.dumps({'product_id': to_global_id('ProductNode', product_id), 'title': title,
+                              'offered_price': int(offered_price), 'in_stock': in_stock}) + '\n'
+
+    else:
+        raise Exception(f'Catalog format should be one of {", ".join(CATALOG_FORMATS)}')
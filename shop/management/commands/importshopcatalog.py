@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.catalog import CATALOG_FORMATS, read_catalog_rows, import_catalog
+from shop.models import Shop
+
+
+class Command(BaseCommand):
+    help = 'Add the products of a csv or jsonl catalog to a shop'
+
+    def add_arguments(self, parser):
+        parser.add_argument('shop', help='Username of the shop')
+        parser.add_argument('path', help='Catalog file with product_id or title, offered_price and in_stock')
+        parser.add_argument('--format', choices=CATALOG_FORMATS, help='Defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows resolved and inserted per batch')
+
+    def handle(self, *args, **options):
+        try:
+            shop = Shop.objects.get(username=options['shop'])
+        except Shop.DoesNotExist:
+            raise CommandError(f'No shop with username {options["shop"]} exist')
+
+        catalog_format = options['format'] or options['path'].rsplit('.', 1)[-1].lower()
+        if catalog_format not in CATALOG_FORMATS:
+            raise CommandError(f'Catalog format should be one of {", ".join(CATALOG_FORMATS)}')
+
+        with open(options['path'], encoding='utf-8-sig', newline='') as catalog_file:
+            try:
+                result = import_catalog(shop, read_catalog_rows(catalog_file, catalog_format),
+                                        batch_size=options['batch_size'])
+            except Exception as e:
+                raise CommandError(e)
+
+        for row_number, error in result['errors']:
+            self.stderr.write(f'Row {row_number}: {error}')
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully added {result["created"]} products to {shop}'))
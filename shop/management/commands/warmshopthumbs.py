@@ -1,18 +1,27 @@
+from itertools import islice
+
 from django.core.management.base import BaseCommand, CommandError
-from versatileimagefield.image_warmer import VersatileImageFieldWarmer
+from images.renditions import warm_renditions
 from shop.models import Shop
 
 class Command(BaseCommand):
-    help = 'Create or check thumbnails of shop hero_image'
+    help = 'Create the missing thumbnails of shop hero_image and record them in the rendition manifest'
     
     def handle(self, *args, **options):
-        all_shops = Shop.objects.all()
+        all_shops = Shop.objects.order_by('id').iterator(chunk_size=500)
+        done = 0
+        failed = []
         
-        img_warmer = VersatileImageFieldWarmer(instance_or_queryset=all_shops, rendition_key_set='hero_image', image_attr='hero_image', verbose=True)
-        done, failed = img_warmer.warm()
+        while True:
+            shops = list(islice(all_shops, 500))
+            if len(shops) == 0:
+                break
+            created, batch_failed = warm_renditions([shop.hero_image for shop in shops], 'hero_image')
+            done += created
+            failed += batch_failed
         
         if done:
             self.stdout.write(self.style.SUCCESS(f'Successfully warmed {done} thumbs.'))
             
         if failed:
-            raise CommandError(f'Failed to warm {failed} thumbs')
\ No newline at end of file
+            raise CommandError(f'Failed to warm {len(failed)} thumbs')
@@ -0,0 +1,24 @@
+# Generated by Django 3.0.3 on 2026-10-19 14:20
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0017_auto_20200311_1030'),
+    ]
+
+    operations = [
+        # Blank thumbs do not cast to jsonb
+        migrations.RunSQL(
+            sql="UPDATE shop_combo SET thumbs = NULL WHERE thumbs = ''",
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AlterField(
+            model_name='combo',
+            name='thumbs',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -1,20 +1,26 @@
 import datetime
+from collections import defaultdict
 from json import dumps
 from random import randint
 from django.conf import settings
 from django.contrib.gis.db.models import PointField
-from django.contrib.postgres.fields import HStoreField
+from django.contrib.postgres.fields import HStoreField, JSONField
 from django.db import models
+from django.db.models import DecimalField, Exists, ExpressionWrapper, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.utils.timezone import now
 from versatileimagefield.fields import VersatileImageField
-from versatileimagefield.image_warmer import VersatileImageFieldWarmer
 
-from product.models import ApplicationStatus
+from product.models import ApplicationStatus, PlanQueueManager
 from product.models import Product
 from search.env import MANDI_LOCATION
 from core.utils import image_from_64
+from images.dedup import save_image
+from images.models import Rendition, HERO_THUMB
+from images.renditions import warm_renditions
+from storagequeue.models import StorageDeletion
 
 User = settings.AUTH_USER_MODEL
 
@@ -29,8 +35,7 @@ class PopularPlace(models.Model):
     def delete_image(self):
         # remove image from storage
         if self.image:
-            self.image.delete_all_created_images()
-            self.image.delete(save=False)
+            StorageDeletion.objects.enqueue_image(self.image)
 
     def __str__(self):
         return self.name
@@ -84,18 +89,16 @@ class Shop(models.Model):
         return self.public_username
         
     def get_thumb(self):
-        thumb = self.hero_image.thumbnail['360x270']
-        return thumb
+        # Storage path of the hero image thumbnail. Hero images of shops created before the manifest have
+        # their thumbnails under the built names, the warmer created them.
+        return Rendition.objects.path(self.hero_image, HERO_THUMB, built_names=True)
         
     def warm_image(self):
-        shop_img_warmer = VersatileImageFieldWarmer(instance_or_queryset=self, rendition_key_set='hero_image',
-                                                image_attr='hero_image')
-        shop_img_warmer.warm()
+        warm_renditions([self.hero_image], 'hero_image')
 
     def delete_hero_image(self):
-        # remove hero_image from storage
-        self.hero_image.delete_all_created_images()
-        self.hero_image.delete(save=False)
+        # remove hero_image from storage, the files are removed by the deletequeuedfiles worker
+        StorageDeletion.objects.enqueue_image(self.hero_image, 'hero_image')
         
     def update_hero_image(self, base64image):
         suffix = randint(100, 999)
@@ -103,7 +106,7 @@ class Shop(models.Model):
         hero_img_file = image_from_64(base64image, img_name, max_width=Shop.IMG_MAX_WIDTH)
         if self.hero_image:
             self.delete_hero_image()
-        self.hero_image.save(hero_img_file.name, hero_img_file, save=False)
+        save_image(self.hero_image, hero_img_file, save=False)
         self.save()
         self.warm_image()
 
@@ -175,10 +178,8 @@ def delete_Shop_instance(sender, instance, **kwargs):
     owner = instance.owner
     owner.is_shop_owner = False
     owner.save()
-    # Deletes Image Renditions
-    instance.hero_image.delete_all_created_images()
-    # Deletes Original Image
-    instance.hero_image.delete(save=False)
+    # Queues the original image and its renditions for deletion
+    instance.delete_hero_image()
     
 # @receiver(post_save, sender=Shop)
 # def warm_Shop_image(sender, instance, **kwargs):
@@ -187,45 +188,15 @@ def delete_Shop_instance(sender, instance, **kwargs):
     # shop_img_warmer.warm()
 
 
-class ShopPlanQueueManager(models.Manager):
+class ShopPlanQueueManager(PlanQueueManager):
+    owner_field = 'shop'
+
     def add_plan_to_queue(self, plan_id=None, shop_id=None, plan=None, shop=None, order_id=None):
         try:
             plan = ShopPlan.objects.get(id=plan_id) if plan_id else plan
             shop = Shop.objects.get(id=shop_id) if shop_id else shop
 
-            def add_to_plan_queue(date_start, date_end, is_active=False):
-                shop_plan = self.model(shop=shop, product_space=plan.product_space, plan=plan, is_active=is_active,
-                                       date_start=date_start, order_id=order_id, date_end=date_end)
-                shop_plan.save()
-                if not shop.is_active:
-                    shop.is_active = True
-                    shop.save()
-
-                return shop_plan
-
-            no_shop_plans_in_queue = shop.plans.count()
-
-            if no_shop_plans_in_queue == 0:
-                shop_plan = add_to_plan_queue(is_active=True, date_start=now(),
-                                              date_end=now() + plan.validity_duration)
-
-            else:
-                latest_shop_plan_in_queue = shop.plans.latest('added_at')
-                # New plan start date will be equal to previous plan end date if previous plan is still active
-                latest_plan_end_date = latest_shop_plan_in_queue.date_end
-                end_date = latest_plan_end_date + plan.validity_duration
-
-                if latest_plan_end_date < now():
-                    # it means the shop do not have any active plans. All plans have expired.
-                    # and will be reomved from table by cron job
-                    shop_plan = add_to_plan_queue(is_active=True, date_start=now(),
-                                                  date_end=now() + plan.validity_duration)
-                else:
-                    # shop have either active plan or extra future plan in queue. Add another plan in queue
-                    # This plan will not be active and will continue the dates from previous latest plan
-                    shop_plan = add_to_plan_queue(is_active=False, date_start=latest_plan_end_date, date_end=end_date)
-
-            return shop_plan
+            return self.credit(shop, plan, order_id)
 
         except self.model.DoesNotExist:
             raise Exception("No plan exist with that id")
@@ -280,6 +251,51 @@ class ShopProduct(models.Model):
         return self.product.title
 
 
+def combo_thumb(product, quantity):
+    return {
+        "src": product.thumb,
+        "overlayText": product.thumb_overlay_text,
+        "quantity": quantity
+    }
+
+
+class ComboQuerySet(models.QuerySet):
+    # Set based maintenance of the denormalized combo columns. Each refresh costs the same couple of
+    # statements whether it covers one combo or every combo holding a product.
+
+    def refresh_prices(self):
+        combo_products = ComboProduct.objects.filter(combo=OuterRef('pk')).order_by().values('combo')
+        max_offered_price = combo_products.annotate(
+            total=Sum(ExpressionWrapper(F('quantity') * F('shop_product__offered_price'), output_field=DecimalField()))
+        ).values('total')
+        # Cost when all the items in a combo are bought at mrp, offered price for items without one
+        total_cost = combo_products.annotate(
+            total=Sum(ExpressionWrapper(F('quantity') * Coalesce('shop_product__product__mrp',
+                                                                 'shop_product__offered_price'),
+                                        output_field=DecimalField()))
+        ).values('total')
+
+        return self.update(max_offered_price=Coalesce(Subquery(max_offered_price), 0),
+                           total_cost=Subquery(total_cost))
+
+    def refresh_is_available(self):
+        out_of_stock = ComboProduct.objects.filter(combo=OuterRef('pk'), shop_product__in_stock=False)
+        return self.update(is_available=~Exists(out_of_stock))
+
+    def refresh_thumbs(self):
+        combo_products = ComboProduct.objects.filter(combo__in=self) \
+            .select_related('shop_product__product') \
+            .order_by('id')
+
+        thumbs = defaultdict(list)
+        for combo_product in combo_products:
+            thumbs[combo_product.combo_id].append(combo_thumb(combo_product.shop_product.product,
+                                                              combo_product.quantity))
+
+        combos = [Combo(id=combo_id, thumbs=combo_thumbs) for combo_id, combo_thumbs in thumbs.items()]
+        return Combo.objects.bulk_update(combos, ['thumbs'])
+
+
 class Combo(models.Model):
     shop = models.ForeignKey(Shop, related_name="combos", on_delete=models.CASCADE)
     offered_price = models.DecimalField(max_digits=9, decimal_places=0, default=0)
@@ -287,69 +303,30 @@ class Combo(models.Model):
     # offered_price of combo can not be greater than of the offered_price of its consisting shop_products
     max_offered_price = models.DecimalField(max_digits=9, decimal_places=0, default=0)
     name = models.CharField(max_length=200)
-    thumbs = models.TextField(null=True, blank=True)
+    # [{src, overlayText, quantity}] of the combo products, see combo_thumb
+    thumbs = JSONField(null=True, blank=True)
     # Total cost - cost when all the products in combo are bought at mrp
     total_cost = models.DecimalField(max_digits=9, decimal_places=0, null=True)
     description = models.CharField(max_length=255)
     is_available = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True, null=True)
 
+    objects = ComboQuerySet.as_manager()
+
     def __str__(self):
         return self.name
-    
+
     def update_thumbs(self):
-        combo_products = self.products
-        
-        thumbs = []
-        
-        for combo_product in combo_products.all():
-            product = combo_product.shop_product.product
-            
-            thumb_src = product.get_thumb().name
-            thumb_overlay_text = product.thumb_overlay_text
-            thumb = {
-            "src": thumb_src,
-            "overlayText": thumb_overlay_text,
-            "quantity": quantity
-            }
-            thumbs.append(thumb)
-            
-        self.thumbs = dumps(thumbs)
-        self.save()
-        
+        Combo.objects.filter(pk=self.pk).refresh_thumbs()
+        self.refresh_from_db(fields=['thumbs'])
+
     def update_is_available(self):
-        combo_products = self.products
-        
-        is_available = True
-        
-        for combo_product in combo_products.all():
-            in_stock  = combo_product.shop_product.in_stock
-            if not in_stock:
-                is_available = False
-                break
-        self.is_available = is_available
-    
+        Combo.objects.filter(pk=self.pk).refresh_is_available()
+        self.refresh_from_db(fields=['is_available'])
+
     def update_prices(self):
-        combo_products = self.products
-        
-        max_offered_price = 0
-        total_cost = 0
-        
-        for combo_product in combo_products.all():
-            quantity = combo_product.quantity
-            shop_product = combo_product.shop_product
-            mrp = shop_product.product.mrp
-            offered_price = shop_product.offered_price
-            
-            cost_subtotal = mrp * quantity if mrp else offered_price * quantity
-            max_offered_price_subtotal = offered_price * quantity
-            
-            total_cost += cost_subtotal
-            max_offered_price += max_offered_price_subtotal
-        
-        self.max_offered_price = max_offered_price
-        self.total_cost = total_cost
-        self.save()
+        Combo.objects.filter(pk=self.pk).refresh_prices()
+        self.refresh_from_db(fields=['max_offered_price', 'total_cost'])
 
 
 class ComboProduct(models.Model):
@@ -369,3 +346,13 @@ def handle_ComboProduct_delete(sender, instance, **kwargs):
 
     except Combo.DoesNotExist:
         pass
+
+
+@receiver(post_save, sender=Product)
+def refresh_Product_combos(sender, instance, created, **kwargs):
+    # Mrp, overlay text and primary image (saved before the product by ModifyBrandProduct) feed the
+    # combos of every shop selling this product
+    if not created:
+        combos = Combo.objects.filter(products__shop_product__product=instance)
+        combos.refresh_prices()
+        combos.refresh_thumbs()
@@ -1,6 +1,7 @@
 import datetime
 import os
 import random
+import time
 from json import dumps
 
 import graphene
@@ -8,9 +9,7 @@ import graphql_geojson
 import jwt
 from django.contrib.auth import get_user_model
 from django.contrib.gis.geos import Point
-from django.contrib.gis.measure import D
-from django.core.mail import send_mail
-from django.template.loader import render_to_string
+from django.db import transaction
 from django.utils import timezone
 from django.utils.timezone import now
 from django_filters import FilterSet, OrderingFilter
@@ -18,11 +17,22 @@ from graphene_django import DjangoObjectType
 from graphene_django.filter import DjangoFilterConnectionField
 from graphql_jwt.decorators import user_passes_test, login_required, superuser_required
 from graphql_relay import from_global_id
-from django.contrib.postgres.search import TrigramSimilarity
 
 from core.utils import validate_username, image_from_64
-from search.postgresql_search import search_products_in_shop, shop_product_search, combos_search, search_combos_in_shop
-from .models import Shop, ShopPlan, PopularPlace, ShopProduct, PlanQueue, ShopApplication, Combo, ComboProduct, ApplicationStatus
+from images.dedup import save_image
+from images.models import HERO_THUMB
+from images.schema import ResponsiveImageType, load_responsive_image, load_rendition_path
+from mailqueue.models import OutboundEmail
+from search import SearchSort
+from search.backends import get_search_backend
+from search.models import ShopProductSearchDoc, ComboSearchDoc, SearchQueryLog
+from search.postgresql_search import search_products_in_shop, search_combos_in_shop, nearby_shop_products, \
+    nearby_combos, nearby_shops_named
+from search.querylog import log_search
+from search.suggestions import search_suggestions, MAX_SUGGESTIONS
+from .models import Shop, ShopPlan, PopularPlace, ShopProduct, PlanQueue, ShopApplication, Combo, ComboProduct, ApplicationStatus, \
+    combo_thumb
+from .catalog import update_shop_products, parse_offered_price
 
 User = get_user_model()
 
@@ -96,10 +106,14 @@ class ShopNode(graphql_geojson.GeoJSONType):
     active_plan = graphene.Field(ShopPlanQueueNode)
     occupied_space = graphene.Int()
     hero_image_thumb = graphene.String()
+    responsive_hero_image = graphene.Field(ResponsiveImageType)
 
     def resolve_hero_image_thumb(self, info, **kwargs):
-        thumb = self.get_thumb().name
-        return thumb
+        # Shop.get_thumb, batched over the shops of the request
+        return load_rendition_path(info, self.hero_image, HERO_THUMB, built_names=True)
+
+    def resolve_responsive_hero_image(self, info, **kwargs):
+        return load_responsive_image(info, self.hero_image)
 
     def resolve_occupied_space(self, info, **kwargs):
         occupied_space = self.occupied_space()
@@ -161,11 +175,34 @@ class ShopProductNode(DjangoObjectType):
         }
         interfaces = (graphene.relay.Node,)
 
+    @classmethod
+    def is_type_of(cls, root, info):
+        # Search and nearby results are rendered straight from the search docs
+        return isinstance(root, ShopProductSearchDoc) or super().is_type_of(root, info)
+
+
+class SearchSortEnum(graphene.Enum):
+    RELEVANCE = SearchSort.RELEVANCE
+    PRICE = SearchSort.PRICE
+    DISTANCE = SearchSort.DISTANCE
+
+
+class SearchEdge:
+    # Search and nearby results carry their distance from the searched location
+    distance = graphene.Float(description='Distance from the searched location in km')
+
+    def resolve_distance(root, info):
+        distance = getattr(root.node, 'distance', None)
+        return round(distance.km, 3) if distance is not None else None
+
 
 class ShopProductNodeConnections(graphene.relay.Connection):
     class Meta:
         node = ShopProductNode
 
+    class Edge(SearchEdge):
+        pass
+
     count = graphene.Int()
     shop = graphene.Field(ShopNode)
 
@@ -192,6 +229,9 @@ class ComboNodeConnections(graphene.relay.Connection):
     class Meta:
         node = ComboNode
 
+    class Edge(SearchEdge):
+        pass
+
     count = graphene.Int()
     shop = graphene.Field(ShopNode)
 
@@ -238,7 +278,7 @@ class AdminAddPopularPlace(graphene.relay.ClientIDMutation):
         
         if img64:
             img_file = image_from_64(img64, name, max_width=PopularPlace.IMG_MAX_WIDTH)
-            popular_place.image.save(img_file.name, img_file, save=False)
+            save_image(popular_place.image, img_file, save=False)
         
         popular_place.save()
 
@@ -287,7 +327,7 @@ class AdminEditPopularPlace(graphene.relay.ClientIDMutation):
                     img_file = image_from_64(img64, img_name, max_width=PopularPlace.IMG_MAX_WIDTH)
                     if popular_place.image:
                         popular_place.delete_image()
-                    popular_place.image.save(img_file.name, img_file, save=False)
+                    save_image(popular_place.image, img_file, save=False)
                     
                 popular_place.save()
 
@@ -387,19 +427,24 @@ class ModifyShopProduct(graphene.relay.ClientIDMutation):
 
                 if action == 'modify':
                     in_stock = input.get('in_stock')
-                    
+                    stock_changed = in_stock is not None and in_stock != shop_product.in_stock
+                    price_changed = bool(offered_price) and offered_price != shop_product.offered_price
+
                     if in_stock is not None:
                             shop_product.in_stock = in_stock
                             
                     if offered_price:
-                        combo_products = shop_product.combo_products
-                        if combo_products.count() == 0:
-                            shop_product.offered_price = offered_price
-                        else:
-                            raise Exception("Delete any combos associated with this product before making changes")
+                        shop_product.offered_price = offered_price
 
                     shop_product.save()
 
+                    # Combos holding this product are updated in place instead of blocking the edit
+                    combos = Combo.objects.filter(products__shop_product=shop_product)
+                    if price_changed:
+                        combos.refresh_prices()
+                    if stock_changed:
+                        combos.refresh_is_available()
+
                 elif action == 'delete':
                     # checking for combos
                     combo_products = shop_product.combo_products
@@ -419,6 +464,48 @@ class ModifyShopProduct(graphene.relay.ClientIDMutation):
             raise Exception("No active shop plan")
 
 
+class BulkUpdateShopProducts(graphene.relay.ClientIDMutation):
+    shop_products = graphene.List(ShopProductNode)
+
+    class Input:
+        # Each item:- { shopProductId, offeredPrice, inStock }, offeredPrice and inStock are optional
+        shop_products = graphene.List(graphene.JSONString, required=True)
+
+    @classmethod
+    @login_required
+    @user_passes_test(lambda user: user.is_shop_owner)
+    def mutate_and_get_payload(cls, root, info, **input):
+        shop = info.context.user.shop
+
+        if not shop.is_active:
+            raise Exception("No active shop plan")
+
+        changes = {}
+        for shop_product in input.get('shop_products'):
+            try:
+                shop_product_id = int(from_global_id(shop_product['shopProductId'])[1])
+            except (KeyError, TypeError, ValueError):
+                raise Exception("A valid shopProductId is required for every shop product")
+
+            offered_price = shop_product.get('offeredPrice')
+            in_stock = shop_product.get('inStock')
+            if in_stock is not None and not isinstance(in_stock, bool):
+                raise Exception("inStock should be true or false")
+
+            changes[shop_product_id] = {
+                'offered_price': parse_offered_price(offered_price) if offered_price is not None else None,
+                'in_stock': in_stock,
+            }
+
+        with transaction.atomic():
+            shop_products, changed, missing = update_shop_products(shop, changes)
+            if missing:
+                # Nothing is applied when any of the products is not in the shop
+                raise Exception("Unauthorized access")
+
+        return cls(shop_products)
+
+
 class DeleteCombo(graphene.relay.ClientIDMutation):
     deleted_combo_id = graphene.ID()
 
@@ -446,6 +533,83 @@ class DeleteCombo(graphene.relay.ClientIDMutation):
             raise Exception("No active shop plan")
 
 
+def fetch_combo_shop_products(shop, combos_products):
+    # One query for every shop product referenced by the combos, with its product
+    shop_product_ids = {from_global_id(relay_id)[1] for combo_products in combos_products for relay_id in combo_products}
+    shop_products = shop.products.filter(id__in=shop_product_ids).select_related('product')
+
+    return {str(shop_product.id): shop_product for shop_product in shop_products}
+
+
+def build_combo(shop, shop_products, combo_name, offered_price, description, combo_products):
+    # Validates a combo against the fetched shop products and computes its denormalized columns.
+    # Nothing is written here.
+    # Structure of combo_products should be:-
+    # { relayShopProductId:{quantity}, ddbuiyw87y7324:{quantity:2}, adv872b0andia:{quantity:1} }
+    if len(combo_products) < 2:
+        raise Exception("Two or more products are required for making a combo.")
+
+    combo = Combo(shop=shop, offered_price=offered_price, name=combo_name, description=description,
+                  max_offered_price=0, total_cost=0)
+    combo_product_list = []
+    thumbs = []
+
+    for shop_product_relay_id, combo_product in combo_products.items():
+        shop_product = shop_products.get(from_global_id(shop_product_relay_id)[1])
+        if shop_product is None:
+            raise Exception('No shop product exist with that id. Make sure that the product is added to you shop first')
+
+        try:
+            quantity = int(combo_product['quantity'])
+        except (KeyError, TypeError, ValueError):
+            raise Exception("Quantity is required for every combo product")
+        if quantity < 1:
+            raise Exception("Quantity of a combo product should be at least 1")
+
+        product = shop_product.product
+        if not product.thumb:
+            raise Exception(f'{product.title} does not have an image')
+
+        thumbs.append(combo_thumb(product, quantity))
+        combo.max_offered_price += shop_product.offered_price * quantity
+        # Total cost is the cost when all the items in a combo are bought at mrp
+        combo.total_cost += (product.mrp or shop_product.offered_price) * quantity
+        if not shop_product.in_stock:
+            combo.is_available = False
+
+        combo_product_list.append(ComboProduct(shop_product=shop_product, quantity=quantity))
+
+    combo.thumbs = thumbs
+    return combo, combo_product_list
+
+
+def create_combos(shop, combos):
+    # combos is a list of dicts with combo_name, offered_price, description and combo_products
+    if not shop.is_active:
+        raise Exception("No active plan")
+
+    remaining_space = shop.remaining_space()
+    if remaining_space is None or remaining_space - COMBO_VOLUME * len(combos) < 0:
+        raise Exception("Not enough product space. Please upgrade your plan")
+
+    shop_products = fetch_combo_shop_products(shop, [combo['combo_products'] for combo in combos])
+    built_combos = [build_combo(shop, shop_products, **combo) for combo in combos]
+
+    with transaction.atomic():
+        Combo.objects.bulk_create([combo for combo, combo_product_list in built_combos])
+
+        all_combo_products = []
+        for combo, combo_product_list in built_combos:
+            for combo_product in combo_product_list:
+                combo_product.combo = combo
+            all_combo_products += combo_product_list
+
+        ComboProduct.objects.bulk_create(all_combo_products)
+        ComboSearchDoc.objects.refresh(Combo.objects.filter(id__in=[combo.id for combo, combo_product_list in built_combos]))
+
+    return [combo for combo, combo_product_list in built_combos]
+
+
 class CreateCombo(graphene.relay.ClientIDMutation):
     combo = graphene.Field(ComboNode)
 
@@ -459,76 +623,44 @@ class CreateCombo(graphene.relay.ClientIDMutation):
     @login_required
     @user_passes_test(lambda user: user.is_shop_owner)
     def mutate_and_get_payload(cls, root, info, **input):
-        combo_name = input.get('combo_name')
-        offered_price = input.get('offered_price')
-        description = input.get('description')
-        combo_products = input.get('combo_products')
-
-        # Structure of combo_products should be:-
-        # { relayShopProductId:{qty}, ddbuiyw87y7324:{qty:2}, adv872b0andia:{qty:1} }
-
-        if len(combo_products) > 1:
-            shop = info.context.user.shop
-
-            remaining_space = shop.remaining_space()
-
-            if remaining_space - SHOP_PRODUCT_VOLUME >= 0:
-                if shop.is_active:
-                    shop_products = shop.products
+        combo = {
+            'combo_name': input.get('combo_name'),
+            'offered_price': input.get('offered_price'),
+            'description': input.get('description'),
+            'combo_products': input.get('combo_products'),
+        }
 
-                    combo = Combo(shop=shop, offered_price=offered_price, name=combo_name,
-                                  description=description)
-                    combo.save()
+        return cls(create_combos(info.context.user.shop, [combo])[0])
 
-                    combo_product_list = []
-                    thumbs = []
 
-                    # Total cost is the cost when all the items in a combo are bought at mrp
-                    combo_total_cost = 0
+class CreateCombos(graphene.relay.ClientIDMutation):
+    combos = graphene.List(ComboNode)
 
-                    for shop_product_relay_id, combo_product in combo_products.items():
-                        shop_product_id = from_global_id(shop_product_relay_id)[1]
-                        quantity = combo_product['quantity']
-                        try:
-                            shop_product = shop_products.get(id=shop_product_id)
-                            
-                            thumb_src = shop_product.product.get_thumb().name
-                            thumb_overlay_text = shop_product.product.thumb_overlay_text
-                            thumb = {
-                            "src": thumb_src,
-                            "overlayText": thumb_overlay_text,
-                            "quantity": quantity
-                            }
-                            thumbs.append(thumb)
-                            combo_product = ComboProduct(combo=combo, shop_product=shop_product, quantity=quantity)
-                            combo_product_list.append(combo_product)
-
-                            combo_total_cost += shop_product.product.mrp * quantity if shop_product.product.mrp else shop_product.offered_price * quantity
-
-                        except ShopProduct.DoesNotExist:
-                            combo.delete()
-                            raise Exception(
-                                'No shop product exist with that id. Make sure that the product is added to you shop first')
-                        
-                        except Exception as e:
-                            combo.delete()
-                            raise Exception(e)
-
-                    ComboProduct.objects.bulk_create(combo_product_list)
-                    combo.thumbs = dumps(thumbs)
-                    combo.total_cost = combo_total_cost
-                    combo.save()
-
-                    return cls(combo)
+    class Input:
+        # Each item has the same structure as CreateCombo input:-
+        # { comboName, offeredPrice, description, comboProducts }
+        combos = graphene.List(graphene.JSONString, required=True)
 
-                else:
-                    raise Exception("No active plan")
+    @classmethod
+    @login_required
+    @user_passes_test(lambda user: user.is_shop_owner)
+    def mutate_and_get_payload(cls, root, info, **input):
+        combos = []
+        for combo in input.get('combos'):
+            try:
+                combos.append({
+                    'combo_name': combo['comboName'],
+                    'offered_price': combo['offeredPrice'],
+                    'description': combo['description'],
+                    'combo_products': combo['comboProducts'],
+                })
+            except KeyError as e:
+                raise Exception(f'{e.args[0]} is required for every combo')
 
-            else:
-                raise Exception("Not enough product space. Please upgrade your plan")
+        if len(combos) == 0:
+            raise Exception("No combos to create")
 
-        else:
-            raise Exception("Two or more products are required for making a combo.")
+        return cls(create_combos(info.context.user.shop, combos))
 
 
 class EditCombo(graphene.relay.ClientIDMutation):
@@ -664,15 +796,11 @@ class AdminAddShopVerifyEmail(graphene.relay.ClientIDMutation):
 
             mail_subject = 'Raspaai: Verify Your Email For Shop Registration'
             message = f'Hi {email}. Welcome to raspaai.'
-            html_message = render_to_string('email_verification_template.html',
-                                            {'key_code': key_code, 'email': email, 'front_end': FRONT_END})
+            OutboundEmail.objects.enqueue(mail_subject, message, [email],
+                                          html_template='email_verification_template.html',
+                                          context={'key_code': key_code, 'email': email, 'front_end': FRONT_END})
 
-            email_resp = send_mail(mail_subject, message, None,
-                                   recipient_list=[email], html_message=html_message)
-            if email_resp == 1:
-                return cls(jwt_encoded_str=jwt_encoded_str)
-            else:
-                raise Exception('Email could not be sent please try again.')
+            return cls(jwt_encoded_str=jwt_encoded_str)
 
         except User.DoesNotExist:
             raise Exception('No user with this email')
@@ -735,7 +863,7 @@ class AdminAddShop(graphene.relay.ClientIDMutation):
 
                 try:
                     PlanQueue.objects.add_plan_to_queue(plan_id=plan_id, shop=shop)
-                    shop.hero_image.save(hero_img_file.name, hero_img_file, save=False)
+                    save_image(shop.hero_image, hero_img_file, save=False)
                     shop.save()
                     shop.warm_image()
                     user.is_shop_owner = True
@@ -807,13 +935,13 @@ class ShopRegistrationApplication(graphene.relay.ClientIDMutation):
             shop = Shop(username=username, website=website, address=address, contact_number=contact_number,
                         public_username=public_username.replace(' ', ''), owner=user, title=shop_name)
             shop.full_clean(exclude=['hero_image', 'location'])
-            shop.hero_image.save(hero_img_file.name, hero_img_file, save=False)
+            save_image(shop.hero_image, hero_img_file, save=False)
             try:
                 shop.save()
                 shop.warm_image()
             
             except Exception as e:
-                shop.hero_image.delete(save=False)
+                shop.delete_hero_image()
                 raise Exception(e)
                 
             try:
@@ -1135,6 +1263,7 @@ class Mutation(graphene.ObjectType):
     shop_registration_application = ShopRegistrationApplication.Field()
     review_shop_application = ReviewShopApplication.Field()
     modify_shop_product = ModifyShopProduct.Field()
+    bulk_update_shop_products = BulkUpdateShopProducts.Field()
     admin_add_shop_verify_email = AdminAddShopVerifyEmail.Field()
     admin_add_shop = AdminAddShop.Field()
     admin_get_shop_info = AdminGetShopInfo.Field()
@@ -1145,6 +1274,7 @@ class Mutation(graphene.ObjectType):
     modify_shop_return_refund_policy = ModifyShopReturnRefundPolicy.Field()
     add_shop_product = AddShopProduct.Field()
     create_combo = CreateCombo.Field()
+    create_combos = CreateCombos.Field()
     delete_combo = DeleteCombo.Field()
     edit_combo = EditCombo.Field()
     modify_shop = ModifyShop.Field()
@@ -1160,7 +1290,8 @@ class Query(graphene.ObjectType):
                                                    lng=graphene.Float())
     combo_search = graphene.relay.ConnectionField(ComboNodeConnections, lat=graphene.Float(required=True),
                                                   lng=graphene.Float(required=True), phrase=graphene.String(required=True),
-                                                  range_in_km=graphene.Int(), shop_name=graphene.String())
+                                                  range_in_km=graphene.Int(), shop_name=graphene.String(),
+                                                  sort=SearchSortEnum())
     shop_combos = graphene.relay.ConnectionField(ComboNodeConnections, public_shop_username=graphene.String(),
                                                  phrase=graphene.String())
     shops = DjangoFilterConnectionField(ShopNode)
@@ -1173,7 +1304,11 @@ class Query(graphene.ObjectType):
                                                              phrase=graphene.String(), product_type=graphene.String())
     product_search = graphene.relay.ConnectionField(ShopProductNodeConnections, lat=graphene.Float(required=True),
                                                     lng=graphene.Float(required=True), phrase=graphene.String(required=True),
-                                                    range_in_km=graphene.Int(), shop_name=graphene.String())
+                                                    range_in_km=graphene.Int(), shop_name=graphene.String(),
+                                                    sort=SearchSortEnum())
+    search_suggestions = graphene.List(graphene.String, prefix=graphene.String(required=True),
+                                       lat=graphene.Float(required=True), lng=graphene.Float(required=True),
+                                       limit=graphene.Int())
 
     available_plans = DjangoFilterConnectionField(ShopPlanNode, filterset_class=ShopPlanFilter)
     shop_application = graphene.relay.Node.Field(ShopApplicationNode)
@@ -1204,22 +1339,20 @@ class Query(graphene.ObjectType):
         return shop_plans
 
     def resolve_nearby_shop_products(self, info, **kwargs):
-        lat = kwargs.get('lat')
-        lng = kwargs.get('lng')
-        ref_location = Point(lng, lat, srid=4326)
-        nearby_shop_products = ShopProduct.objects.filter(shop__location__dwithin=(ref_location, D(km=5)),
-                                                          shop__is_active=True)
+        coords = {
+            'lat': kwargs.get('lat'),
+            'lng': kwargs.get('lng')
+        }
 
-        return nearby_shop_products
+        return nearby_shop_products(coords)
 
     def resolve_nearby_combos(self, info, **kwargs):
-        lat = kwargs.get('lat')
-        lng = kwargs.get('lng')
-        ref_location = Point(lng, lat, srid=4326)
+        coords = {
+            'lat': kwargs.get('lat'),
+            'lng': kwargs.get('lng')
+        }
 
-        nearby_combos = Combo.objects.filter(shop__location__dwithin=(ref_location, D(km=5)),
-                                             shop__is_active=True)
-        return nearby_combos
+        return nearby_combos(coords)
 
     def resolve_shop_combos(self, info, **kwargs):
         phrase = kwargs.get('phrase')
@@ -1270,42 +1403,50 @@ class Query(graphene.ObjectType):
             return products_in_shop
 
     def resolve_combo_search(self, info, **kwargs):
-        lat = kwargs.get('lat')
-        lng = kwargs.get('lng')
         phrase = kwargs.get('phrase')
         shop_name = kwargs.get('shop_name')
-        shop_name = kwargs.get('shop_name')
-        matching_shops = None
-        if shop_name and len(shop_name) > 3:
-            shop_name_sim = TrigramSimilarity("title", shop_name)
-            matching_shops = Shop.objects.annotate(name_sim=shop_name_sim).filter(name_sim__gt=0.3)
-        
         range_in_km = kwargs.get('range_in_km')
         coords = {
-            'lat': lat,
-            'lng': lng
+            'lat': kwargs.get('lat'),
+            'lng': kwargs.get('lng')
         }
 
-        return combos_search(phrase=phrase, coords=coords, shops=matching_shops)
+        started_at = time.monotonic()
+        matching_shops = None
+        if shop_name and len(shop_name) > 3:
+            matching_shops = nearby_shops_named(shop_name, coords, range_in_km)
+
+        # The connection reads every result anyway, evaluating here gives the count and latency to log
+        search_result = list(get_search_backend().search_combos(phrase, coords, range_in_km, shops=matching_shops,
+                                                                sort=kwargs.get('sort') or SearchSort.PRICE))
+        log_search(SearchQueryLog.COMBOS, phrase, coords, len(search_result), started_at)
+        return search_result
 
     def resolve_product_search(self, info, **kwargs):
-        lat = kwargs.get('lat')
-        lng = kwargs.get('lng')
         phrase = kwargs.get('phrase')
         shop_name = kwargs.get('shop_name')
-        matching_shops = None
-        if shop_name and len(shop_name) > 3:
-            shop_name_sim = TrigramSimilarity("title", shop_name)
-            matching_shops = Shop.objects.annotate(name_sim=shop_name_sim).filter(name_sim__gt=0.3)
-        
         range_in_km = kwargs.get('range_in_km')
         coords = {
-            'lat': lat,
-            'lng': lng
+            'lat': kwargs.get('lat'),
+            'lng': kwargs.get('lng')
         }
-        search_result = shop_product_search(phrase, coords, range_in_km, shops=matching_shops)
+
+        started_at = time.monotonic()
+        matching_shops = None
+        if shop_name and len(shop_name) > 3:
+            matching_shops = nearby_shops_named(shop_name, coords, range_in_km)
+
+        search_result = list(get_search_backend().search_shop_products(phrase, coords, range_in_km,
+                                                                       shops=matching_shops,
+                                                                       sort=kwargs.get('sort') or SearchSort.PRICE))
+        log_search(SearchQueryLog.PRODUCTS, phrase, coords, len(search_result), started_at)
         return search_result
 
+    def resolve_search_suggestions(self, info, prefix, lat, lng, limit=8):
+        # limit may be sent as null or out of 1..MAX_SUGGESTIONS
+        limit = max(1, min(limit or 8, MAX_SUGGESTIONS))
+        return search_suggestions(prefix, {'lat': lat, 'lng': lng}, limit=limit)
+
     shop = graphene.relay.node.Field(ShopNode, public_shop_username=graphene.String())
     # admin_shops = graphene.relay.ConnectionField(ShopNodeConnections, category=graphene.String(),
                                                  # shop_username=graphene.String(), search_by_username=graphene.Boolean(),
@@ -1 +1,104 @@
+import io
 
+from django.contrib.auth import authenticate
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from graphql_jwt.exceptions import JSONWebTokenError
+
+from .catalog import CATALOG_FORMATS, read_catalog_rows, import_catalog, update_catalog, export_catalog
+
+CATALOG_CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+
+def get_shop_owner(request):
+    # Same JWT as the graphql endpoint, sent as "Authorization: JWT <token>"
+    try:
+        user = authenticate(request=request)
+    except JSONWebTokenError:
+        user = None
+
+    if user is None or not user.is_shop_owner:
+        return None
+
+    return user
+
+
+@csrf_exempt
+@require_POST
+def import_shop_catalog(request):
+    user = get_shop_owner(request)
+    if user is None:
+        return JsonResponse({'error': 'Permission denied'}, status=401)
+
+    catalog_file = request.FILES.get('file')
+    if catalog_file is None:
+        return JsonResponse({'error': 'A catalog file is required'}, status=400)
+
+    catalog_format = request.POST.get('format') or catalog_file.name.rsplit('.', 1)[-1].lower()
+    if catalog_format not in CATALOG_FORMATS:
+        return JsonResponse({'error': f'Catalog format should be one of {", ".join(CATALOG_FORMATS)}'}, status=400)
+
+    # The upload is decoded and parsed line by line, it is never read into memory as a whole
+    lines = io.TextIOWrapper(catalog_file.file, encoding='utf-8-sig', newline='')
+
+    try:
+        result = import_catalog(user.shop, read_catalog_rows(lines, catalog_format))
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    return JsonResponse({
+        'created': result['created'],
+        'errors': [{'row': row_number, 'error': error} for row_number, error in result['errors']],
+    })
+
+
+@csrf_exempt
+@require_POST
+def update_shop_catalog(request):
+    # Same file format as the export, rows change offered_price and in_stock of products already in the shop
+    user = get_shop_owner(request)
+    if user is None:
+        return JsonResponse({'error': 'Permission denied'}, status=401)
+
+    if not user.shop.is_active:
+        return JsonResponse({'error': 'No active shop plan'}, status=400)
+
+    catalog_file = request.FILES.get('file')
+    if catalog_file is None:
+        return JsonResponse({'error': 'A catalog file is required'}, status=400)
+
+    catalog_format = request.POST.get('format') or catalog_file.name.rsplit('.', 1)[-1].lower()
+    if catalog_format not in CATALOG_FORMATS:
+        return JsonResponse({'error': f'Catalog format should be one of {", ".join(CATALOG_FORMATS)}'}, status=400)
+
+    lines = io.TextIOWrapper(catalog_file.file, encoding='utf-8-sig', newline='')
+
+    try:
+        result = update_catalog(user.shop, read_catalog_rows(lines, catalog_format))
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    return JsonResponse({
+        'updated': result['updated'],
+        'errors': [{'row': row_number, 'error': error} for row_number, error in result['errors']],
+    })
+
+
+@require_GET
+def export_shop_catalog(request):
+    user = get_shop_owner(request)
+    if user is None:
+        return JsonResponse({'error': 'Permission denied'}, status=401)
+
+    catalog_format = request.GET.get('format', 'csv')
+    if catalog_format not in CATALOG_FORMATS:
+        return JsonResponse({'error': f'Catalog format should be one of {", ".join(CATALOG_FORMATS)}'}, status=400)
+
+    response = StreamingHttpResponse(export_catalog(user.shop, catalog_format),
+                                     content_type=CATALOG_CONTENT_TYPES[catalog_format])
+    response['Content-Disposition'] = f'attachment; filename="{user.shop.public_username}-catalog.{catalog_format}"'
+    return response
@@ -0,0 +1,84 @@
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils.timezone import now
+from storages.backends.s3boto3 import S3Boto3Storage
+
+from .models import StorageDeletion, DeletionStatus
+
+# Most keys a single S3 DeleteObjects request takes
+MAX_KEYS_PER_REQUEST = 1000
+MAX_ATTEMPTS = 6
+# Seconds before the first retry, doubled for every further attempt
+RETRY_BACKOFF = 60
+
+
+def delete_keys(keys, storage=default_storage):
+    """
+    Deletes storage keys, with one DeleteObjects request per MAX_KEYS_PER_REQUEST keys on S3 and one
+    delete per key on any other storage. Keys already gone count as deleted.
+    Returns {key: error} of the keys that could not be deleted.
+    """
+    errors = {}
+    if not isinstance(storage, S3Boto3Storage):
+        for key in keys:
+            try:
+                storage.delete(key)
+            except Exception as e:
+                errors[key] = str(e)
+        return errors
+
+    client = storage.bucket.meta.client
+    for start in range(0, len(keys), MAX_KEYS_PER_REQUEST):
+        chunk = keys[start:start + MAX_KEYS_PER_REQUEST]
+        # Bucket keys carry the storage location in front of the names
+        names = {storage._normalize_name(storage._clean_name(key)): key for key in chunk}
+        try:
+            response = client.delete_objects(Bucket=storage.bucket_name, Delete={
+                'Objects': [{'Key': name} for name in names],
+                'Quiet': True,
+            })
+        except Exception as e:
+            errors.update({key: str(e) for key in chunk})
+            continue
+
+        # Quiet mode only reports the keys that failed
+        for error in response.get('Errors', []):
+            key = names.get(error.get('Key'))
+            if key is not None:
+                errors[key] = f'{error.get("Code")}: {error.get("Message")}'
+
+    return errors
+
+
+def delete_batch(batch_size=MAX_KEYS_PER_REQUEST, storage=default_storage):
+    # Returns the number of queued keys claimed. Batches are claimed with SKIP LOCKED, so several
+    # workers never pick up the same keys.
+    with transaction.atomic():
+        batch = list(StorageDeletion.objects.select_for_update(skip_locked=True)
+                     .filter(status=DeletionStatus.PENDING, next_attempt_at__lte=now())
+                     .order_by('next_attempt_at')[:batch_size])
+        if not batch:
+            return 0
+
+        errors = delete_keys(list({deletion.key for deletion in batch}), storage)
+
+        failed = []
+        for deletion in batch:
+            if deletion.key not in errors:
+                continue
+            deletion.attempts += 1
+            deletion.last_error = errors[deletion.key]
+            if deletion.attempts >= MAX_ATTEMPTS:
+                deletion.status = DeletionStatus.FAILED
+            else:
+                delay = RETRY_BACKOFF * 2 ** (deletion.attempts - 1)
+                deletion.next_attempt_at = now() + timedelta(seconds=delay)
+            failed.append(deletion)
+
+        deleted_ids = [deletion.id for deletion in batch if deletion.key not in errors]
+        StorageDeletion.objects.filter(id__in=deleted_ids).delete()
+        StorageDeletion.objects.bulk_update(failed, ['status', 'attempts', 'next_attempt_at', 'last_error'])
+
+    return len(batch)
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from storagequeue.deleter import delete_batch, MAX_KEYS_PER_REQUEST
+
+
+class Command(BaseCommand):
+    help = 'Delete the queued storage keys of deleted images, up to 1000 keys per S3 request'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=MAX_KEYS_PER_REQUEST,
+                            help='Keys claimed per transaction')
+        parser.add_argument('--run-for', type=int, default=0,
+                            help='Keep polling for new keys for this many seconds, by default delete what is '
+                                 'queued and exit')
+        parser.add_argument('--interval', type=float, default=5, help='Seconds between polls when idle')
+
+    def handle(self, *args, **options):
+        stop_at = time.monotonic() + options['run_for']
+        processed = 0
+
+        while True:
+            claimed = delete_batch(options['batch_size'])
+            processed += claimed
+            if claimed:
+                continue
+            if time.monotonic() + options['interval'] >= stop_at:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write(f'Processed {processed} queued storage keys')
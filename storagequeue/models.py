@@ -0,0 +1,70 @@
+from django.db import models
+from django.utils.timezone import now
+from versatileimagefield.utils import get_rendition_key_set
+
+from images.models import ImageBlob, Rendition, StoredImage
+
+
+class DeletionStatus:
+    PENDING = 'pending'
+    FAILED = 'failed'
+
+    CHOICES = [
+        (PENDING, 'Pending'),
+        (FAILED, 'Failed'),
+    ]
+
+
+def image_storage_keys(image, rendition_key_set=None):
+    # Storage names of an image and of its renditions in the manifest. Names of the rendition_key_set
+    # renditions are derived from the image name as well, which covers renditions created before the
+    # manifest. Nothing is read from storage.
+    if not image:
+        return []
+
+    keys = [image.name]
+    keys += Rendition.objects.filter(source=image.name).values_list('path', flat=True)
+    if rendition_key_set:
+        for key, size_key in get_rendition_key_set(rendition_key_set):
+            if size_key == 'url':
+                continue
+            method, size = size_key.split('__')
+            keys.append(getattr(image, method)[size].name)
+    return list(dict.fromkeys(keys))
+
+
+class StorageDeletionManager(models.Manager):
+    def enqueue(self, keys):
+        self.bulk_create([self.model(key=key) for key in keys if key])
+
+    def enqueue_image(self, image, rendition_key_set=None):
+        # Written in the transaction deleting the row, so a rolled back delete keeps its files. An image
+        # other fields still refer to, see images.dedup, only loses a reference.
+        if image and not ImageBlob.objects.release(image.name):
+            return
+        self.enqueue(image_storage_keys(image, rendition_key_set))
+        if image:
+            Rendition.objects.filter(source=image.name).delete()
+            StoredImage.objects.filter(name=image.name).delete()
+
+
+class StorageDeletion(models.Model):
+    # Storage keys waiting to be removed by the deletequeuedfiles command, see storagequeue.deleter.
+    # Rows are removed once their key is deleted.
+    key = models.CharField(max_length=255)
+    status = models.CharField(max_length=10, choices=DeletionStatus.CHOICES, default=DeletionStatus.PENDING)
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=now)
+    last_error = models.TextField(null=True, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    objects = StorageDeletionManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['next_attempt_at'], name='storagedeletion_pending',
+                         condition=models.Q(status=DeletionStatus.PENDING)),
+        ]
+
+    def __str__(self):
+        return self.key
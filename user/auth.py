@@ -0,0 +1,112 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from django.contrib.auth import get_user_model
+from graphql_jwt.backends import JSONWebTokenBackend
+from graphql_jwt.exceptions import JSONWebTokenError
+from graphql_jwt.settings import jwt_settings
+from graphql_jwt.utils import get_payload, get_credentials, get_http_authorization
+
+User = get_user_model()
+
+# Verified tokens kept per worker process
+MAX_CACHED_TOKENS = 10000
+
+# token: (user id, unix time the token expires at)
+_verified_tokens = OrderedDict()
+_verified_tokens_lock = Lock()
+
+
+def cached_user_id(token):
+    with _verified_tokens_lock:
+        cached = _verified_tokens.get(token)
+        if cached is None:
+            return None
+
+        user_id, expires_at = cached
+        if expires_at <= time.time():
+            del _verified_tokens[token]
+            return None
+
+        _verified_tokens.move_to_end(token)
+        return user_id
+
+
+def cache_user_id(token, user_id, payload):
+    # A token is kept until it expires, never longer than JWT_EXPIRATION_DELTA
+    expires_at = time.time() + jwt_settings.JWT_EXPIRATION_DELTA.total_seconds()
+    if isinstance(payload.get('exp'), (int, float)):
+        expires_at = min(expires_at, payload['exp'])
+
+    with _verified_tokens_lock:
+        _verified_tokens[token] = (user_id, expires_at)
+        _verified_tokens.move_to_end(token)
+        while len(_verified_tokens) > MAX_CACHED_TOKENS:
+            _verified_tokens.popitem(last=False)
+
+
+def get_user_by_token(token, context=None):
+    """
+    Same as graphql_jwt.shortcuts.get_user_by_token, but the signature of a token is only verified the
+    first time it is seen by the process. After that it is looked up by user id. The user comes with
+    its shop and brand, which the shop owner and brand owner checks read.
+    Raises JSONWebTokenError for invalid or expired tokens and disabled users.
+    """
+    users = User.objects.select_related('shop', 'brand')
+
+    user_id = cached_user_id(token)
+    if user_id is not None:
+        user = users.filter(pk=user_id).first()
+    else:
+        payload = get_payload(token, context)
+        username = jwt_settings.JWT_PAYLOAD_GET_USERNAME_HANDLER(payload)
+        if not username:
+            raise JSONWebTokenError('Invalid payload')
+
+        user = users.filter(**{User.USERNAME_FIELD: username}).first()
+        if user is not None:
+            cache_user_id(token, user.pk, payload)
+
+    if user is not None and not user.is_active:
+        raise JSONWebTokenError('User is disabled')
+    return user
+
+
+class CachedJSONWebTokenBackend(JSONWebTokenBackend):
+    # Drop in for graphql_jwt.backends.JSONWebTokenBackend using the verified token cache
+
+    def authenticate(self, request=None, **kwargs):
+        if request is None or getattr(request, '_jwt_token_auth', False):
+            return None
+
+        token = get_credentials(request, **kwargs)
+        if token is not None:
+            return get_user_by_token(token, request)
+
+        return None
+
+
+class JSONWebTokenRequestMiddleware:
+    """
+    Authenticates the JWT of the Authorization header once per HTTP request, so the graphene
+    JSONWebTokenMiddleware finds request.user set and does not authenticate again for every field.
+    Invalid tokens are left to the graphene middleware, which reports them as it always did.
+    Goes after django.contrib.auth.middleware.AuthenticationMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = get_http_authorization(request)
+        if token is not None:
+            try:
+                user = get_user_by_token(token, request)
+            except JSONWebTokenError:
+                user = None
+
+            if user is not None:
+                request.user = user
+
+        return self.get_response(request)
@@ -8,13 +8,12 @@ import graphql_jwt
 import jwt
 from django.contrib.auth import get_user_model, logout
 from django.contrib.auth.password_validation import validate_password
-from django.core.mail import send_mail
-from django.template.loader import render_to_string
 from graphene_django.filter import DjangoFilterConnectionField
 from graphene_django.types import DjangoObjectType
 from graphql_jwt.decorators import login_required, superuser_required
 from graphql_relay import from_global_id
 
+from mailqueue.models import OutboundEmail
 from product.models import MeasurementUnit
 from shop.models import ShopProduct, Combo
 from .models import UserSavedLocation, CartItem, UserSavedAddress, CartLine
@@ -308,17 +307,10 @@ class ForgotPasswordEmailVerification(graphene.relay.ClientIDMutation):
 
             mail_subject = "Raspaai | Password reset confirmation."
             message = f'Hi {email}. Here is your key for password reset.'
-            html_message = render_to_string('password_reset_template.html',
-                                            {'key_code': key_code, 'email': email,
-                                             'front_end': FRONT_END})
+            OutboundEmail.objects.enqueue(mail_subject, message, [email], html_template='password_reset_template.html',
+                                          context={'key_code': key_code, 'email': email, 'front_end': FRONT_END})
 
-            email_resp = send_mail(mail_subject, message, None,
-                                   recipient_list=[email], html_message=html_message)
-
-            if email_resp == 1:
-                return cls(jwt_encoded_str=jwt_encoded_str)
-            else:
-                raise Exception('Email could not be sent. Please try again in a moment')
+            return cls(jwt_encoded_str=jwt_encoded_str)
 
         except User.DoesNotExist:
             raise Exception("No registered user found with this email. Check your email again or sign up")
@@ -368,18 +360,12 @@ class SignupEmailVerification(graphene.relay.ClientIDMutation):
             # Email sending
             mail_subject = 'Raspaai: Verify Your Email'
             message = f'Hi {email}. You are receiving this email because you applied for signup at Raspaai'
-            html_message = render_to_string('email_verification_template.html',
-                                            {'key_code': key_code, 'email': email,
-                                             'front_end': FRONT_END})
+            OutboundEmail.objects.enqueue(mail_subject, message, [email],
+                                          html_template='email_verification_template.html',
+                                          context={'key_code': key_code, 'email': email, 'front_end': FRONT_END})
 
-            email_resp = send_mail(mail_subject, message, None,
-                                   recipient_list=[email], html_message=html_message)
-
-            if email_resp == 1:
-                return cls(email_resp=f'email sent successfully to {email}.',
-                           jwt_encoded_str=jwt_encoded_str)
-            else:
-                raise Exception('Email could not be sent please try again.')
+            return cls(email_resp=f'A verification email will be sent to {email} shortly.',
+                       jwt_encoded_str=jwt_encoded_str)
 
 
 class CreateUser(graphene.relay.ClientIDMutation):